@@ -1,4 +1,13 @@
 from patchwork import config
-from patchwork import routines
-from patchwork import app
-from patchwork import widgets
\ No newline at end of file
+
+# The GUI modules need DearPyGui, so they're only imported when first used.
+# Headless entry points like the CLI never pay for them.
+_gui_modules = ("routines", "app", "widgets")
+
+
+def __getattr__(name):
+    if name in _gui_modules:
+        import importlib
+
+        return importlib.import_module(f"patchwork.{name}")
+    raise AttributeError(f"module 'patchwork' has no attribute '{name}'")
@@ -1,31 +1,29 @@
 
-import copy
 import logging
 from pathlib import Path
-from pydavinci import davinci
-from pydavinci.wrappers.marker import Marker, MarkerCollection
-from pydavinci.wrappers.timeline import Timeline
-from timecode import Timecode
-from rich.logging import RichHandler
 import webbrowser
 import json
 from json import JSONDecodeError
 import os
-from deepdiff import DeepDiff
+import time
 import trio
 import dearpygui.dearpygui as dpg
 
 from patchwork.config import default_configuration as defaults
 from patchwork.config import defaults_filepath
+from patchwork import async_helpers
+from patchwork import jobs
+from patchwork import journal
+from patchwork import pipeline
+from patchwork.marker_index import MarkerIndex, PATCHWORK_MARKER, DETECTED_MARKER
+from patchwork import snapshot
+from patchwork import tracing
+from patchwork.snapshot import Snapshot
+from patchwork.poller import Poller, latest
+from patchwork.pacing import FramePacer
+from patchwork.monitor import JobMonitor, WatchedJob
 from click import launch
 
-# Logging
-logging.basicConfig(
-    level="NOTSET",
-    format="%(message)s",
-    datefmt="[%X]",
-    handlers=[RichHandler(rich_tracebacks=True, markup=True)],
-)
 logger = logging.getLogger("rich")
 logger.setLevel("INFO")
 
@@ -40,10 +38,8 @@ patchwork_file = None
 window_width = 600
 window_height = 400
 
-#############################################################################
-# ALL DPG CALLS MUST BE MADE AFTER 'dpg.create_context()!
-dpg.create_context()
-#############################################################################
+# Render presets per project, from the last session, so the GUI needn't wait on Resolve for them
+render_preset_cache = {}
 
 
 #############################################################################
@@ -56,8 +52,7 @@ def select_patchfile_callback(sender, _, app_data:dict):
     global chosen_filepath
     
     logger.debug('[magenta]OK was clicked.')
-    print("Sender: ", sender)
-    print("App Data: ", app_data)
+    logger.debug(f"[magenta]Sender: {sender}, App Data: {app_data}")
     
     if not app_data["selections"]:
         dialog_box.prompt("No selection was made!")
@@ -65,23 +60,24 @@ def select_patchfile_callback(sender, _, app_data:dict):
     
     chosen_filepath = app_data['file_path_name']
     
-    with open(chosen_filepath, "r") as patchfile:
-        patchfile_data = json.load(patchfile)
+    try:
+        patchfile_data = patchfile.load(chosen_filepath)
+    except journal.JournalError as e:
+        dialog_box.prompt(f"Couldn't read the patch file:\n{e}")
+        return
 
     dpg.configure_item("render_preset", enabled=False)        
     dpg.configure_item("source_status", color=[100, 255, 100])
     dpg.set_value("source_status", f"Linked: '{os.path.basename(chosen_filepath).split('.patch')[0]}'")
     
 def cancel_patchfile_callback(sender, _, app_data):
-    print('Cancel was clicked.')
-    print("Sender: ", sender)
-    print("App Data: ", app_data)       
+    logger.debug('[magenta]Cancel was clicked.')
+    logger.debug(f"[magenta]Sender: {sender}, App Data: {app_data}")       
 
 def select_render_dir_callback(sender:str, _, app_data:dict):
     
-    print('OK was clicked.')
-    print("Sender: ", sender)
-    print("App Data: ", app_data)
+    logger.debug('[magenta]OK was clicked.')
+    logger.debug(f"[magenta]Sender: {sender}, App Data: {app_data}")
     
     chosen_dirpath = app_data['file_path_name']
     determined_filename = f"{resolve.project.name} - {resolve.active_timeline.name}"
@@ -94,16 +90,15 @@ def select_render_dir_callback(sender:str, _, app_data:dict):
     dpg.set_value("source_status", f"Rendering \"{determined_filename}\"")
     
 def cancel_render_dir_callback(sender, _, app_data):
-    print('Cancel was clicked.')
-    print("Sender: ", sender)
-    print("App Data: ", app_data)
+    logger.debug('[magenta]Cancel was clicked.')
+    logger.debug(f"[magenta]Sender: {sender}, App Data: {app_data}")
 
 def app_exit_callback():
     
     global config_file
     logger.info("[magenta]Writing viewport config to file")
     with open(config_file, "w") as json_file:
-        json_file.write(json.dumps(get_current_viewport_config()))
+        json_file.write(json.dumps({**get_current_viewport_config(), "render_presets": render_preset_cache}))
 
 #############################################################################
 
@@ -118,34 +113,30 @@ def get_current_viewport_config() -> dict:
         }
     }
 
-def set_viewport_config() -> bool:
+def load_config_file() -> dict:
+    """Read the app's config file. No DearPyGui calls, so it can run in a worker thread."""
     
     logger.debug("[magenta]Loading viewport configuration")
     
     global config_file
-    if not os.path.exists(config_file):
-        logger.warning("[yellow]Config file does not exist")
-        return False
+    try:
+        with open(config_file, "r") as json_file: 
+            return json.loads(json_file.read())
         
-    with open(config_file, "r") as json_file: 
-        
-        try:
-            json_data = json_file.read()
-            config_data = json.loads(json_data)
-            
-        except FileNotFoundError:
-            logger.warning("[yellow]Config file does not exist")
-            return False
-        
-        except JSONDecodeError:
-            logger.warning("[red]Config file contains malformed JSON!")
-            return False
+    except FileNotFoundError:
+        logger.warning("[yellow]Config file does not exist")
         
-        viewport_config = config_data.get("viewport")
-        if not viewport_config:
-            logger.warning("[yellow]Config file contained no viewport configuration")
-            return False
+    except JSONDecodeError:
+        logger.warning("[red]Config file contains malformed JSON!")
+    
+    return {}
+
+def set_viewport_config(config_data:dict) -> bool:
     
+    viewport_config = config_data.get("viewport")
+    if not viewport_config:
+        logger.warning("[yellow]Config file contained no viewport configuration")
+        return False
     
     global window_width
     global window_height
@@ -167,26 +158,7 @@ def should_refresh_now():
 def get_next_free_marker_num():
     """Get the next marker number in the series"""
     
-    def get_marker_num(marker: Marker) -> int:
-        """
-        Parses ordinal number from marker name
-        
-        Returns zero if none
-        """
-        try:
-            return int(marker.name[-1])
-        except TypeError:
-            return 0
-    
-    timeline = resolve.active_timeline
-    markers = timeline.markers.find_all("patchwork_marker")
-    
-    if not markers:
-        return 1
-    
-    last_num = int(sorted([get_marker_num(x) for x in markers])[-1])
-    next_num = last_num + 1
-    return str(next_num)
+    return str(markers.next_change_number())
 
 def toggle_always_on_top():
     
@@ -202,45 +174,38 @@ def create_marker():
     
     timeline = resolve.active_timeline
     framerate = resolve.active_timeline.settings.frame_rate
-    patchwork_markers:list[Marker]|None = timeline.markers.find_all("patchwork_marker")
+    markers.reconcile(timeline)
     
-    min_duration = int(framerate) * 2
+    try:
+        min_duration = pipeline.get_change_duration(patchwork_file, framerate)
+    except pipeline.PipelineError:
+        min_duration = int(framerate) * 2
+    from timecode import Timecode
     tc = Timecode(framerate=framerate, start_timecode=timeline.timecode)
-    print(f"Timecode: {timeline.timecode} Frames: {tc.frames} Framerate: {framerate}")
+    logger.debug(f"[magenta]Timecode: {timeline.timecode} Frames: {tc.frames} Framerate: {framerate}")
 
     assert tc.frames is not None
-    new_marker_frame_id = tc.frames -1
     new_marker_start = tc.frames -1
     new_marker_end = new_marker_start + min_duration
     
+    logger.debug(f"[magenta]Attempt marker @ {new_marker_start} -> {new_marker_end}")
+    
     # Check if any patchwork markers overlap
-    if patchwork_markers:
-        for x in patchwork_markers:
-            
-            existing_marker_start = x.frameid
-            existing_marker_end = x.frameid + x.duration
-            
-            logger.debug(f"[magenta]Attempt marker @ {new_marker_start} -> {new_marker_end}")
-            
-            # Check overlap between new marker and existing marker ranges
-            nm_range = range(new_marker_start, new_marker_end)
-            em_range = range(existing_marker_start, existing_marker_end)
-            overlap = bool(range(max(nm_range[0], em_range[0]), min(nm_range[-1], em_range[-1])+1))
-            
-            if overlap:
-                dialog_box.prompt(
-                    "Whoops, sorry. Changes can't overlap!\n"
-                    f"A change added here would overlap with '{x.name}'"
-                )
-                return None
+    overlapping = [x for x in markers.overlapping(new_marker_start, new_marker_end) if x.is_change]
+    if overlapping:
+        dialog_box.prompt(
+            "Whoops, sorry. Changes can't overlap!\n"
+            f"A change added here would overlap with '{overlapping[0].name}'"
+        )
+        return None
             
-    if not resolve.active_timeline.markers.add(
+    if not markers.add(
+        timeline,
         new_marker_start,
-
         "Purple", 
+        f"Change - {get_next_free_marker_num()}", 
         duration=min_duration, 
-        name=f"Change - {get_next_free_marker_num()}", 
-        customdata="patchwork_marker"
+        customdata=PATCHWORK_MARKER,
     ):
         dialog_box.prompt("Sorry, Resolve says no. Maybe there's already a marker there?")
         return
@@ -248,18 +213,16 @@ def create_marker():
 def set_marker_note(note:str):
     timeline = resolve.active_timeline
     framerate = resolve.active_timeline.settings.frame_rate
-    patchwork_markers = timeline.markers.find_all("patchwork_marker")
     
-    print(note)
+    logger.debug(f"[magenta]Setting note: '{note}'")
     
+    from timecode import Timecode
     tc = Timecode(framerate=framerate, start_timecode=timeline.timecode)
     
-    assert patchwork_markers
-    for marker in patchwork_markers:
-        if tc.frames in range(marker.frameid, marker.frameid+marker.duration):
+    for marker in markers.at(tc.frames - 1):
+        if marker.is_change:
             logger.info(f"[cyan]Added note: '{note}'")
-            marker.note = note
-            return True
+            return bool(markers.set_note(timeline, marker, note))
         
     logger.warning("[yellow]Couldn't set marker description.")
     return False
@@ -272,12 +235,14 @@ def clear_markers():
     
     global force_refresh
     
-    patchwork_markers = resolve.active_timeline.markers.find_all("patchwork_marker")
+    timeline = resolve.active_timeline
+    markers.reconcile(timeline)
+    patchwork_markers = markers.changes
     
     if not patchwork_markers:
         return False
     
-    [x.delete() for x in patchwork_markers]
+    [markers.delete(timeline, x) for x in patchwork_markers]
     return True
 
 
@@ -306,8 +271,9 @@ def open_defaults_configuration():
 def add_change():
     
     def change_note_callback():
+        note = dpg.get_value("marker_note")
         dpg.delete_item("change_note_popup")
-        set_marker_note()
+        set_marker_note(note)
         
 
     global refresh_now
@@ -319,6 +285,113 @@ def add_change():
 
     refresh_now = True
     
+def mark_detected_changes(detected:list[tuple[int, int]]):
+    """Add a patchwork marker for each detected range that isn't already marked"""
+    
+    global refresh_now
+    
+    if not detected:
+        dialog_box.prompt("No changes detected since the master was rendered.")
+        return
+    
+    timeline = resolve.active_timeline
+    markers.reconcile(timeline)
+    
+    added = 0
+    for start, end in detected:
+        
+        # Leave hand-placed changes alone
+        if any(x.is_change for x in markers.overlapping(start, end)):
+            logger.debug(f"[magenta]Skipping detected change {start} -> {end}, already marked")
+            continue
+        
+        if markers.add(
+            timeline,
+            start,
+            "Purple",
+            f"Change - {get_next_free_marker_num()}",
+            duration=end - start,
+            customdata=DETECTED_MARKER,
+        ):
+            added += 1
+    
+    logger.info(f"[cyan]Detected {len(detected)} changes, marked {added}")
+    refresh_now = True
+
+def detect_changes():
+    
+    global patchwork_file
+    
+    if not patchwork_file:
+        dialog_box.prompt("Link a patch file first, so there's something to compare against.")
+        return
+    
+    mark_detected_changes(patchfile.detect_changes(patchfile.load(patchwork_file)))
+
+def detect_pixel_changes():
+    
+    global patchwork_file
+    
+    from patchwork import phash
+    
+    if not patchwork_file:
+        dialog_box.prompt("Link a patch file first, so there's something to compare against.")
+        return
+    
+    if monitor.is_watching("fingerprint"):
+        dialog_box.prompt("Hang on, a fingerprint render is already running.")
+        return
+    
+    pixel_fingerprint = patchfile.load(patchwork_file).get("pixel_fingerprint", {})
+    try:
+        baseline = phash.get_baseline(patchwork_file, pixel_fingerprint.get("proxy"))
+    except phash.PixelHashError as e:
+        dialog_box.prompt(f"Couldn't hash the master's fingerprint render:\n{e}")
+        return
+    
+    if baseline is None:
+        dialog_box.prompt(
+            "The master's fingerprint render hasn't been rendered yet.\n"
+            "Render it from Resolve's render queue alongside the master."
+        )
+        return
+    
+    project = resolve.project
+    job_id, proxy = phash.queue_fingerprint_render(
+        project,
+        os.path.dirname(os.path.abspath(patchwork_file)),
+        f"{os.path.splitext(os.path.basename(patchwork_file))[0]} - fingerprint current",
+    )
+    jobs.start_render(project, [job_id])
+    
+    timeline = resolve.active_timeline
+    frames = timeline._obj.GetEndFrame() - timeline._obj.GetStartFrame()
+    monitor.watch(
+        "fingerprint",
+        [WatchedJob(job_id, frames)],
+        on_finished=lambda group: compare_pixel_fingerprint(group, proxy, baseline),
+    )
+    logger.info("[cyan]Rendering fingerprint of the current timeline...")
+
+async def compare_pixel_fingerprint(group, proxy:str, baseline):
+    """Compare the current fingerprint render against the master's once Resolve finishes it"""
+    
+    from patchwork import phash
+    
+    if not group.succeeded:
+        dialog_box.prompt(f"Fingerprint render didn't finish: {group.jobs[0].status}")
+        return
+    
+    # Decoding the render takes a while, keep it off the GUI's thread
+    try:
+        current = await trio.to_thread.run_sync(phash.hash_video, proxy)
+    except phash.PixelHashError as e:
+        dialog_box.prompt(f"Couldn't hash the fingerprint render:\n{e}")
+        return
+    
+    os.remove(proxy)
+    mark_detected_changes(phash.compare(baseline, current))
+    
 def clear_changes():
     
     global refresh_now
@@ -336,63 +409,162 @@ def render_changes():
     global patchwork_file
     assert patchwork_file
     
-    project = resolve.project
-    timeline = resolve.active_timeline
-    markers = resolve.active_timeline.markers
-    patchwork_markers = [x for x in markers if x.customdata == "patchwork_marker"]
+    chosen_render_preset = dpg.get_value("render_preset")
+    try:
+        planned = pipeline.plan(resolve, patchwork_file, chosen_render_preset, markers, segment_cache)
+        segments = pipeline.submit(resolve, patchwork_file, planned, chosen_render_preset)
+    except pipeline.PipelineError as e:
+        dialog_box.prompt(str(e))
+        return
     
-    patch_data = patchfile.load(patchwork_file)
-    print(patch_data)
+    rendering = [x for x in segments if not x.get("cached")]
+    if not rendering:
+        splice_changes()
+        return
     
-    if not patch_data['project_name'] == project.name:
-        dialog_box.prompt(
-            "The active project doesn't match the linked patch file\n"
-            "Please load the correct file or change project."
-        )
+    # Splice as soon as the last change renders
+    monitor.watch(
+        "changes",
+        [WatchedJob(x["job_id"], x["end"] - x["start"], x["path"]) for x in rendering],
+        on_job_finished=log_finished_job,
+        on_finished=splice_rendered_changes,
+    )
+
+async def splice_rendered_changes(group):
+    """Splice and verify the changes once they've all rendered"""
+    
+    if not group.succeeded:
+        dialog_box.prompt("Some changes didn't render. Render them again to splice.")
         return
     
-    if not patch_data['timeline_name'] == timeline.name:
-        dialog_box.prompt(
-            "The active timeline doesn't match the linked patch file\n"
-            "Please load the correct file or change timeline."
-        )
+    logger.info("[magenta]Starting splice routine")
+    
+    # Splicing runs ffmpeg and copies segments into the history, and verifying decodes
+    # around every cut. Only those go to a worker thread, Resolve and the GUI stay here.
+    frame_rate = resolve.active_timeline.settings.frame_rate
+    try:
+        output = await trio.to_thread.run_sync(pipeline.splice_rendered, patchwork_file, frame_rate, segment_cache)
+    except pipeline.PipelineError as e:
+        dialog_box.prompt(str(e))
         return
-        
-    if not patch_data.get('render_preset'):
+    
+    problems = await trio.to_thread.run_sync(pipeline.verify, patchwork_file)
+    report_splice(output, problems)
+
+def log_finished_job(job):
+    
+    if job.status == jobs.COMPLETE:
+        logger.info(f"[green]Rendered '{job.label}'")
+    else:
+        logger.warning(f"[yellow]Render of '{job.label}' didn't finish: {job.status}")
+
+def splice_changes():
+    
+    logger.info("[magenta]Starting splice routine")
+    
+    global patchwork_file
+    assert patchwork_file
+    
+    try:
+        output = pipeline.splice_changes(resolve, patchwork_file, segment_cache)
+    except pipeline.PipelineError as e:
+        dialog_box.prompt(str(e))
+        return
+    
+    report_splice(output, pipeline.verify(patchwork_file))
+
+def report_splice(output:str, problems:list[str]):
+    
+    if problems:
         dialog_box.prompt(
-            "Render preset has not been defined within the patchfile!"
+            f"Patched master written to:\n'{output}'\n\nBut it didn't verify:\n" + "\n".join(problems)
         )
         return
+    
+    dialog_box.prompt(f"Done! Verified patched master written to:\n'{output}'")
+
+def check_changes():
+    
+    logger.info("[magenta]Starting QC routine")
+    
+    global patchwork_file
+    global refresh_now
+    assert patchwork_file
+    
+    try:
+        found = pipeline.check_changes(patchwork_file)
+    except pipeline.PipelineError as e:
+        dialog_box.prompt(str(e))
+        return
+    
+    if not found:
+        dialog_box.prompt("No black, green, frozen or offline frames in the rendered changes.")
+        return
+    
+    from patchwork.defects import WARNING_KINDS
+    
+    added = pipeline.mark_defects(resolve, found, markers)
+    refresh_now = True
+    frozen = len([x for x in found if x.kind in WARNING_KINDS])
+    dialog_box.prompt(
+        f"Found {len(found)} defects in the rendered changes, {frozen} of them frozen frames that may be intended.\n"
+        f"Marked {added} of them in red on the timeline."
+    )
         
-    # COMPARE
-    current_settings = patchfile.get_current_settings()
-    patchfile.compare(current_settings, patchwork_file)
-    
-    # Choose render preset
-    chosen_render_preset = dpg.get_value("chosen_render_preset")
-    if not chosen_render_preset:
-        dialog_box.prompt("No render preset chosen.\nPlease choose one before continuing.")
-    
-    job_ids = []
-    for x in patchwork_markers:
-        resolve.project.load_render_preset(chosen_render_preset)
-        project.set_render_settings(
-            {
-                "MarkIn": x.frameid,
-                "MarkOut": x.frameid + x.duration,
-                "CustomName": f"{project.name} {timeline.name} {x.name}"
-            }
-        )
-        job_id = project.add_renderjob()
-        job_ids.append(job_id)
-        print(job_ids)
+def render_master():
+    
+    logger.info("[magenta]Starting master render routine")
+    
+    global patchwork_file
+    assert patchwork_file
+    
+    chosen_render_preset = dpg.get_value("render_preset")
+    nodes = defaults["render"].get("remote_nodes", 1)
+    try:
+        pipeline.new(resolve, patchwork_file, chosen_render_preset)
+        segments = pipeline.queue_master(resolve, patchwork_file, chosen_render_preset, nodes)
+    except pipeline.PipelineError as e:
+        dialog_box.prompt(str(e))
+        return
+    
+    watched = [WatchedJob(x["job_id"], x["end"] - x["start"], x["path"]) for x in segments]
+    if nodes <= 1:
+        monitor.watch("master", watched, on_job_finished=log_finished_job)
+        return
+    
+    monitor.watch(
+        "master",
+        watched,
+        on_job_finished=log_finished_job,
+        on_finished=lambda group: join_master_segments(group, segments),
+    )
+    dialog_box.prompt(
+        f"Queued the master as {len(segments)} segments.\n"
+        "Start the render queue on your render nodes. They'll be joined once they're all done."
+    )
+
+async def join_master_segments(group, segments:list[dict]):
+    """Join the distributed master once every segment has rendered"""
+    
+    if not group.succeeded:
+        dialog_box.prompt("Some master segments didn't render. Re-queue the master to try again.")
+        return
+    
+    # Joining copies the whole master, keep it off the GUI's thread
+    try:
+        await trio.to_thread.run_sync(pipeline.join_master, patchwork_file, segments)
+    except pipeline.PipelineError as e:
+        dialog_box.prompt(str(e))
         
 def open_documentation():
     webbrowser.open_new_tab("https://github.com/in03/patchwork")
 
-def init():
+async def init():
     
-    print("Running")
+    #############################################################################
+    # ALL DPG CALLS MUST BE MADE AFTER 'dpg.create_context()!
+    dpg.create_context()
+    #############################################################################
     
     dpg.set_global_font_scale(1.2)
     dpg.configure_app(init_file=os.path.join(root_folder, "dpg.ini"))
@@ -411,12 +583,29 @@ def init():
     dpg.set_viewport_always_top(True)
     dpg.setup_dearpygui()
     
-    # TODO: Potentially make this async for faster start up?
-    # Would need all of init to be async though...
-    # Whilst awaiting viewport config json to load, set everything else up
-    # Then once loaded, show the viewport?
-    set_viewport_config()
-    dpg.show_viewport()
+    # Connecting to Resolve is the slow part, show the viewport meanwhile
+    connection = {}
+    async def connect():
+        from pydavinci import davinci
+        connection["resolve"] = await trio.to_thread.run_sync(davinci.Resolve)
+    
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(connect)
+        
+        config_data = await trio.to_thread.run_sync(load_config_file)
+        render_preset_cache.update(config_data.get("render_presets", {}))
+        set_viewport_config(config_data)
+        dpg.show_viewport()
+    
+    init_state(connection["resolve"])
+
+def init_state(resolve_instance=None):
+    """
+    Connect to Resolve and set up app state.
+    
+    Args:
+        resolve_instance: Resolve to use instead of connecting, e.g. a fake for benchmarks
+    """
 
     # These will silently crash dpg if instantiated earlier
     global routines
@@ -434,7 +623,11 @@ def init():
 
     # Resolve init
     global resolve
-    resolve = davinci.Resolve()
+    if resolve_instance is None:
+        from pydavinci import davinci
+        resolve_instance = davinci.Resolve()
+    resolve = tracing.trace_resolve(resolve_instance)
+    patchfile.connect(resolve)
     
     global project
     project = resolve.project
@@ -448,26 +641,35 @@ def init():
     force_refresh = False
     
     global markers
-    markers = resolve.active_timeline.markers   
-
-    global current_frame_rate
-    current_frame_rate = copy.copy(resolve.active_timeline.settings.frame_rate)
+    markers = MarkerIndex()
+    
+    global segment_cache
+    segment_cache = pipeline.get_segment_cache()
+    markers.reconcile(resolve.active_timeline)
 
-    global current_timecode
-    current_timecode = copy.copy(resolve.active_timeline.timecode)
+    # Start from nothing, so the first poll updates every widget
+    global last_snapshot
+    last_snapshot = snapshot.CLOSED
     
     global refresh_now
     refresh_now = False
     
+    
     # Item enabled flags
     global render_preset_chosen
     render_preset_chosen = False    
 
-    # Timers
-    global half_a_second
-    global five_seconds
-    half_a_second = routines.Timer(0.5)
-    five_seconds = routines.Timer(5)
+    global pacer
+    pacer = FramePacer(
+        target_fps=defaults["app"].get("target_fps", 60),
+        idle_fps=defaults["app"].get("idle_fps", 4),
+    )
+    
+    global poller
+    poller = Poller(resolve, interval=0.5, on_publish=pacer.wake)
+    
+    global monitor
+    monitor = JobMonitor(resolve, interval=1, on_update=show_render_progress)
 
 def setup_gui():
     
@@ -479,6 +681,13 @@ def setup_gui():
             dpg.add_theme_color(dpg.mvThemeCol_Text, (122, 122, 122))
         dpg.bind_theme("main_theme")
         
+    # Any input keeps the GUI at full frame rate
+    with dpg.handler_registry(tag="activity_handlers"):
+        dpg.add_mouse_move_handler(callback=lambda: pacer.mark_active())
+        dpg.add_mouse_click_handler(callback=lambda: pacer.mark_active())
+        dpg.add_mouse_wheel_handler(callback=lambda: pacer.mark_active())
+        dpg.add_key_press_handler(callback=lambda: pacer.mark_active())
+        
     with dpg.window(label="main_window", tag="main_window", autosize=True):
         dpg.set_primary_window("main_window", True)
 
@@ -560,10 +769,16 @@ def setup_gui():
                     with dpg.group(horizontal=True):
                         
                         dpg.add_button(label="Add", tag="add_button", callback=add_change)
+                        dpg.add_button(label="Detect", tag="detect_button", callback=detect_changes)
+                        dpg.add_button(label="Detect Pixels", tag="detect_pixels_button", callback=detect_pixel_changes)
                         dpg.add_button(label="Clear All", tag="clear_changes_button", callback=clear_changes)
                         dpg.add_button(label="Render", tag="render_button", callback=render_changes)
+                        dpg.add_button(label="Splice", tag="splice_button", callback=splice_changes)
+                        dpg.add_button(label="Check", tag="check_button", callback=check_changes)
                         
                     dpg.add_separator()
+                    dpg.add_progress_bar(tag="render_progress_bar", width=-1, show=False)
+                    dpg.add_text("", tag="render_progress_text")
                 
                 # SOURCE PAGE
                 with dpg.tab(label="Source"):
@@ -576,77 +791,91 @@ def setup_gui():
                     with dpg.group(tag="source_buttons", horizontal=True):
                         dpg.add_button(label="Link", tag="link_browse_button", callback=lambda: dpg.show_item("track_file_dialog"))
                         dpg.add_button(label="New", tag="render_browse_button", callback=lambda: dpg.show_item("render_file_dialog"))
+                        dpg.add_button(label="Render Master", tag="render_master_button", callback=render_master)
                     dpg.add_separator()
-                    dpg.add_combo(items=resolve.project.render_presets, default_value=defaults['render']['render_preset'], tag="render_preset", enabled=False)
+                    dpg.add_combo(items=render_preset_cache.get(project.name, []), default_value=defaults['render']['render_preset'], tag="render_preset", enabled=False)
     
                     
-async def resolve_is_ready():
-    routines.get_environment_state()
+def show_render_progress():
+    """Show progress of watched render jobs in the Changes tab"""
+    
+    groups = list(monitor.groups.values())
+    dpg.configure_item("render_progress_bar", show=bool(groups))
+    if groups:
+        frames = sum(x.frames for x in groups)
+        dpg.set_value("render_progress_bar", sum(x.frames_done for x in groups) / frames)
+    dpg.set_value("render_progress_text", "\n".join(monitor.summaries()))
+    pacer.wake()
+
+@async_helpers.cache(ttl=300, tags=lambda project_name: [f"project:{project_name}"])
+async def get_render_presets(project_name:str) -> list[str]:
+    """Resolve's render presets for the open project, kept until it changes or they're five minutes old"""
+    return await trio.to_thread.run_sync(lambda: resolve.project.render_presets, cancellable=True)
+
+async def refresh_render_presets():
+    """Replace the cached render presets with Resolve's, without holding up startup"""
+    
+    project_name = project.name
+    presets = await get_render_presets(project_name)
+    render_preset_cache[project_name] = presets
+    dpg.configure_item("render_preset", items=presets)
+
+async def resolve_is_ready(current:Snapshot, changed:set[str]) -> bool:
+    
+    # Only touch the dialog when readiness changes, not every poll
+    if not changed & {"resolve_is_open", "project_name", "timeline_name"}:
+        await trio.sleep(0)
+        return current.timeline_is_open
+    
+    routines.get_environment_state(current)
     
-    if dpg.get_value("resolve_is_open") == False:
+    if not current.resolve_is_open:
         dialog_box.prompt("Resolve is not running! Waiting...", no_close=True)
         await trio.sleep(0)
         return False
 
-    if dpg.get_value("project_is_open") == False:
+    if not current.project_is_open:
         dialog_box.prompt("No project is open! Waiting...", no_close=True)
         await trio.sleep(0)
         return False
             
-    if dpg.get_value("timeline_is_open") == False:
+    if not current.timeline_is_open:
         dialog_box.prompt("No timeline is open! Waiting...", no_close=True)
         await trio.sleep(0)
         return False
+    
+    if dpg.does_item_exist("dialog"):
+        dpg.delete_item("dialog")
         
     await trio.sleep(0)
     return True
 
-async def gui_render():
-            
-    dpg.render_dearpygui_frame()
-    logger.debug(f"[magenta]{dpg.get_frame_count()}")
+async def apply_snapshot(current:Snapshot):
+    """Update app state and widgets from whatever changed since the last snapshot"""
     
-    global refresh_now
-    if half_a_second.has_passed or refresh_now:
-        refresh_now = False
+    global last_snapshot
+    
+    changed = snapshot.diff(last_snapshot, current)
+    last_snapshot = current
+    
+    if await resolve_is_ready(current, changed):
         
-        if resolve_is_ready:
+        # RUN ONLY IF PROJECT OR TIMELINE HAS CHANGED
+        if changed & {"project_name", "timeline_name"}:
+            
+            # SIMPLE
+            logger.debug("[magenta]Ensure custom timeline settings enabled")
+            await trio.to_thread.run_sync(lambda: resolve.active_timeline.custom_settings(True))
             
-            # RUN ONLY IF PROJECT OR TIMELINE HAS CHANGED
-            if dpg.get_value("environment_has_changed"):
+        if "markers" in changed:
+            markers.reconcile_raw(current.timeline_name, current.markers)
         
-                global current_frame_rate
-                current_frame_rate = copy.copy(resolve.active_timeline.settings.frame_rate)
-                
-                # SIMPLE
-                logger.debug("[magenta]Ensure custom timeline settings enabled")
-                resolve.active_timeline.custom_settings(True)
-                
-            # Direct API results only!!! Calculations should be performed as a routine with caching
-            # Copy to prevent each chained function from calling the API
-            global current_markers
-            current_markers = copy.copy(resolve.active_timeline.markers)
-            patchwork_markers = ([x for x in current_markers if x.customdata == "patchwork_marker"])
-
-            global patchwork_file
-            if patchwork_file:
-                dpg.configure_item("add_button")
-                
-            if not patchwork_markers:
-                dpg.configure_item("clear_changes_button")
-                dpg.configure_item("render_button")
-            else:
-                dpg.configure_item("clear_changes_button")
-                if patchwork_file:
-                    dpg.configure_item("render_button")
-                
-                        
-            global current_timecode
-            current_timecode = copy.copy(resolve.active_timeline.timecode)
+        if changed & {"frame_rate", "timecode", "markers"}:
             
             # Weird single frame offset
             global current_frame
-            current_frame = Timecode(current_frame_rate, current_timecode).frames
+            from timecode import Timecode
+            current_frame = Timecode(current.frame_rate, current.timecode).frames
             if current_frame:
                 current_frame -=1 
             else:
@@ -654,32 +883,68 @@ async def gui_render():
         
             # ROUTINES SHOULD ALL BE ASYNC
             logger.debug("[magenta]Running complex routines")
-            await routines.check_timecode_starts_at_zero(current_frame_rate, current_timecode)
-            await routines.refresh_add_status(current_markers, current_timecode, current_frame)
+            await routines.check_timecode_starts_at_zero(current.frame_rate, current.timecode)
+            await routines.refresh_add_status(markers, current.timecode, current_frame)
+
+async def gui_render(snapshots:trio.MemoryReceiveChannel):
             
+    dpg.render_dearpygui_frame()
+    
+    global refresh_now
+    if refresh_now:
+        refresh_now = False
+        pacer.mark_active()
+        poller.request_refresh()
+    
+    # Polled in the background, never wait on Resolve here
+    current = latest(snapshots)
+    if current is not None:
+        await apply_snapshot(current)
+    
     await trio.sleep(0)
 
 async def event_loop():
     
     # SETUP
     logger.debug("[magenta]Initialising...")
-    init()
+    started = time.perf_counter()
+    await init()
     setup_gui()
-    logger.debug("[magenta]Ready!")
+    logger.debug(f"[magenta]Ready in {time.perf_counter() - started:.2f}s!")
     
     # LOOP
     logger.debug("[magenta]Starting render cycle!")
 
     dpg.set_exit_callback(app_exit_callback)
-    while dpg.is_dearpygui_running():
-        async with trio.open_nursery() as nursery: 
-            nursery.start_soon(gui_render)
+    async with trio.open_nursery() as nursery:
+        
+        send_channel, receive_channel = trio.open_memory_channel(1)
+        nursery.start_soon(poller.run, send_channel)
+        nursery.start_soon(monitor.run)
+        nursery.start_soon(refresh_render_presets)
+        
+        while dpg.is_dearpygui_running():
+            await gui_render(receive_channel)
+            await pacer.wait_for_next_frame()
+            
+        nursery.cancel_scope.cancel()
     
     # EXIT
     logger.debug("[magenta]Exiting!")
     dpg.destroy_context()
     
 def main():
+    
+    # Rich is slow to import, so logging's only set up once the GUI's starting
+    from rich.logging import RichHandler
+    logging.basicConfig(
+        level="NOTSET",
+        format="%(message)s",
+        datefmt="[%X]",
+        handlers=[RichHandler(rich_tracebacks=True, markup=True)],
+    )
+    
+    tracing.configure()
     trio.run(event_loop)
     
 
@@ -1,20 +1,44 @@
-import threading
+"""
+Caching for trio coroutines.
+
+`cache` memoises an async function with a per-entry time to live, evicting the
+least recently used entries once their approximate size passes a budget. Tasks
+asking for a key that's already being computed wait for that result instead of
+computing it again. Entries can be tagged, e.g. with the timeline they were read
+from, and everything with a tag dropped at once when it goes stale.
+
+Caches aren't thread safe. Use them from the trio thread, and run blocking
+Resolve calls inside the cached function with `trio.to_thread`.
+"""
+
+import sys
 import weakref
-from collections import namedtuple
+from collections import OrderedDict
 from functools import update_wrapper
+from typing import NamedTuple
 
 import trio
 
-# Idea of using weakref, trio.Lock and thread-local storage is given by Nathaniel J. Smith <njs@pobox.com>
+from patchwork import tracing
 
+# Every cache, so a tag can be invalidated across all of them
+_caches = weakref.WeakSet()
 
-_CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
-threadLocal = threading.local()
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    invalidations: int
+    entries: int
+    size: int
+    max_size: int | None
 
 
 class _HashedSeq(list):
     """ This class guarantees that hash() will be called no more than once
-        per element.  This is important because the lru_cache() will hash
+        per element.  This is important because the cache will hash
         the key multiple times on a cache miss.
     """
 
@@ -63,174 +87,254 @@ def _make_key(
     return _HashedSeq(key)
 
 
-def lru_cache(maxsize=128, typed=False):
-    """Least-recently-used cache decorator.
-    If *maxsize* is set to None, the LRU features are disabled and the cache
-    can grow without bound.
-    If *typed* is True, arguments of different types will be cached separately.
-    For example, f(3.0) and f(3) will be treated as distinct calls with
-    distinct results.
-    Arguments to the cached function must be hashable.
-    View the cache statistics named tuple (hits, misses, maxsize, currsize)
-    with f.cache_info().  Clear the cache and statistics with f.cache_clear().
-    Access the underlying function with f.__wrapped__.
-    See:  http://en.wikipedia.org/wiki/Cache_replacement_policies#Least_recently_used_(LRU)
+def approximate_size(value, depth: int = 4) -> int:
     """
+    Bytes a value takes up, counting what it contains a few levels deep.
 
-    # Users should only access the lru_cache through its public API:
-    #       cache_info, cache_clear, and f.__wrapped__
-    # The internals of the lru_cache are encapsulated for thread safety and
-    # to allow the implementation to change (including a possible C version).
-
-    if isinstance(maxsize, int):
-        # Negative maxsize is treated as 0
-        if maxsize < 0:
-            maxsize = 0
-    elif callable(maxsize) and isinstance(typed, bool):
-        # The user_function was passed in directly via the maxsize argument
-        user_function, maxsize = maxsize, 128
-        wrapper = _lru_cache_wrapper(user_function, maxsize, typed, _CacheInfo)
-        return update_wrapper(wrapper, user_function)
-    elif maxsize is not None:
-        raise TypeError("Expected first argument to be an integer, a callable, or None")
+    Shared objects are counted once.
+    """
 
-    def decorating_function(user_function):
-        wrapper = _lru_cache_wrapper(user_function, maxsize, typed, _CacheInfo)
-        return update_wrapper(wrapper, user_function)
+    seen = set()
 
-    return decorating_function
+    def size(value, depth):
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
 
+        total = sys.getsizeof(value)
+        if depth and isinstance(value, dict):
+            total += sum(size(k, depth - 1) + size(v, depth - 1) for k, v in value.items())
+        elif depth and isinstance(value, (list, tuple, set, frozenset)):
+            total += sum(size(x, depth - 1) for x in value)
+        elif depth and hasattr(value, "__dict__"):
+            total += size(vars(value), depth - 1)
+        return total
 
-def _lru_cache_wrapper(user_function, maxsize, typed, _CacheInfo):
-    # Constants shared by all lru cache instances:
-    sentinel = object()  # unique object used to signal cache misses
-    make_key = _make_key  # build a key from the function arguments
-    PREV, NEXT, KEY, RESULT = 0, 1, 2, 3  # names for the link fields
-
-    cache = {}
-    hits = misses = 0
-    full = False
-    cache_get = cache.get  # bound method to lookup a key or return None
-    cache_len = cache.__len__  # get cache size without calling len()
-    # Trick: this contains a lock for each unique cache key in use,
-    # that we use to make sure we don't have multiple tasks trying
-    # to rebuild the same cache key at once. Since it's a WeakValueDictionary,
-    # unused keys are automatically evicted by the GC.
-    locks = getattr(threadLocal, "locks", weakref.WeakValueDictionary())
-    cache_lock = threading.RLock()  # because linkedlist updates aren't threadsafe
-    root = []  # root of the circular doubly linked list
-    root[:] = [root, root, None, None]  # initialize by pointing to self
-
-    if maxsize == 0:
+    return size(value, depth)
 
-        async def wrapper(*args, **kwds):
-            # No caching -- just a statistics update
-            nonlocal misses
-            misses += 1
-            result = await user_function(*args, **kwds)
-            return result
 
-    elif maxsize is None:
+class _Entry(NamedTuple):
+    value: object
+    expires: float
+    size: int
+    tags: frozenset
 
-        async def wrapper(*args, **kwds):
-            # Simple caching without ordering or size limit
-            nonlocal hits, misses
-            key = make_key(args, kwds, typed)
-            result = cache_get(key, sentinel)
-            if result is not sentinel:
-                hits += 1
-                return result
-            lock = locks.setdefault(key, trio.Lock())
-            async with lock:
-                result = cache_get(key, sentinel)
-                if result is not sentinel:
-                    hits += 1
-                    return result
-                misses += 1
-                result = await user_function(*args, **kwds)
-                cache[key] = result
-                return result
-
-    else:
+
+class _Pending:
+    """A key being computed, for other tasks asking for it to wait on"""
+
+    __slots__ = ("finished", "value", "error", "done", "tags", "stale")
+
+    def __init__(self, tags: frozenset):
+        self.finished = trio.Event()
+        self.value = None
+        self.error = None
+        self.done = False
+        self.tags = tags
+        self.stale = False
+
+
+class AsyncCache:
+    """
+    A size bounded LRU cache with expiry and tags.
+
+    Args:
+        name (str): Name in exported stats
+        max_size (int, optional): Approximate bytes to hold, unbounded if None
+        max_entries (int, optional): Entries to hold, unbounded if None
+        ttl (float, optional): Seconds an entry stays fresh, forever if None
+    """
+
+    def __init__(self, name: str, max_size: int | None = None, max_entries: int | None = None, ttl: float | None = None):
+        self.name = name
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._size = 0
+        self._hits = self._misses = self._evictions = self._expirations = self._invalidations = 0
+        _caches.add(self)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        if entry.expires <= trio.current_time():
+            self._remove(key)
+            self._expirations += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+
+    def _count(self, outcome: str):
+        tracing.count("patchwork_cache_lookups", cache=self.name, outcome=outcome)
+
+    async def get(self, key, compute, ttl: float | None = None, tags=()):
+        """
+        A key's value, calling `compute()` for it if it's missing or expired.
+
+        Only one task computes a missing key, the rest wait for its result. If it
+        fails they raise its error too. If it's cancelled, one of them takes over.
+
+        Args:
+            compute: Async function of no arguments returning the value
+            ttl (float, optional): Seconds to keep this entry, the cache's ttl if not given
+            tags (iterable[str]): Tags to invalidate the entry by
+        """
+
+        while True:
+            entry = self._lookup(key)
+            if entry is not None:
+                self._hits += 1
+                self._count("hit")
+                return entry.value
+
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+
+            await pending.finished.wait()
+            if pending.error is not None:
+                raise pending.error
+            if pending.done:
+                self._hits += 1
+                self._count("hit")
+                return pending.value
+
+        self._misses += 1
+        self._count("miss")
+
+        pending = self._pending[key] = _Pending(frozenset(tags))
+        try:
+            value = await compute()
+        except Exception as e:
+            pending.error = e
+            raise
+        else:
+            pending.value = value
+            pending.done = True
+            if not pending.stale:
+                self._store(key, value, ttl, pending.tags)
+            return value
+        finally:
+            del self._pending[key]
+            pending.finished.set()
+
+    def _store(self, key, value, ttl: float | None, tags: frozenset):
+        ttl = self.ttl if ttl is None else ttl
+        expires = trio.current_time() + ttl if ttl is not None else float("inf")
+        size = approximate_size(value)
+
+        if self.max_size is not None and size > self.max_size:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, expires, size, tags)
+        self._size += size
+
+        while (self.max_size is not None and self._size > self.max_size) or (
+            self.max_entries is not None and len(self._entries) > self.max_entries
+        ):
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def invalidate(self, tag: str) -> int:
+        """
+        Drop every entry with a tag. Values being computed with it aren't stored.
+
+        Returns:
+            int: Entries dropped
+        """
+
+        stale = [key for key, entry in self._entries.items() if tag in entry.tags]
+        for key in stale:
+            self._remove(key)
+
+        for pending in self._pending.values():
+            if tag in pending.tags:
+                pending.stale = True
+
+        self._invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        """Drop every entry and reset the stats"""
+
+        self._entries.clear()
+        for pending in self._pending.values():
+            pending.stale = True
+        self._size = 0
+        self._hits = self._misses = self._evictions = self._expirations = self._invalidations = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(
+            self._hits,
+            self._misses,
+            self._evictions,
+            self._expirations,
+            self._invalidations,
+            len(self._entries),
+            self._size,
+            self.max_size,
+        )
+
+
+def invalidate(tag: str) -> int:
+    """
+    Drop everything with a tag from every cache, e.g. `timeline:<name>` when the timeline changes.
+
+    Returns:
+        int: Entries dropped
+    """
+
+    return sum(x.invalidate(tag) for x in list(_caches))
+
+
+def cache(max_size: int | None = 16 * 1024**2, max_entries: int | None = None, ttl: float | None = None, tags=None, typed: bool = False):
+    """
+    Cache an async function's results by its arguments.
+
+    Args:
+        max_size (int, optional): Approximate bytes of results to hold, unbounded if None
+        max_entries (int, optional): Results to hold, unbounded if None
+        ttl (float, optional): Seconds a result stays fresh, forever if None
+        tags (optional): Function of the same arguments returning tags for the result
+        typed (bool): Cache arguments of different types separately, e.g. 3 and 3.0
+
+    The cache is available as `f.cache`. `f.cache_info()` and `f.cache_clear()`
+    work as they do for `functools.lru_cache`.
+    """
+
+    def decorating_function(user_function):
+        results = AsyncCache(user_function.__qualname__, max_size, max_entries, ttl)
 
         async def wrapper(*args, **kwds):
-            # Size limited caching that tracks accesses by recency
-            nonlocal root, hits, misses, full
-            key = make_key(args, kwds, typed)
-            with cache_lock:
-                link = cache_get(key)
-                if link is None:
-                    lock = locks.setdefault(key, trio.Lock())
-                    async with lock:
-                        link = cache_get(key)
-                if link is not None:
-                    # Move the link to the front of the circular queue
-                    link_prev, link_next, _key, result = link
-                    link_prev[NEXT] = link_next
-                    link_next[PREV] = link_prev
-                    last = root[PREV]
-                    last[NEXT] = root[PREV] = link
-                    link[PREV] = last
-                    link[NEXT] = root
-                    hits += 1
-                    return result
-                misses += 1
-            lock = locks.setdefault(key, trio.Lock())
-            async with lock:
-                result = await user_function(*args, **kwds)
-            with cache_lock:
-                if key in cache:
-                    # Getting here means that this same key was added to the
-                    # cache while the lock was released.  Since the link
-                    # update is already done, we need only return the
-                    # computed result and update the count of misses.
-                    pass
-                elif full:
-                    # Use the old root to store the new key and result.
-                    oldroot = root
-                    oldroot[KEY] = key
-                    oldroot[RESULT] = result
-                    # Empty the oldest link and make it the new root.
-                    # Keep a reference to the old key and old result to
-                    # prevent their ref counts from going to zero during the
-                    # update. That will prevent potentially arbitrary object
-                    # clean-up code (i.e. __del__) from running while we're
-                    # still adjusting the links.
-                    root = oldroot[NEXT]
-                    oldkey = root[KEY]
-                    oldresult = root[RESULT]
-                    root[KEY] = root[RESULT] = None
-                    # Now update the cache dictionary.
-                    del cache[oldkey]
-                    # Save the potentially reentrant cache[key] assignment
-                    # for last, after the root and links have been put in
-                    # a consistent state.
-                    cache[key] = oldroot
-                else:
-                    # Put result in a new link at the front of the queue.
-                    last = root[PREV]
-                    link = [last, root, key, result]
-                    last[NEXT] = root[PREV] = cache[key] = link
-                    # Use the cache_len bound method instead of the len() function
-                    # which could potentially be wrapped in an lru_cache itself.
-                    full = cache_len() >= maxsize
-            return result
-
-    def cache_info():
-        """Report cache statistics"""
-        with cache_lock:
-            result = _CacheInfo(hits, misses, maxsize, cache_len())
-        return result
-
-    async def cache_clear():
-        """Clear the cache and cache statistics"""
-        nonlocal hits, misses, full
-        with cache_lock:
-            cache.clear()
-            root[:] = [root, root, None, None]
-            hits = misses = 0
-            full = False
-
-    wrapper.cache_info = cache_info
-    wrapper.cache_clear = cache_clear
-    return wrapper
\ No newline at end of file
+            return await results.get(
+                _make_key(args, kwds, typed),
+                lambda: user_function(*args, **kwds),
+                tags=tags(*args, **kwds) if tags else (),
+            )
+
+        wrapper.cache = results
+        wrapper.cache_info = results.info
+        wrapper.cache_clear = results.clear
+        return update_wrapper(wrapper, user_function)
+
+    return decorating_function
+
+
+def lru_cache(maxsize=128, typed=False):
+    """Least-recently-used cache of an async function's results, bounded by entries"""
+
+    if callable(maxsize):
+        return cache(max_size=None, max_entries=128, typed=typed)(maxsize)
+    return cache(max_size=None, max_entries=max(maxsize, 0) if maxsize is not None else None, typed=typed)
@@ -0,0 +1,266 @@
+"""
+Benchmarks of patchwork's hot paths against a fake Resolve.
+
+Run with `python -m patchwork.bench`. Results are written as JSON so runs can be
+compared over time. DearPyGui is needed for the GUI benchmarks, but no display is:
+widgets are created in a context that's never shown.
+"""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import click
+import trio
+
+from patchwork.fake_resolve import FakeResolve
+
+logger = logging.getLogger("rich")
+
+# Cold import budgets of each entry point in seconds, enforced by `--check-startup`
+STARTUP_BUDGETS = {"patchwork.cli": 0.5, "patchwork.app": 0.8}
+
+
+def summarise(timings: list[float], operations: int | None = None) -> dict:
+    """Summary statistics of a list of durations in seconds"""
+
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        "runs": len(timings),
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "max_ms": timings[-1] * 1000,
+        "ops_per_s": (operations or len(timings)) / total if total else None,
+    }
+
+
+def _setup_app(fake: FakeResolve):
+    """Import the app against a fake Resolve, with just the widgets the hot paths touch"""
+
+    from dearpygui import dearpygui as dpg
+    from patchwork import app
+
+    dpg.create_context()
+    with dpg.window(tag="bench_window", show=False):
+        dpg.add_text("", tag="current_timecode_display")
+        dpg.add_combo(items=["H.264 Master"], default_value="H.264 Master", tag="render_preset")
+
+    # Long fake timelines run past an hour, and there's no viewport for the dialog
+    with dpg.value_registry():
+        dpg.add_bool_value(tag="zero_timecode_warning_dismissed", default_value=True)
+
+    app.init_state(fake)
+    return app
+
+
+async def bench_gui_tick(app, fake: FakeResolve, ticks: int) -> dict:
+    """Snapshot and apply a playhead move, as the GUI does when Resolve's state changes"""
+
+    from patchwork import snapshot
+
+    timeline = fake.active_timeline
+    previous = snapshot.CLOSED
+    timings = []
+    for i in range(ticks):
+        timeline.playhead = (i * 37) % timeline.frames
+        start = time.perf_counter()
+        current = snapshot.take(fake, previous)
+        await app.apply_snapshot(current)
+        timings.append(time.perf_counter() - start)
+        previous = current
+
+    # The first tick builds everything from scratch
+    return {"first_tick_ms": timings[0] * 1000, **summarise(timings[1:])}
+
+
+async def bench_marker_lookup(app, fake: FakeResolve, lookups: int) -> dict:
+    from patchwork import routines
+
+    timeline = fake.active_timeline
+    app.markers.reconcile(timeline)
+    timings = []
+    for i in range(lookups):
+        frame = (i * 7919) % timeline.frames
+        start = time.perf_counter()
+        await routines.get_markers_at_playhead(app.markers, frame)
+        timings.append(time.perf_counter() - start)
+    return summarise(timings)
+
+
+def bench_marker_create(app, fake: FakeResolve, count: int, spacing: int) -> dict:
+    """Add changes in the gaps between existing ones, through the app's create path"""
+
+    timeline = fake.active_timeline
+    timings = []
+    for i in range(count):
+        timeline.playhead = i * spacing + spacing // 2
+        start = time.perf_counter()
+        app.create_marker()
+        timings.append(time.perf_counter() - start)
+    return summarise(timings)
+
+
+def bench_compare(app, runs: int) -> dict:
+    from patchwork import journal, patchfile
+
+    current_settings = patchfile.get_current_settings("H.264 Master")
+    with tempfile.NamedTemporaryFile("w", suffix=".patch", delete=False) as patch:
+        pass
+    journal.create(patch.name, {**current_settings, "settings_digests": patchfile.get_settings_digests(current_settings["settings"])})
+
+    timings = []
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            patchfile.compare(current_settings, patch.name)
+            timings.append(time.perf_counter() - start)
+    finally:
+        os.remove(patch.name)
+
+    return summarise(timings)
+
+
+def bench_fingerprint(fake: FakeResolve, runs: int) -> dict:
+    """Full timeline walks"""
+
+    from patchwork import fingerprint
+
+    timeline = fake.active_timeline
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fingerprint.fingerprint(timeline)
+        timings.append(time.perf_counter() - start)
+
+    return summarise(timings)
+
+
+def bench_render_submission(app, fake: FakeResolve, runs: int) -> dict:
+    from patchwork import journal, patchfile
+
+    changes = len(app.markers.changes)
+    with tempfile.TemporaryDirectory() as target_dir:
+        app.patchwork_file = os.path.join(target_dir, "bench.patch")
+        journal.create(app.patchwork_file, patchfile.get_current_settings("H.264 Master"))
+
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            app.render_changes()
+            timings.append(time.perf_counter() - start)
+
+    result = summarise(timings, operations=changes * runs)
+    result["jobs_per_run"] = changes
+    return result
+
+
+def bench_startup(runs: int = 3) -> dict:
+    """Import each entry point in a fresh interpreter, as a user's first launch would"""
+
+    results = {}
+    for module, budget in STARTUP_BUDGETS.items():
+        timings = []
+        for _ in range(runs):
+            code = (
+                "import sys, time; start = time.perf_counter(); "
+                f"import {module}; "
+                "print(time.perf_counter() - start, 'dearpygui' in sys.modules)"
+            )
+            output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+            seconds, gui_loaded = output.split()[-2:]
+            timings.append(float(seconds))
+
+        # The fastest run is the least disturbed by whatever else the machine is doing
+        results[module] = {
+            **summarise(timings),
+            "budget_ms": budget * 1000,
+            "within_budget": min(timings) <= budget,
+            "imports_dearpygui": gui_loaded == "True",
+        }
+    return results
+
+
+def run(markers: int, clips: int, settings: int, latency: float, ticks: int) -> dict:
+    """Run every benchmark, returning the results"""
+
+    spacing = 24 * 8
+    fake = FakeResolve(
+        latency=latency,
+        marker_count=markers,
+        clip_count=clips,
+        settings_count=settings,
+        frames=max(markers, 1) * spacing,
+    )
+
+    # Keep logs and prints out of the timings
+    logger.setLevel("ERROR")
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+
+        app = _setup_app(fake)
+
+        def timed(name, function, *args):
+            calls = fake.api.calls
+            results[name] = function(*args)
+            results[name]["api_calls"] = fake.api.calls - calls
+
+        timed("gui_tick", lambda: trio.run(bench_gui_tick, app, fake, ticks))
+        timed("marker_lookup", lambda: trio.run(bench_marker_lookup, app, fake, ticks * 10))
+        timed("marker_create", bench_marker_create, app, fake, min(markers, 1000) or 100, spacing)
+        timed("patchfile_compare", bench_compare, app, 20)
+        timed("timeline_fingerprint", bench_fingerprint, fake, 5)
+        timed("render_submission", bench_render_submission, app, fake, 3)
+
+    results["startup"] = bench_startup()
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"markers": markers, "clips": clips, "settings": settings, "latency_s": latency, "ticks": ticks},
+        "results": results,
+    }
+
+
+@click.command()
+@click.option("--output", "-o", type=click.Path(dir_okay=False), help="Write JSON results here instead of stdout")
+@click.option("--markers", default=10_000, show_default=True, help="Changes on the fake timeline")
+@click.option("--clips", default=5_000, show_default=True, help="Clips on the fake timeline")
+@click.option("--settings", default=2_000, show_default=True, help="Entries per settings section")
+@click.option("--latency", default=0.0, show_default=True, help="Seconds per fake API call")
+@click.option("--ticks", default=200, show_default=True, help="GUI ticks to measure")
+@click.option("--check-startup", is_flag=True, help="Only measure startup, failing if it's over budget or the CLI loads the GUI")
+def main(output, markers, clips, settings, latency, ticks, check_startup):
+    """Benchmark patchwork against a fake Resolve"""
+
+    if check_startup:
+        startup = bench_startup()
+        click.echo(json.dumps(startup, indent=2))
+        over_budget = [x for x, result in startup.items() if not result["within_budget"]]
+        if over_budget or startup["patchwork.cli"]["imports_dearpygui"]:
+            raise click.ClickException(f"Startup regressed: {', '.join(over_budget) or 'patchwork.cli imports dearpygui'}")
+        return
+
+    results = run(markers, clips, settings, latency, ticks)
+    text = json.dumps(results, indent=2)
+
+    if output:
+        with open(output, "w") as results_file:
+            results_file.write(text)
+    else:
+        click.echo(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Frame-exact verification of a patched master, decoding only around the splices.
+
+A stream-copied splice either reproduces the exact decoded frames of its source or
+it doesn't, and mistakes show up at the cuts: a dropped or doubled frame, or a
+segment a frame early or late. So only a few frames either side of each cut are
+decoded. Each frame's checksum in the patched master is compared against the frame
+it should have come from: the master outside a segment, the segment inside it.
+Segments are checked in parallel, one process each.
+"""
+
+import logging
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from typing import NamedTuple
+
+from patchwork.splice import Segment, parse_frame_rate
+
+logger = logging.getLogger("rich")
+
+# Frames decoded on each side of a cut
+WINDOW = 3
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class SegmentCheck(NamedTuple):
+    start: int
+    end: int
+    frames_checked: int
+    mismatched: list[int]
+    """Patched master frames that differ from their source"""
+
+    @property
+    def ok(self) -> bool:
+        return not self.mismatched
+
+
+def frame_checksums(path: str, first: int, count: int, frame_rate) -> list[str]:
+    """
+    MD5 of each decoded frame from `first`, up to `count` frames.
+
+    Fewer are returned if the file ends first.
+
+    Raises:
+        ChecksumError: If ffmpeg is missing or can't decode the file
+    """
+
+    if count <= 0 or first < 0:
+        return []
+
+    # Seek to half a frame early, so rounding can't skip the first frame
+    seconds = max(Fraction(0), (first - Fraction(1, 2)) / parse_frame_rate(frame_rate))
+    command = [
+        "ffmpeg",
+        "-v", "error",
+        "-ss", f"{float(seconds):.6f}",
+        "-i", path,
+        "-map", "0:v:0",
+        "-frames:v", str(count),
+        "-f", "framemd5",
+        "-",
+    ]
+
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except FileNotFoundError:
+        raise ChecksumError("ffmpeg not found. Is it installed and on your PATH?")
+
+    if result.returncode != 0:
+        raise ChecksumError(f"ffmpeg couldn't decode '{path}':\n{result.stderr.strip()}")
+
+    # Lines are 'stream, dts, pts, duration, size, hash', comments start with '#'
+    return [x.rsplit(",", 1)[-1].strip() for x in result.stdout.splitlines() if x and not x.startswith("#")]
+
+
+def _windows(segment: Segment) -> list[tuple[int, str, int]]:
+    """`(patched frame, source, source frame)` runs to compare, each `WINDOW` long"""
+
+    length = segment.end - segment.start
+    return [
+        (segment.start - WINDOW, "master", segment.start - WINDOW),
+        (segment.start, "segment", 0),
+        (segment.end - WINDOW, "segment", length - WINDOW),
+        (segment.end, "master", segment.end),
+    ]
+
+
+def check_segment(master: str, patched: str, segment: Segment, frame_rate) -> SegmentCheck:
+    """Compare the frames around both cuts of one segment"""
+
+    sources = {"master": master, "segment": segment.path}
+    checked = 0
+    mismatched = []
+
+    for patched_frame, source, source_frame in _windows(segment):
+
+        # Clip windows that run off the start of the file or outside the segment
+        offset = max(0, -patched_frame, -source_frame)
+        patched_frame += offset
+        source_frame += offset
+        count = WINDOW - offset
+        if source == "segment":
+            count = min(count, segment.end - segment.start - source_frame)
+
+        expected = frame_checksums(sources[source], source_frame, count, frame_rate)
+        actual = frame_checksums(patched, patched_frame, count, frame_rate)
+
+        checked += max(len(expected), len(actual))
+        for i in range(max(len(expected), len(actual))):
+            if i >= len(expected) or i >= len(actual) or expected[i] != actual[i]:
+                mismatched.append(patched_frame + i)
+
+    return SegmentCheck(segment.start, segment.end, checked, sorted(set(mismatched)))
+
+
+def verify(master: str, patched: str, segments: list[Segment], frame_rate, workers: int | None = None) -> list[SegmentCheck]:
+    """
+    Check every segment's cuts in a patched master, in parallel.
+
+    Raises:
+        ChecksumError: If any file can't be decoded
+    """
+
+    logger.info(f"[cyan]Verifying {len(segments)} splices of '{patched}'")
+
+    if len(segments) == 1:
+        return [check_segment(master, patched, segments[0], frame_rate)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(check_segment, master, patched, x, str(frame_rate)) for x in segments]
+        return [x.result() for x in futures]
@@ -0,0 +1,309 @@
+"""
+Command line entry point.
+
+Without a command, the GUI starts as before. The commands run the same patching
+steps headless, for render nodes and scheduled jobs. Nothing here imports
+DearPyGui, which is only loaded if the GUI is.
+"""
+
+import logging
+
+import click
+import trio
+from rich.logging import RichHandler
+
+from patchwork import jobs
+from patchwork import patchfile
+from patchwork import pipeline
+from patchwork import tracing
+from patchwork.config import default_configuration as defaults
+from patchwork.monitor import JobMonitor, WatchedJob
+
+logger = logging.getLogger("rich")
+
+patch_file_argument = click.argument("patch_file", type=click.Path(dir_okay=False))
+preset_option = click.option(
+    "--preset",
+    default=lambda: defaults["render"]["render_preset"],
+    show_default="from defaults.toml",
+    help="Render preset to render with",
+)
+wait_option = click.option("--wait", is_flag=True, help="Start rendering the queued jobs and wait for them to finish")
+
+
+def connect():
+    """Connect to Resolve for the patch file and pipeline steps"""
+
+    from pydavinci import davinci
+
+    try:
+        resolve = tracing.trace_resolve(davinci.Resolve())
+        resolve.project
+    except TypeError:
+        raise click.ClickException("Couldn't connect to Resolve. Is it running with scripting enabled?")
+
+    patchfile.connect(resolve)
+    return resolve
+
+
+def wait_for(resolve, name: str, segments: list[dict]):
+    """
+    Start rendering segments' jobs and wait until they finish, showing progress.
+
+    Returns:
+        JobGroup: The finished jobs
+    """
+
+    watched = [WatchedJob(x["job_id"], x["end"] - x["start"], x["path"]) for x in segments if x.get("job_id") and not x.get("cached")]
+    if not watched:
+        return None
+
+    jobs.start_render(resolve.project, [x.job_id for x in watched])
+
+    async def watch():
+        finished = trio.Event()
+        shown = None
+
+        def show_progress():
+            nonlocal shown
+            summaries = monitor.summaries()
+            if summaries and summaries != shown:
+                shown = summaries
+                click.echo(summaries[0])
+
+        monitor = JobMonitor(resolve, interval=2, on_update=show_progress)
+        group = monitor.watch(name, watched, on_finished=lambda _: finished.set())
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(monitor.run)
+            await finished.wait()
+            nursery.cancel_scope.cancel()
+        return group
+
+    with tracing.span("render_wait", renders=name, jobs=len(watched)):
+        group = trio.run(watch)
+    if not group.succeeded:
+        failed = [f"{x.label}: {x.status}" for x in group.jobs if x.status != jobs.COMPLETE]
+        raise click.ClickException("Some jobs didn't render:\n" + "\n".join(failed))
+    return group
+
+
+@click.group(invoke_without_command=True)
+@click.option("--loglevel", default="INFO", show_default=True, help="See Python's logging module for levels")
+@click.option("--trace/--no-trace", default=None, help="Time each stage and count Resolve calls. Defaults to [tracing] in defaults.toml.")
+@click.pass_context
+def main(ctx, loglevel, trace):
+    """Patchable renders, git style! Starts the GUI when run without a command."""
+
+    logging.basicConfig(
+        level="NOTSET",
+        format="%(message)s",
+        datefmt="[%X]",
+        handlers=[RichHandler(rich_tracebacks=True, markup=True)],
+    )
+    logger.setLevel(loglevel)
+    tracing.configure(trace)
+
+    if ctx.invoked_subcommand is None:
+        from patchwork import app
+
+        app.main()
+
+
+@main.command()
+@patch_file_argument
+@preset_option
+@click.option("--nodes", default=lambda: defaults["render"].get("remote_nodes", 1), type=int, help="Render nodes to split the master across")
+@wait_option
+def new(patch_file, preset, nodes, wait):
+    """Start a new patch file for the active timeline and queue its master"""
+
+    resolve = connect()
+    try:
+        pipeline.new(resolve, patch_file, preset)
+        segments = pipeline.queue_master(resolve, patch_file, preset, nodes)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(f"Queued the master as {len(segments)} job(s)")
+    if not wait:
+        return
+
+    wait_for(resolve, "master", segments)
+    if len(segments) > 1:
+        try:
+            master = pipeline.join_master(patch_file, segments)
+        except pipeline.PipelineError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Joined master: '{master}'")
+
+
+@main.command()
+@patch_file_argument
+@preset_option
+def plan(patch_file, preset):
+    """Show what rendering the current changes would queue and reuse"""
+
+    resolve = connect()
+    try:
+        planned = pipeline.plan(resolve, patch_file, preset, segment_cache=pipeline.get_segment_cache())
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+
+    for start, end, label, _, kind in planned.planned:
+        click.echo(f"queue  {start:>8}-{end:<8} {kind:<8} {label}")
+    for x in planned.reused:
+        source = "cache" if x.get("cached") else f"job {x['job_id']}"
+        click.echo(f"reuse  {x['start']:>8}-{x['end']:<8} {source}")
+    click.echo(f"{planned.changes} changes: {len(planned.planned)} jobs to queue, {len(planned.reused)} reused")
+
+
+@main.command()
+@patch_file_argument
+@preset_option
+@wait_option
+@click.option("--splice", "then_splice", is_flag=True, help="Splice once every change has rendered. Implies --wait.")
+def render(patch_file, preset, wait, then_splice):
+    """Queue renders of the current changes"""
+
+    resolve = connect()
+    segment_cache = pipeline.get_segment_cache()
+    try:
+        planned = pipeline.plan(resolve, patch_file, preset, segment_cache=segment_cache)
+        segments = pipeline.submit(resolve, patch_file, planned, preset)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(f"Queued {len(planned.planned)} jobs, reused {len(planned.reused)}")
+    if not (wait or then_splice):
+        return
+
+    wait_for(resolve, "changes", segments)
+    if then_splice:
+        try:
+            output = pipeline.splice_changes(resolve, patch_file, segment_cache)
+        except pipeline.PipelineError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Patched master written to '{output}'")
+
+
+@main.command()
+@patch_file_argument
+@click.option(
+    "--in-place/--copy",
+    default=None,
+    help="Patch the master itself, or write a patched copy. Defaults to splice_in_place in defaults.toml.",
+)
+@click.option("--label", default="", help="Label the new version in the history")
+def splice(patch_file, in_place, label):
+    """Splice rendered changes into the master"""
+
+    resolve = connect()
+    try:
+        output = pipeline.splice_changes(resolve, patch_file, pipeline.get_segment_cache(), in_place, label)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Patched master written to '{output}'")
+
+
+@main.command()
+@patch_file_argument
+def rollback(patch_file):
+    """Undo an in-place splice, restoring the master"""
+
+    try:
+        master = pipeline.rollback(patch_file)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Restored '{master}'")
+
+
+@main.command()
+@patch_file_argument
+def log(patch_file):
+    """List the versions spliced so far"""
+
+    try:
+        versions = pipeline.log(patch_file)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+
+    for x in versions:
+        changes = "squashed" if x.get("squashed") else f"{len(x['segments'])} segments"
+        click.echo(f"v{x['version']:<4} {x['created']}  {changes:<12} {x['label']}")
+
+
+@main.command()
+@patch_file_argument
+@click.argument("version", type=int)
+@click.option("--output", type=click.Path(dir_okay=False), help="Where to write it. Beside the master by default.")
+def materialize(patch_file, version, output):
+    """Write out any version in the history again"""
+
+    try:
+        output = pipeline.materialize(patch_file, version, output)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Version {version} written to '{output}'")
+
+
+@main.command()
+@patch_file_argument
+@click.argument("version", type=int, required=False)
+def squash(patch_file, version):
+    """Make a version the new master, dropping older versions. The latest by default."""
+
+    try:
+        base = pipeline.squash(patch_file, version)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"New master is '{base}'")
+
+
+@main.command()
+@patch_file_argument
+def verify(patch_file):
+    """Check the master, rendered changes and patched master are all in order"""
+
+    try:
+        problems = pipeline.verify(patch_file)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+
+    if problems:
+        raise click.ClickException("\n".join(problems))
+    click.echo("OK")
+
+
+@main.command()
+@patch_file_argument
+@click.option("--mark", is_flag=True, help="Mark defects on the active timeline")
+def qc(patch_file, mark):
+    """Scan rendered changes for black, green, frozen and offline frames"""
+
+    try:
+        found = pipeline.check_changes(patch_file)
+    except pipeline.PipelineError as e:
+        raise click.ClickException(str(e))
+
+    for start, end, kind in found:
+        click.echo(f"{kind:<8} {start:>8}-{end:<8}")
+
+    if mark and found:
+        added = pipeline.mark_defects(connect(), found)
+        click.echo(f"Marked {added} of {len(found)} defects")
+
+    # Freezes may be intended holds, so they're flagged for a look without failing
+    from patchwork.defects import WARNING_KINDS
+
+    failing = [x for x in found if x.kind not in WARNING_KINDS]
+    if failing:
+        raise click.ClickException(f"{len(failing)} defects in the rendered changes")
+    if found:
+        click.echo(f"OK, but check the {len(found)} frozen ranges are intended")
+        return
+    click.echo("OK")
+
+
+if __name__ == "__main__":
+    main()
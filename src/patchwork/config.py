@@ -1,10 +1,13 @@
 """
 Import `default_configuration` var into modules requiring access to default configuration.
+
+defaults.toml is only created and read the first time a setting is looked up,
+so importing this costs nothing at startup.
 """
 
 import logging
 import os
-import tomli
+from collections.abc import Mapping
 from appdirs import AppDirs
 
 
@@ -14,18 +17,31 @@ new_defaults = """# Please consider backing up this file and ensure you're famil
 [app]
 loglevel = "INFO" # See Python logging module for supported levels
 starting_directory = "C:/" # Refer to Resolve's supported colors (case-sensitive)
+target_fps = 60 # GUI frame rate while in use
+idle_fps = 4 # GUI frame rate when nothing's happening, leaves the CPU to Resolve
 
 [render]
 render_preset = "H.264 Master"
 hide_generic_render_presets = false
+remote_nodes = 1 # Render nodes sharing the queue. Above 1, masters are split across them
+merge_gap = 24 # Changes this many frames apart or closer render as one job
+segment_cache_size = 20 # GB of rendered changes kept for reuse, 0 turns the cache off
+splice_in_place = false # Patch .mov and .mp4 masters where they are instead of writing a patched copy, when only picture changed
+
+[qc]
+offline_slate = "" # Still of Resolve's "Media Offline" slate to match, blank matches its red
+freeze_frames = 120 # Frames a picture must hold to be reported frozen, 0 to not check
+
+[tracing]
+enabled = false # Time each pipeline stage and count Resolve calls, see `patchwork --trace`
+directory = "" # Where the trace and metrics go, blank for the cache folder
+max_mb = 10 # Size the trace file rotates at
+backups = 5 # Rotated trace files kept
 
 [advanced]
 advanced_stuff = false
 """
 
-default_configuration = {}
-
-
 logger = logging.getLogger("rich")
 logger.setLevel("INFO")
 
@@ -33,16 +49,45 @@ appdir = AppDirs()
 appdir.appauthor = "in03"
 appdir.appname = "Patchwork"
 config_dir = appdir.user_config_dir
+cache_dir = appdir.user_cache_dir
 
 defaults_filepath = os.path.join(config_dir, "defaults.toml")
 
-# TODO: Catch exceptions
-if not os.path.exists(defaults_filepath):
-    logger.warning(f"[yellow]Bookie default configuration file does not exist. Creating at '{defaults_filepath}'")
-    os.makedirs(config_dir, exist_ok=True)
-    with open(defaults_filepath, "xb") as new_defaults_file:
-        new_defaults_file.write(new_defaults.encode())
-   
+def load_defaults() -> dict:
+    """Read defaults.toml, writing it out first if it doesn't exist"""
+    
+    import tomli
+    
+    # TODO: Catch exceptions
+    if not os.path.exists(defaults_filepath):
+        logger.warning(f"[yellow]Bookie default configuration file does not exist. Creating at '{defaults_filepath}'")
+        os.makedirs(config_dir, exist_ok=True)
+        with open(defaults_filepath, "xb") as new_defaults_file:
+            new_defaults_file.write(new_defaults.encode())
+    
+    with open(defaults_filepath, "rb") as defaults_file:
+        return tomli.load(defaults_file)
+
+
+class _Defaults(Mapping):
+    """defaults.toml's settings, loaded on first lookup"""
+    
+    def __init__(self):
+        self._data = None
+    
+    def _load(self) -> dict:
+        if self._data is None:
+            self._data = load_defaults()
+        return self._data
+    
+    def __getitem__(self, key):
+        return self._load()[key]
+    
+    def __iter__(self):
+        return iter(self._load())
+    
+    def __len__(self):
+        return len(self._load())
+
 
-with open(defaults_filepath, "rb") as defaults_file:
-    default_configuration = tomli.load(defaults_file)
\ No newline at end of file
+default_configuration = _Defaults()
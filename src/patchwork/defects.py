@@ -0,0 +1,234 @@
+"""
+Automated QC of rendered changes: black, green, frozen and offline frames.
+
+Only the re-rendered segments are scanned, decoded by ffmpeg to a small YUV
+thumbnail per frame. Frames are classified a batch at a time with array maths
+over their luma and chroma planes, so the scan is bound by decoding, which at
+this size runs many times faster than real time.
+
+- black: nearly every pixel is close to black
+- green: nearly every pixel has near-zero chroma, what a corrupt or missing decode looks like
+- offline: the frame matches Resolve's red "Media Offline" slate
+- frozen: a run of frames with no change from one to the next
+"""
+
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from patchwork import tracing
+from patchwork.phash import mask_to_ranges
+from patchwork.splice import Segment
+
+logger = logging.getLogger("rich")
+
+QC_MARKER = "patchwork_qc"
+
+SCAN_WIDTH = 96
+SCAN_HEIGHT = 54
+
+# Frames classified per batch, bounds memory on long segments
+BATCH_FRAMES = 512
+
+# Share of a frame's pixels that have to look the part
+COVERAGE = 0.95
+
+# Limited range black is 16, allow for noise and grain
+BLACK_LUMA = 32
+
+# Chroma planes of a zeroed frame are 0, neutral is 128
+GREEN_CHROMA = 64
+
+# Resolve's offline slate is a flat, saturated red
+OFFLINE_MIN_V = 170
+OFFLINE_MAX_U = 128
+OFFLINE_SLATE_DIFF = 12
+
+# Mean absolute luma difference below which two frames are the same
+FREEZE_DIFF = 0.5
+
+# Frames a picture must hold to count as frozen. Holds and slow shots are often
+# intended, so this is long and `freeze_frames` in defaults.toml can change it.
+FREEZE_FRAMES = 120
+
+OK, BLACK, GREEN, OFFLINE, FROZEN = range(5)
+KINDS = {BLACK: "black", GREEN: "green", OFFLINE: "offline", FROZEN: "frozen"}
+
+# Kinds that may be intended, reported without failing a check
+WARNING_KINDS = {"frozen"}
+
+
+class DefectError(Exception):
+    pass
+
+
+class Defect(NamedTuple):
+    start: int
+    end: int
+    kind: str
+
+
+def _decode_command(path: str) -> list[str]:
+    return [
+        "ffmpeg", "-v", "error", "-i", path,
+        "-map", "0:v:0", "-an",
+        "-vf", f"scale={SCAN_WIDTH}:{SCAN_HEIGHT}:flags=area,format=yuv444p",
+        "-f", "rawvideo", "-",
+    ]
+
+
+def decode_frames(path: str):
+    """
+    Decode a video to `(n, 3, SCAN_HEIGHT, SCAN_WIDTH)` Y, U and V planes, a batch at a time.
+
+    Raises:
+        DefectError: If ffmpeg is missing or can't decode the file
+    """
+
+    frame_size = 3 * SCAN_HEIGHT * SCAN_WIDTH
+    try:
+        process = subprocess.Popen(_decode_command(path), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise DefectError("ffmpeg was not found on PATH")
+
+    try:
+        while True:
+            data = process.stdout.read(frame_size * BATCH_FRAMES)
+            tracing.count_bytes("read", len(data), "qc_decode")
+            frames = len(data) // frame_size
+            if frames:
+                yield np.frombuffer(data[:frames * frame_size], dtype=np.uint8).reshape(frames, 3, SCAN_HEIGHT, SCAN_WIDTH)
+            if len(data) < frame_size * BATCH_FRAMES:
+                break
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.wait()
+
+    if process.returncode != 0:
+        raise DefectError(f"ffmpeg couldn't decode '{path}':\n{stderr.decode(errors='replace')}")
+
+
+def load_slate(path: str) -> np.ndarray:
+    """
+    Decode a still of Resolve's offline slate, to match frames against.
+
+    Raises:
+        DefectError: If the still can't be decoded
+    """
+
+    for frames in decode_frames(path):
+        return frames[0]
+    raise DefectError(f"'{path}' has no frames")
+
+
+def classify(frames: np.ndarray, previous: np.ndarray | None = None, slate: np.ndarray | None = None) -> np.ndarray:
+    """
+    Classify a batch of frames.
+
+    Args:
+        frames (np.ndarray): uint8 array shaped `(n, 3, SCAN_HEIGHT, SCAN_WIDTH)`
+        previous (np.ndarray, optional): The frame before the batch, so freezes carry across batches
+        slate (np.ndarray, optional): Offline slate to match, its colour is used if not given
+
+    Returns:
+        np.ndarray: A kind per frame, `OK` if nothing's wrong
+    """
+
+    luma = frames[:, 0]
+    u = frames[:, 1]
+    v = frames[:, 2]
+
+    black = (luma <= BLACK_LUMA).mean(axis=(1, 2)) >= COVERAGE
+    green = ((u < GREEN_CHROMA) & (v < GREEN_CHROMA)).mean(axis=(1, 2)) >= COVERAGE
+
+    if slate is not None:
+        distance = np.abs(frames.astype(np.int16) - slate).mean(axis=(1, 2, 3))
+        offline = distance < OFFLINE_SLATE_DIFF
+    else:
+        # Allow for the slate's text
+        offline = ((v >= OFFLINE_MIN_V) & (u < OFFLINE_MAX_U)).mean(axis=(1, 2)) >= COVERAGE - 0.15
+
+    # Frame to frame difference, the first frame is compared to the previous batch
+    if previous is not None:
+        luma = np.concatenate((previous[None, 0], luma))
+    difference = np.abs(np.diff(luma.astype(np.int16), axis=0)).mean(axis=(1, 2))
+    unchanged = np.zeros(len(frames), dtype=bool)
+    unchanged[len(frames) - len(difference):] = difference < FREEZE_DIFF
+
+    kinds = np.full(len(frames), OK, dtype=np.uint8)
+    kinds[unchanged] = FROZEN
+    kinds[black] = BLACK
+    kinds[green] = GREEN
+    kinds[offline] = OFFLINE
+    return kinds
+
+
+def to_defects(kinds: np.ndarray, offset: int = 0, freeze_frames: int = FREEZE_FRAMES) -> list[Defect]:
+    """
+    Turn per-frame kinds into ranges, in timeline frames.
+
+    A freeze starts on the frame that's repeated, and is only reported once
+    it's held for `freeze_frames`. Freezes aren't reported if that's 0.
+    """
+
+    defects = []
+    for kind, name in KINDS.items():
+        for start, end in mask_to_ranges(kinds == kind):
+            if kind == FROZEN:
+                start -= 1
+                if not freeze_frames or end - start < freeze_frames:
+                    continue
+            defects.append(Defect(offset + start, offset + end, name))
+    return sorted(defects)
+
+
+def scan(path: str, offset: int = 0, slate: np.ndarray | None = None, freeze_frames: int = FREEZE_FRAMES) -> list[Defect]:
+    """
+    Scan one rendered segment.
+
+    Args:
+        offset (int): Timeline frame the segment starts on
+        freeze_frames (int): Frames a picture must hold to count as frozen
+
+    Raises:
+        DefectError: If the segment can't be decoded
+    """
+
+    batches = []
+    previous = None
+    for frames in decode_frames(path):
+        batches.append(classify(frames, previous, slate))
+        previous = frames[-1]
+
+    kinds = np.concatenate(batches) if batches else np.empty(0, dtype=np.uint8)
+    logger.debug(f"[magenta]Scanned {len(kinds)} frames of '{path}'")
+    return to_defects(kinds, offset, freeze_frames)
+
+
+def scan_segments(segments: list[Segment], slate_path: str | None = None, workers: int | None = None, freeze_frames: int = FREEZE_FRAMES) -> list[Defect]:
+    """
+    Scan rendered segments for defects, several at once.
+
+    Decoding happens in ffmpeg and NumPy releases the GIL, so threads are enough.
+
+    Raises:
+        DefectError: If a segment or the slate can't be decoded
+    """
+
+    slate = load_slate(slate_path) if slate_path else None
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers or min(len(segments), os.cpu_count() or 1) or 1) as pool:
+        futures = [pool.submit(scan, x.path, x.start, slate, freeze_frames) for x in segments]
+        defects = sorted(x for future in futures for x in future.result())
+
+    frames = sum(x.end - x.start for x in segments)
+    elapsed = time.perf_counter() - started
+    logger.info(f"[cyan]Scanned {frames} frames in {elapsed:.1f}s, found {len(defects)} defects")
+    return defects
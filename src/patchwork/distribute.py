@@ -0,0 +1,143 @@
+"""
+Split-and-join rendering of a whole master across Resolve render nodes.
+
+The timeline is split into segments, each queued as its own render job, and the
+results are joined losslessly into the master. Every segment is rendered as an
+independent file starting on a keyframe, so any frame is a valid boundary. Edit
+points are preferred anyway, since a cut hides any change in GOP structure.
+
+Resolve's remote render clients pick jobs up from the shared queue, and the API
+can't pin a job to a node. Jobs are queued longest first, which makes the queue
+itself a longest-processing-time-first schedule.
+"""
+
+import heapq
+import logging
+import os
+from bisect import bisect_left
+
+from patchwork import splice
+
+logger = logging.getLogger("rich")
+
+# Splitting finer than the node count lets fast nodes pick up the slack
+SEGMENTS_PER_NODE = 2
+
+
+def split(total_frames: int, count: int, cut_points: list[int] | None = None, tolerance: int = 0) -> list[tuple[int, int]]:
+    """
+    Split a range of frames into roughly equal segments.
+
+    Args:
+        total_frames (int): Length of the timeline
+        count (int): Number of segments wanted
+        cut_points (list[int], optional): Preferred boundaries, e.g. edit points
+        tolerance (int): How far a boundary may move to land on a cut point
+
+    Returns:
+        list[tuple[int, int]]: Contiguous `(start, end)` ranges, end exclusive
+    """
+
+    count = max(1, min(count, total_frames))
+    cut_points = sorted(set(cut_points or []))
+
+    boundaries = [0]
+    for i in range(1, count):
+        ideal = round(total_frames * i / count)
+        boundary = ideal
+
+        # Nearest cut point either side of the ideal boundary
+        j = bisect_left(cut_points, ideal)
+        nearby = [cut_points[k] for k in (j - 1, j) if 0 <= k < len(cut_points)]
+        if nearby:
+            closest = min(nearby, key=lambda x: abs(x - ideal))
+            if abs(closest - ideal) <= tolerance:
+                boundary = closest
+
+        if boundaries[-1] < boundary < total_frames:
+            boundaries.append(boundary)
+
+    boundaries.append(total_frames)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def schedule(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Order segments longest first"""
+
+    return sorted(ranges, key=lambda x: x[1] - x[0], reverse=True)
+
+
+def estimate_makespan(ranges: list[tuple[int, int]], nodes: int) -> int:
+    """
+    Estimate the frames rendered by the busiest node.
+
+    Each segment goes to whichever node frees up first, in queue order.
+    """
+
+    loads = [0] * max(1, nodes)
+    for start, end in schedule(ranges):
+        heapq.heapreplace(loads, loads[0] + end - start)
+    return max(loads)
+
+
+def queue_segments(project, ranges: list[tuple[int, int]], render_preset: str, target_dir: str, name: str) -> list[dict]:
+    """
+    Queue a render job per segment, longest first.
+
+    The preset is loaded once; only the range and name change between jobs.
+
+    Returns:
+        list[dict]: Segments as recorded in the patch file, in timeline order
+    """
+
+    project.load_render_preset(render_preset)
+    extension = project.current_render_format_and_codec["format"]
+
+    segments = []
+    for start, end in schedule(ranges):
+        custom_name = f"{name} - part {start}"
+        project.set_render_settings(
+            {
+                "MarkIn": start,
+                "MarkOut": end - 1, # Resolve's mark out is inclusive
+                "TargetDir": target_dir,
+                "CustomName": custom_name,
+            }
+        )
+        segments.append(
+            {
+                "start": start,
+                "end": end,
+                "path": os.path.join(target_dir, f"{custom_name}.{extension}"),
+                "job_id": project.add_renderjob(),
+            }
+        )
+
+    return sorted(segments, key=lambda x: x["start"])
+
+
+def get_edit_points(fingerprint_data: dict) -> list[int]:
+    """Clip boundaries on every video track of a timeline fingerprint"""
+
+    points = set()
+    for key, track in fingerprint_data.get("tracks", {}).items():
+        if key.startswith("video/"):
+            for start, end, _ in track["clips"]:
+                points.update((start, end))
+    return sorted(points)
+
+
+def join(segments: list[splice.Segment], output: str) -> str:
+    """
+    Join contiguous rendered segments into a master, stream-copying everything.
+
+    Raises:
+        splice.SpliceError: If the segments leave a gap or overlap, or ffmpeg fails
+    """
+
+    segments = sorted(segments, key=lambda x: x.start)
+    for previous, segment in zip(segments, segments[1:]):
+        if segment.start != previous.end:
+            raise splice.SpliceError(f"Segments don't join up at frame {previous.end}")
+
+    return splice.concat([splice.Piece(x.path) for x in segments], output, frame_rate=None)
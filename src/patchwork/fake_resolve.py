@@ -0,0 +1,282 @@
+"""
+In-process stand-in for Resolve, for benchmarks and development without Resolve.
+
+Covers the parts of pydavinci and the raw scripting API (via `_obj`) that patchwork
+uses. Projects, timelines, markers, clips and settings are synthetic and sized on
+construction. Every API call is counted and can be delayed to mimic Resolve's IPC.
+"""
+
+import time
+from types import SimpleNamespace
+
+
+class FakeApi:
+    """Shared call counter and injected latency"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class _Raw:
+    """Counts every attribute call made on a raw API object"""
+
+    def __init__(self, api: FakeApi, target):
+        self._api = api
+        self._target = target
+
+    def __getattr__(self, name):
+        method = getattr(self._target, name)
+
+        def counted(*args, **kwargs):
+            self._api.call()
+            return method(*args, **kwargs)
+
+        return counted
+
+
+class FakeTimelineItem:
+    def __init__(self, start: int, end: int, name: str, media_id: str):
+        self.start = start
+        self.end = end
+        self.name = name
+        self.media_id = media_id
+        self.version = "Version 1"
+
+    def GetStart(self):
+        return self.start
+
+    def GetEnd(self):
+        return self.end
+
+    def GetDuration(self):
+        return self.end - self.start
+
+    def GetName(self):
+        return self.name
+
+    def GetLeftOffset(self):
+        return 0
+
+    def GetClipEnabled(self):
+        return True
+
+    def GetMediaPoolItem(self):
+        return SimpleNamespace(GetMediaId=lambda: self.media_id)
+
+    def GetFusionCompNameList(self):
+        return []
+
+    def GetCurrentVersion(self):
+        return {"versionName": self.version, "versionType": 0}
+
+    def GetNumNodes(self):
+        return 1
+
+    def GetProperty(self):
+        return {"ZoomX": 1.0, "ZoomY": 1.0, "Pan": 0.0, "Tilt": 0.0}
+
+
+class _RawTimeline:
+    def __init__(self, timeline: "FakeTimeline"):
+        self.timeline = timeline
+
+    def GetMarkers(self):
+        return {float(frame): dict(data) for frame, data in self.timeline.markers.items()}
+
+    def AddMarker(self, frame, color, name, note, duration, custom_data=""):
+        if frame in self.timeline.markers:
+            return False
+        self.timeline.markers[frame] = {
+            "color": color,
+            "duration": duration,
+            "note": note,
+            "name": name,
+            "customData": custom_data,
+        }
+        return True
+
+    def DeleteMarkerAtFrame(self, frame):
+        return self.timeline.markers.pop(frame, None) is not None
+
+    def GetStartFrame(self):
+        return self.timeline.start_frame
+
+    def GetEndFrame(self):
+        return self.timeline.start_frame + self.timeline.frames
+
+    def GetTrackCount(self, track_type):
+        return len(self.timeline.tracks.get(track_type, []))
+
+    def GetItemListInTrack(self, track_type, index):
+        return self.timeline.tracks[track_type][index - 1]
+
+    def GetIsTrackEnabled(self, track_type, index):
+        return True
+
+
+class FakeTimeline:
+    def __init__(
+        self,
+        api: FakeApi,
+        name: str = "Timeline 1",
+        frame_rate: int = 24,
+        frames: int = 24 * 60 * 90,
+        marker_count: int = 0,
+        clip_count: int = 0,
+        settings_count: int = 50,
+    ):
+        self._api = api
+        self._name = name
+        self.frame_rate = frame_rate
+        self.frames = frames
+        self.start_frame = 0
+        self.playhead = 0
+        self.markers = {}
+        self.tracks = {"video": [], "audio": [], "subtitle": []}
+        self._settings = {f"timelineSetting{i}": str(i) for i in range(settings_count)}
+        self._obj = _Raw(api, _RawTimeline(self))
+
+        # Evenly spaced changes, each two seconds long
+        if marker_count:
+            spacing = max(1, frames // marker_count)
+            for i in range(marker_count):
+                self.markers[i * spacing] = {
+                    "color": "Purple",
+                    "duration": min(spacing, frame_rate * 2),
+                    "note": "",
+                    "name": f"Change - {i + 1}",
+                    "customData": "patchwork_marker",
+                }
+
+        # Clips split across one video and one audio track
+        if clip_count:
+            per_track = max(1, clip_count // 2)
+            length = max(1, frames // per_track)
+            for track_type in ("video", "audio"):
+                self.tracks[track_type].append(
+                    [FakeTimelineItem(i * length, (i + 1) * length, f"Clip {i}", f"media-{i}") for i in range(per_track)]
+                )
+
+    @property
+    def name(self):
+        self._api.call()
+        return self._name
+
+    @property
+    def timecode(self):
+        self._api.call()
+        frame = self.playhead
+        fps = self.frame_rate
+        return f"{frame // (fps * 3600):02d}:{frame // (fps * 60) % 60:02d}:{frame // fps % 60:02d}:{frame % fps:02d}"
+
+    @property
+    def settings(self):
+        self._api.call()
+        return SimpleNamespace(frame_rate=str(self.frame_rate))
+
+    def custom_settings(self, enabled: bool):
+        self._api.call()
+        return True
+
+    def get_setting(self, name: str | None = None):
+        self._api.call()
+        return self._settings if name is None else self._settings.get(name)
+
+
+class _RawProject:
+    def __init__(self, project: "FakeProject"):
+        self.project = project
+
+    def StartRendering(self, job_ids):
+        for job_id in job_ids:
+            self.project.jobs[job_id]["JobStatus"] = "Complete"
+            self.project.jobs[job_id]["CompletionPercentage"] = 100
+        return True
+
+    def GetRenderJobStatus(self, job_id):
+        job = self.project.jobs.get(job_id)
+        if not job:
+            return {}
+        return {"JobStatus": job["JobStatus"], "CompletionPercentage": job["CompletionPercentage"]}
+
+
+class FakeProject:
+    def __init__(self, api: FakeApi, name: str = "Project 1", settings_count: int = 200, **timeline_options):
+        self._api = api
+        self._name = name
+        self._settings = {f"projectSetting{i}": str(i) for i in range(settings_count)}
+        self._format_and_codec = {"format": "mov", "codec": "ProRes422HQ"}
+        self.render_settings = {}
+        self.jobs = {}
+        self.timeline = FakeTimeline(api, settings_count=settings_count, **timeline_options)
+        self._obj = _Raw(api, _RawProject(self))
+
+    @property
+    def name(self):
+        self._api.call()
+        return self._name
+
+    @property
+    def render_presets(self):
+        self._api.call()
+        return ["H.264 Master", "ProRes 422 HQ"]
+
+    @property
+    def current_render_format_and_codec(self):
+        self._api.call()
+        return dict(self._format_and_codec)
+
+    def set_render_format_and_codec(self, format: str, codec: str):
+        self._api.call()
+        self._format_and_codec = {"format": format, "codec": codec}
+        return True
+
+    def get_setting(self, name: str | None = None):
+        self._api.call()
+        return self._settings if name is None else self._settings.get(name)
+
+    def load_render_preset(self, name: str):
+        self._api.call()
+        return True
+
+    def set_render_settings(self, settings: dict):
+        self._api.call()
+        self.render_settings.update(settings)
+        return True
+
+    def add_renderjob(self):
+        self._api.call()
+        job_id = f"job-{len(self.jobs) + 1}"
+        self.jobs[job_id] = {**self.render_settings, "JobStatus": "Ready", "CompletionPercentage": 0}
+        return job_id
+
+
+class FakeResolve:
+    """
+    A Resolve with one open project and timeline.
+
+    Args:
+        latency (float): Seconds each API call takes
+        **options: Passed to the project and timeline, e.g. `marker_count`,
+            `clip_count`, `settings_count`, `frames`
+    """
+
+    def __init__(self, latency: float = 0.0, **options):
+        self.api = FakeApi(latency)
+        self._project = FakeProject(self.api, **options)
+
+    @property
+    def project(self):
+        self.api.call()
+        return self._project
+
+    @property
+    def active_timeline(self):
+        self.api.call()
+        return self._project.timeline
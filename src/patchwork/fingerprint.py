@@ -0,0 +1,189 @@
+"""
+Structural fingerprints of a timeline, for detecting changes without markers.
+
+Every clip is reduced to its timeline range plus a short digest of what it shows:
+media id, in point, duration, Fusion comps, grade version and properties. Diffing
+two fingerprints gives the frame ranges that need re-rendering.
+
+Every clip is walked each time. Resolve can't say what changed since the last
+walk, and nothing cheaper than a clip's own details sees a grade version switch,
+a media replacement or a same-length clip swap.
+"""
+
+import hashlib
+import json
+from bisect import bisect_left, bisect_right
+import logging
+
+logger = logging.getLogger("rich")
+
+TRACK_TYPES = ("video", "audio", "subtitle")
+
+
+def _digest(details: list) -> str:
+    encoded = json.dumps(details, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def fingerprint_clip(item, start_frame: int) -> list:
+    """
+    Fingerprint a single timeline item.
+
+    Returns:
+        list: `[start, end, digest]`, with frames relative to the timeline start
+    """
+
+    media_pool_item = item.GetMediaPoolItem()
+    details = [
+        item.GetName(),
+        media_pool_item.GetMediaId() if media_pool_item else None,
+        item.GetLeftOffset(),
+        item.GetDuration(),
+        item.GetClipEnabled(),
+        item.GetFusionCompNameList(),
+        item.GetCurrentVersion(),
+        item.GetNumNodes(),
+        item.GetProperty(),
+    ]
+    return [item.GetStart() - start_frame, item.GetEnd() - start_frame, _digest(details)]
+
+
+def fingerprint(timeline) -> dict:
+    """
+    Fingerprint every track of a timeline.
+
+    Args:
+        timeline: A pydavinci timeline
+
+    Returns:
+        dict: JSON-serialisable fingerprint
+    """
+
+    # pydavinci doesn't wrap most of the per-clip getters
+    raw_timeline = timeline._obj
+    start_frame = raw_timeline.GetStartFrame()
+
+    tracks = {}
+    for track_type in TRACK_TYPES:
+        for index in range(1, raw_timeline.GetTrackCount(track_type) + 1):
+
+            clips = []
+            if raw_timeline.GetIsTrackEnabled(track_type, index):
+                items = raw_timeline.GetItemListInTrack(track_type, index) or []
+                clips = [fingerprint_clip(x, start_frame) for x in items]
+            tracks[f"{track_type}/{index}"] = {"clips": clips}
+
+    logger.debug(f"[magenta]Fingerprinted timeline, {len(tracks)} tracks")
+    return {"start_frame": start_frame, "tracks": tracks}
+
+
+def merge(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Merge overlapping and touching frame ranges"""
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def diff(old: dict, new: dict) -> list[tuple[int, int]]:
+    """
+    Find the frame ranges that differ between two fingerprints.
+
+    A clip counts as changed if no clip with the same range and digest exists on
+    the same track of the other fingerprint. Both its old and new positions are
+    reported, since the content at each has changed.
+
+    Returns:
+        list[tuple[int, int]]: Sorted, non-overlapping `(start, end)` ranges, end exclusive
+    """
+
+    changed = []
+    for key in old["tracks"].keys() | new["tracks"].keys():
+
+        old_clips = {tuple(x) for x in old["tracks"].get(key, {}).get("clips", [])}
+        new_clips = {tuple(x) for x in new["tracks"].get(key, {}).get("clips", [])}
+
+        if old_clips == new_clips:
+            continue
+
+        changed += [(start, end) for start, end, _ in old_clips ^ new_clips]
+
+    return merge(changed)
+
+
+def range_digests(fingerprint_data: dict, ranges: list[tuple[int, int]]) -> list[str]:
+    """
+    Digest what a fingerprint shows over each of several frame ranges.
+
+    Two ranges with the same digest show the same clips, placed the same way
+    relative to the range start. A track's clips don't overlap, so the clips
+    touching a range are found with a binary search.
+
+    Args:
+        fingerprint_data (dict): A fingerprint from `fingerprint`
+        ranges (list[tuple[int, int]]): `(start, end)` ranges, end exclusive
+
+    Returns:
+        list[str]: A digest per range, in order
+    """
+
+    tracks = []
+    for key in sorted(fingerprint_data["tracks"]):
+        clips = fingerprint_data["tracks"][key]["clips"]
+        if clips:
+            tracks.append((key, clips, [x[0] for x in clips], [x[1] for x in clips]))
+
+    digests = []
+    for start, end in ranges:
+        details = []
+        for key, clips, starts, ends in tracks:
+            first = bisect_right(ends, start)
+            last = bisect_left(starts, end)
+            if first < last:
+                details.append([key, [[x[0] - start, x[1] - start, x[2]] for x in clips[first:last]]])
+        digests.append(_digest(details))
+    return digests
+
+
+def changed_track_types(old: dict, new: dict, ranges: list[tuple[int, int]]) -> list[set[str]]:
+    """
+    Find which kinds of track differ between two fingerprints over each range.
+
+    Args:
+        ranges (list[tuple[int, int]]): `(start, end)` ranges, end exclusive
+
+    Returns:
+        list[set[str]]: Track types from `TRACK_TYPES` per range, in order. Empty
+        if the range shows the same clips in both.
+    """
+
+    def index(fingerprint_data: dict) -> dict:
+        tracks = {}
+        for key, track in fingerprint_data["tracks"].items():
+            clips = [list(x) for x in track["clips"]]
+            tracks[key] = (clips, [x[0] for x in clips], [x[1] for x in clips])
+        return tracks
+
+    def clips_in(track, start: int, end: int) -> list:
+        clips, starts, ends = track
+        return clips[bisect_right(ends, start):bisect_left(starts, end)]
+
+    empty = ([], [], [])
+    old_tracks = index(old)
+    new_tracks = index(new)
+
+    changed = []
+    for start, end in ranges:
+        types = set()
+        for key in old_tracks.keys() | new_tracks.keys():
+            track_type = key.partition("/")[0]
+            if track_type in types:
+                continue
+            if clips_in(old_tracks.get(key, empty), start, end) != clips_in(new_tracks.get(key, empty), start, end):
+                types.add(track_type)
+        changed.append(types)
+    return changed
@@ -0,0 +1,258 @@
+"""
+Version history of a patched master, kept in its patch file.
+
+Every splice is recorded as a version: the base master it was spliced from and
+the segments spliced into it. Versions only reference their segments, so one that
+reuses an earlier version's renders costs nothing but a line in the patch file,
+and storage grows with the changes made rather than the number of versions.
+
+Segments are hard-linked (or copied, across drives) into a store beside the patch
+file, named by what they render, so re-rendering a change can't overwrite a
+version's segment. Any version can be materialized again by splicing its segments
+into its base. Squashing folds a version into a new base master, after which
+older versions and the segments only they used are dropped.
+
+Timeline fingerprints are kept in the store too, deduplicated by digest, so a
+squash can start change detection over from the squashed version.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from patchwork import journal
+from patchwork import splice
+
+logger = logging.getLogger("rich")
+
+
+class HistoryError(Exception):
+    pass
+
+
+def get_store_dir(patchwork_file: str) -> str:
+    return f"{os.path.splitext(patchwork_file)[0]}.history"
+
+
+def _link_or_copy(source: str, destination: str):
+    if os.path.exists(destination):
+        return
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def preserve_segment(patchwork_file: str, segment: dict) -> dict:
+    """
+    Keep a segment's render in the history store.
+
+    Returns:
+        dict: The segment, pointing at its copy in the store
+    """
+
+    # A hand-placed change's key can outlive an edit to it, so its render is stored by file
+    key = segment.get("cache_key") if not segment.get("hand_placed") else None
+    if not key:
+        stat = os.stat(segment["path"])
+        identity = json.dumps([os.path.abspath(segment["path"]), stat.st_size, stat.st_mtime_ns])
+        key = hashlib.blake2b(identity.encode(), digest_size=16).hexdigest()
+
+    directory = os.path.join(get_store_dir(patchwork_file), "segments")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{key}{os.path.splitext(segment['path'])[1]}")
+    _link_or_copy(segment["path"], path)
+
+    return {"start": segment["start"], "end": segment["end"], "path": path, "kind": segment.get("kind", "full")}
+
+
+def save_fingerprint(patchwork_file: str, fingerprint_data: dict) -> str:
+    """Keep a timeline fingerprint in the history store, returning its digest"""
+
+    encoded = journal.safe_dump(fingerprint_data, sort_keys=True, separators=(",", ":")).encode()
+    digest = hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+    directory = os.path.join(get_store_dir(patchwork_file), "fingerprints")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{digest}.json")
+    if not os.path.exists(path):
+        with open(path, "wb") as fingerprint_file:
+            fingerprint_file.write(encoded)
+    return digest
+
+
+def load_fingerprint(patchwork_file: str, digest: str) -> dict | None:
+    path = os.path.join(get_store_dir(patchwork_file), "fingerprints", f"{digest}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as fingerprint_file:
+        return json.load(fingerprint_file)
+
+
+def record(patchwork_file: str, base: str, segments: list[dict], output: str, frame_rate, fingerprint_data: dict | None = None, label: str = "") -> dict:
+    """
+    Record a splice as the next version.
+
+    Args:
+        base (str): Master the segments were spliced into
+        segments (list[dict]): Segments as recorded in the patch file
+        output (str): The spliced master
+        frame_rate: Timeline frame rate, as reported by Resolve
+        fingerprint_data (dict, optional): Timeline fingerprint the segments were rendered from
+
+    Returns:
+        dict: The version, as appended to the patch file's "history"
+    """
+
+    history = journal.load(patchwork_file).get("history", [])
+    version = {
+        "version": history[-1]["version"] + 1 if history else 1,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "label": label,
+        "base": base,
+        "segments": [preserve_segment(patchwork_file, x) for x in segments],
+        "output": output,
+        "frame_rate": str(frame_rate),
+        "fingerprint": save_fingerprint(patchwork_file, fingerprint_data) if fingerprint_data else None,
+    }
+    journal.extend(patchwork_file, "history", [version])
+
+    logger.info(f"[cyan]Recorded version {version['version']} with {len(segments)} segments")
+    return version
+
+
+def get_version(patch_data: dict, number: int | None = None) -> dict:
+    """
+    A version from the history, the latest if no number is given.
+
+    Raises:
+        HistoryError: If there's no such version
+    """
+
+    history = patch_data.get("history", [])
+    if not history:
+        raise HistoryError("Nothing has been spliced yet, there's no history.")
+
+    if number is None:
+        return history[-1]
+
+    for version in history:
+        if version["version"] == number:
+            return version
+
+    raise HistoryError(f"There's no version {number}. Versions are {history[0]['version']} to {history[-1]['version']}.")
+
+
+def materialize(version: dict, output: str) -> str:
+    """
+    Splice a version's segments into its base, writing it out again.
+
+    Returns:
+        str: The output path, or the base for a version with no segments of its own
+
+    Raises:
+        HistoryError: If the base or a segment is gone, or splicing fails
+    """
+
+    # A squashed version is its base
+    if not version["segments"]:
+        logger.info(f"[cyan]Version {version['version']} is its base, '{version['base']}'")
+        return version["base"]
+
+    segments = [splice.Segment(x["start"], x["end"], x["path"]) for x in version["segments"] if x["kind"] == "full"]
+    audio = [splice.Segment(x["start"], x["end"], x["path"]) for x in version["segments"] if x["kind"] == "audio"]
+    subtitles = [x["path"] for x in version["segments"] if x["kind"] == "subtitle"]
+
+    try:
+        splice.splice(version["base"], segments, output, version["frame_rate"], audio_segments=audio, subtitles=subtitles[-1] if subtitles else None)
+    except splice.SpliceError as e:
+        raise HistoryError(f"Couldn't materialize version {version['version']}:\n{e}")
+
+    logger.info(f"[green]Materialized version {version['version']} to '{output}'")
+    return output
+
+
+def _covers(segments: list[dict], ranges: list[dict]) -> bool:
+    """Whether every range is entirely replaced by the segments, full renders covering sound too"""
+
+    for x in ranges:
+        kinds = {"full", x["kind"]}
+        covering = sorted((y["start"], y["end"]) for y in segments if y["kind"] in kinds)
+        cursor = x["start"]
+        for start, end in covering:
+            if start <= cursor < end:
+                cursor = end
+        if cursor < x["end"]:
+            return False
+    return True
+
+
+def get_dependents(patch_data: dict, number: int) -> list[int]:
+    """Later versions that would come out differently spliced into a squashed version"""
+
+    squashed = get_version(patch_data, number)
+    return [
+        x["version"] for x in patch_data["history"]
+        if x["version"] > number and not _covers(x["segments"], squashed["segments"])
+    ]
+
+
+def squash(patchwork_file: str, number: int, base: str) -> list[dict]:
+    """
+    Make a materialized version the new base, dropping the versions before it.
+
+    Later versions are kept if their segments replace everything the squashed
+    version changed, since splicing them into the new base gives the same result.
+
+    Args:
+        base (str): The version, materialized
+
+    Raises:
+        HistoryError: If a later version still needs the old base
+
+    Returns:
+        list[dict]: The new history
+    """
+
+    patch_data = journal.load(patchwork_file)
+    squashed = get_version(patch_data, number)
+    later = [x for x in patch_data["history"] if x["version"] > number]
+
+    dependent = get_dependents(patch_data, number)
+    if dependent:
+        raise HistoryError(
+            f"Versions {', '.join(str(x) for x in dependent)} keep parts of the old base that version {number} changed.\n"
+            "Squash the latest version instead."
+        )
+
+    history = [{**squashed, "base": base, "segments": [], "output": base, "squashed": True}]
+    history += [{**x, "base": base} for x in later]
+    journal.update(patchwork_file, {"history": history})
+
+    prune(patchwork_file, history, patch_data.get("segments", []))
+    return history
+
+
+def prune(patchwork_file: str, history: list[dict], current_segments: list[dict]):
+    """Delete stored segments and fingerprints nothing refers to anymore"""
+
+    store = get_store_dir(patchwork_file)
+    used = {os.path.abspath(y["path"]) for x in history for y in x["segments"]}
+    used |= {os.path.abspath(x["path"]) for x in current_segments}
+    used |= {os.path.abspath(os.path.join(store, "fingerprints", f"{x['fingerprint']}.json")) for x in history if x.get("fingerprint")}
+
+    removed = 0
+    for directory in ("segments", "fingerprints"):
+        directory = os.path.join(store, directory)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.abspath(os.path.join(directory, name))
+            if path not in used:
+                os.remove(path)
+                removed += 1
+
+    logger.debug(f"[magenta]Pruned {removed} unused files from the history store")
@@ -0,0 +1,489 @@
+"""
+In-place patching of QuickTime and MP4 masters.
+
+Splicing with the concat demuxer copies every byte of the master, even to change
+a few seconds. Here the master is patched where it sits instead. Replacement
+samples are appended to the end of the file in a new `mdat` atom, and only the
+sample table entries of the replaced range are overwritten to point at them:
+chunk offsets (`stco`/`co64`), sample sizes (`stsz`) and sync samples (`stss`).
+Timing (`stts`) is untouched, since a segment replaces exactly as many frames as
+it spans. Bytes written scale with the change, not the master.
+
+Tables are never resized, so a patch can only change entries, not add them. The
+original bytes of every overwritten entry are returned as rollback state, to be
+kept in the patch file. Rolling back writes them back and truncates the appended
+samples away.
+
+Only the first video track is patched, so changes that touch sound are spliced
+as a copy instead. Atoms are parsed through a memory map, so nothing but the
+tables is read.
+"""
+
+import base64
+import itertools
+import logging
+import mmap
+import os
+import struct
+from bisect import bisect_right
+from typing import NamedTuple
+
+from patchwork import tracing
+from patchwork.checksums import SegmentCheck
+from patchwork.splice import Segment
+
+logger = logging.getLogger("rich")
+
+EXTENSIONS = (".mov", ".mp4", ".m4v")
+
+# Copies are streamed in blocks this big
+COPY_BLOCK = 16 * 1024**2
+
+# The appended mdat always uses a 64 bit size
+MDAT_HEADER = 16
+
+
+class InPlaceError(Exception):
+    pass
+
+
+class Atom(NamedTuple):
+    kind: bytes
+    offset: int
+    header: int
+    size: int
+
+    @property
+    def body(self) -> int:
+        return self.offset + self.header
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+class SampleTable:
+    """A video track's sample table, with the file offsets of its entries"""
+
+    def __init__(self, buffer, stbl: Atom):
+        atoms = {x.kind: x for x in iter_atoms(buffer, stbl.body, stbl.end)}
+
+        if b"ctts" in atoms:
+            raise InPlaceError("Frames are reordered (B-frames), which can't be patched in place")
+
+        stsd = atoms[b"stsd"]
+        # First sample description: size, data format, 6 reserved, data reference index
+        entry = buffer[stsd.body + 8:stsd.end]
+        self.data_format = bytes(entry[4:8])
+        self.width, self.height = struct.unpack(">HH", entry[32:36])
+
+        stsz = atoms[b"stsz"]
+        self.uniform_size, count = struct.unpack(">II", buffer[stsz.body + 4:stsz.body + 12])
+        self.sizes_offset = stsz.body + 12
+        if self.uniform_size:
+            self.sizes = [self.uniform_size] * count
+        else:
+            self.sizes = [x[0] for x in struct.iter_unpack(">I", buffer[self.sizes_offset:self.sizes_offset + 4 * count])]
+
+        if b"co64" in atoms:
+            chunk_atom, self.offset_format = atoms[b"co64"], ">Q"
+        else:
+            chunk_atom, self.offset_format = atoms[b"stco"], ">I"
+        self.offset_width = struct.calcsize(self.offset_format)
+        (chunks,) = struct.unpack(">I", buffer[chunk_atom.body + 4:chunk_atom.body + 8])
+        self.chunk_offsets_offset = chunk_atom.body + 8
+        end = self.chunk_offsets_offset + self.offset_width * chunks
+        self.chunk_offsets = [x[0] for x in struct.iter_unpack(self.offset_format, buffer[self.chunk_offsets_offset:end])]
+
+        # Runs of (first chunk, samples per chunk), expanded to every chunk
+        stsc = atoms[b"stsc"]
+        (runs,) = struct.unpack(">I", buffer[stsc.body + 4:stsc.body + 8])
+        entries = list(struct.iter_unpack(">III", buffer[stsc.body + 8:stsc.body + 8 + 12 * runs]))
+        self.chunk_samples = []
+        for i, (first_chunk, samples, _) in enumerate(entries):
+            last_chunk = entries[i + 1][0] if i + 1 < len(entries) else chunks + 1
+            self.chunk_samples.extend([samples] * (last_chunk - first_chunk))
+
+        self.chunk_first_sample = []
+        first = 0
+        for samples in self.chunk_samples:
+            self.chunk_first_sample.append(first)
+            first += samples
+
+        # No stss means every sample is a sync sample
+        self.sync_offset = None
+        self.sync = None
+        if b"stss" in atoms:
+            stss = atoms[b"stss"]
+            (syncs,) = struct.unpack(">I", buffer[stss.body + 4:stss.body + 8])
+            self.sync_offset = stss.body + 8
+            self.sync = [x[0] - 1 for x in struct.iter_unpack(">I", buffer[self.sync_offset:self.sync_offset + 4 * syncs])]
+
+    def chunk_of(self, sample: int) -> int:
+        return bisect_right(self.chunk_first_sample, sample) - 1
+
+    def sample_offset(self, sample: int) -> int:
+        chunk = self.chunk_of(sample)
+        first = self.chunk_first_sample[chunk]
+        return self.chunk_offsets[chunk] + sum(self.sizes[first:sample])
+
+    def sample_offsets(self) -> list[int]:
+        """File offset of every sample"""
+
+        offsets = []
+        for chunk_offset, first, samples in zip(self.chunk_offsets, self.chunk_first_sample, self.chunk_samples):
+            for size in self.sizes[first:first + samples]:
+                offsets.append(chunk_offset)
+                chunk_offset += size
+        return offsets
+
+
+class Patch(NamedTuple):
+    """Everything needed to apply a patch, worked out without writing anything"""
+
+    size: int
+    """Size of the master before patching, where the new samples go"""
+
+    copies: list[tuple[str, int, int]]
+    """`(path, offset, length)` of the bytes to append, in order"""
+
+    writes: list[tuple[int, bytes]]
+    """Table entries to overwrite, `(offset, data)`"""
+
+    originals: list[tuple[int, bytes]]
+    """What `writes` overwrite, for rolling back"""
+
+    @property
+    def appended(self) -> int:
+        return sum(x[2] for x in self.copies)
+
+    def rollback_state(self) -> dict:
+        """Rollback state, ready to save in the patch file"""
+
+        return {
+            "size": self.size,
+            "patched_size": self.size + MDAT_HEADER + self.appended,
+            "regions": [[offset, base64.b64encode(data).decode()] for offset, data in self.originals],
+        }
+
+
+def is_supported(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in EXTENSIONS
+
+
+def iter_atoms(buffer, start: int, end: int):
+    """Atoms between two offsets, not descending into any"""
+
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack(">I4s", buffer[offset:offset + 8])
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", buffer[offset + 8:offset + 16])
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise InPlaceError(f"Malformed '{kind.decode(errors='replace')}' atom at {offset}")
+        yield Atom(kind, offset, header, size)
+        offset += size
+
+
+def find_video_table(buffer) -> SampleTable:
+    """
+    Find the sample table of the first video track.
+
+    Raises:
+        InPlaceError: If there's no video track, or it can't be patched in place
+    """
+
+    moov = next((x for x in iter_atoms(buffer, 0, len(buffer)) if x.kind == b"moov"), None)
+    if not moov:
+        raise InPlaceError("No 'moov' atom, is it a QuickTime or MP4 file?")
+
+    for trak in iter_atoms(buffer, moov.body, moov.end):
+        if trak.kind != b"trak":
+            continue
+
+        mdia = _child(buffer, trak, b"mdia")
+        hdlr = _child(buffer, mdia, b"hdlr") if mdia else None
+        if not hdlr or buffer[hdlr.body + 8:hdlr.body + 12] != b"vide":
+            continue
+
+        stbl = _child(buffer, _child(buffer, mdia, b"minf"), b"stbl")
+        if not stbl:
+            raise InPlaceError("The video track has no sample table")
+        return SampleTable(buffer, stbl)
+
+    raise InPlaceError("No video track found")
+
+
+def _child(buffer, parent: Atom | None, kind: bytes) -> Atom | None:
+    if not parent:
+        return None
+    return next((x for x in iter_atoms(buffer, parent.body, parent.end) if x.kind == kind), None)
+
+
+def _open_map(path: str, write: bool = False):
+    file = open(path, "r+b" if write else "rb")
+    try:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_WRITE if write else mmap.ACCESS_READ)
+    except ValueError:
+        file.close()
+        raise InPlaceError(f"'{path}' is empty")
+    return file, buffer
+
+
+def _read_table(path: str) -> SampleTable:
+    file, buffer = _open_map(path)
+    try:
+        return find_video_table(buffer)
+    finally:
+        buffer.close()
+        file.close()
+
+
+def _merge_copies(copies: list[tuple[str, int, int]]) -> list[tuple[str, int, int]]:
+    merged = []
+    for path, offset, length in copies:
+        if merged and merged[-1][0] == path and merged[-1][1] + merged[-1][2] == offset:
+            merged[-1] = (path, merged[-1][1], merged[-1][2] + length)
+        else:
+            merged.append((path, offset, length))
+    return merged
+
+
+def prepare(master: str, segments: list[Segment]) -> Patch:
+    """
+    Work out how to patch segments into a master in place, without writing anything.
+
+    Every chunk holding a replaced frame is rewritten at the end of the file,
+    with the master's own samples copied across for frames the chunk keeps.
+
+    Raises:
+        InPlaceError: If the master or a segment can't be patched in place
+    """
+
+    if not is_supported(master):
+        raise InPlaceError(f"Only {', '.join(EXTENSIONS)} masters can be patched in place")
+
+    table = _read_table(master)
+    size = os.path.getsize(master)
+
+    copies = []
+    writes = []
+    appended_at = size + MDAT_HEADER
+    replacements = {}
+
+    for segment in sorted(segments):
+
+        if segment.start in replacements:
+            raise InPlaceError(f"Segment {segment.start}-{segment.end} overlaps another")
+
+        if segment.start < 0 or segment.end > len(table.sizes):
+            raise InPlaceError(f"Segment {segment.start}-{segment.end} runs past the master's {len(table.sizes)} frames")
+
+        source = _read_table(segment.path)
+        if len(source.sizes) != segment.end - segment.start:
+            raise InPlaceError(f"'{segment.path}' has {len(source.sizes)} frames, it should replace {segment.end - segment.start}")
+
+        if (source.data_format, source.width, source.height) != (table.data_format, table.width, table.height):
+            raise InPlaceError(
+                f"'{segment.path}' is {source.data_format.decode(errors='replace')} {source.width}x{source.height}, "
+                f"the master is {table.data_format.decode(errors='replace')} {table.width}x{table.height}"
+            )
+
+        if table.uniform_size and set(source.sizes) != {table.uniform_size}:
+            raise InPlaceError("The master's frames are all one size, the segment's aren't")
+
+        # Sync samples can be rewritten, but not added or removed
+        if table.sync is not None:
+            replaced = [x for x in table.sync if segment.start <= x < segment.end]
+            incoming = [segment.start + x for x in (source.sync if source.sync is not None else range(len(source.sizes)))]
+            if len(replaced) != len(incoming):
+                raise InPlaceError(
+                    f"Segment {segment.start}-{segment.end} has {len(incoming)} keyframes where the master has {len(replaced)}. "
+                    "Keyframes can't be added or removed in place."
+                )
+            if replaced != incoming:
+                first = table.sync.index(replaced[0])
+                writes.append((table.sync_offset + 4 * first, b"".join(struct.pack(">I", x + 1) for x in incoming)))
+        elif source.sync is not None and len(source.sync) != len(source.sizes):
+            raise InPlaceError("The master is all keyframes, the segment isn't")
+
+        source_offsets = source.sample_offsets()
+        for index, sample in enumerate(range(segment.start, segment.end)):
+            replacements[sample] = (segment.path, source_offsets[index], source.sizes[index])
+
+        if not table.uniform_size:
+            writes.append((table.sizes_offset + 4 * segment.start, b"".join(struct.pack(">I", x) for x in source.sizes)))
+
+    # Each chunk is rewritten once, with every segment's frames in it
+    chunks = sorted({table.chunk_of(x) for x in replacements})
+    new_offsets = {}
+    for chunk in chunks:
+        new_offsets[chunk] = appended_at
+        first = table.chunk_first_sample[chunk]
+        for sample in range(first, first + table.chunk_samples[chunk]):
+            path, offset, length = replacements.get(sample) or (master, table.sample_offset(sample), table.sizes[sample])
+            copies.append((path, offset, length))
+            appended_at += length
+
+    if appended_at > 0xFFFFFFFF and table.offset_width == 4:
+        raise InPlaceError("The master uses 32 bit chunk offsets, the patched samples would land past 4 GB")
+
+    # One write per run of consecutive chunks
+    for chunk in chunks:
+        if chunk - 1 in new_offsets:
+            continue
+        run = itertools.takewhile(lambda x: x in new_offsets, itertools.count(chunk))
+        writes.append((
+            table.chunk_offsets_offset + table.offset_width * chunk,
+            b"".join(struct.pack(table.offset_format, new_offsets[x]) for x in run),
+        ))
+
+    file, buffer = _open_map(master)
+    try:
+        originals = [(offset, bytes(buffer[offset:offset + len(data)])) for offset, data in writes]
+    finally:
+        buffer.close()
+        file.close()
+
+    return Patch(size, _merge_copies(copies), writes, originals)
+
+
+def apply(master: str, patch: Patch):
+    """
+    Append a prepared patch's samples to the master, then point its tables at them.
+
+    Save `patch.rollback_state()` before applying, so an interrupted patch can
+    be rolled back.
+
+    Raises:
+        InPlaceError: If the master changed since the patch was prepared
+    """
+
+    if os.path.getsize(master) != patch.size:
+        raise InPlaceError(f"'{master}' changed since the patch was prepared")
+
+    with open(master, "r+b") as file:
+        file.seek(patch.size)
+        file.write(struct.pack(">I4sQ", 1, b"mdat", MDAT_HEADER + patch.appended))
+
+        for path, offset, length in patch.copies:
+            with open(path, "rb") as source:
+                source.seek(offset)
+                while length:
+                    block = source.read(min(length, COPY_BLOCK))
+                    if not block:
+                        raise InPlaceError(f"'{path}' ended early")
+                    file.write(block)
+                    length -= len(block)
+
+        # Samples have to be on disk before anything points at them
+        file.flush()
+        os.fsync(file.fileno())
+
+    _write_regions(master, patch.writes)
+    tracing.count_bytes("read", patch.appended, "in_place")
+    tracing.count_bytes("written", MDAT_HEADER + patch.appended + sum(len(x) for _, x in patch.writes), "in_place")
+    logger.info(f"[green]Patched '{master}' in place, wrote {patch.appended / 1024**2:.1f} MB")
+
+
+def rollback(master: str, state: dict):
+    """
+    Undo an in-place patch, from its rollback state.
+
+    Safe to repeat, and to use on a patch that was interrupted partway.
+    """
+
+    if os.path.getsize(master) < state["size"]:
+        raise InPlaceError(f"'{master}' is smaller than before it was patched, it can't be rolled back")
+
+    _write_regions(master, [(offset, base64.b64decode(data)) for offset, data in state["regions"]])
+    os.truncate(master, state["size"])
+    logger.info(f"[cyan]Rolled back in-place patch of '{master}'")
+
+
+class _Original:
+    """The master as it was before patching, read through its rollback state"""
+
+    def __init__(self, buffer, state: dict):
+        self.buffer = buffer
+        self.size = state["size"]
+        self.regions = [(offset, base64.b64decode(data)) for offset, data in state["regions"]]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index: slice) -> bytes:
+        start, stop, _ = index.indices(self.size)
+        data = bytearray(self.buffer[start:stop])
+        for offset, original in self.regions:
+            if offset < stop and offset + len(original) > start:
+                lo = max(offset, start)
+                hi = min(offset + len(original), stop)
+                data[lo - start:hi - start] = original[lo - offset:hi - offset]
+        return bytes(data)
+
+
+def verify(master: str, state: dict, segments: list[Segment], window: int) -> list[SegmentCheck]:
+    """
+    Check an in-place patch sample by sample, against the segments and the master as it was.
+
+    Every replaced frame has to be its segment's sample, byte for byte, and the
+    `window` frames either side of each cut the master's original sample.
+
+    Raises:
+        InPlaceError: If the master or a segment can't be read
+    """
+
+    file, buffer = _open_map(master)
+    try:
+        patched = find_video_table(buffer)
+        original = find_video_table(_Original(buffer, state))
+        patched_offsets = patched.sample_offsets()
+        original_offsets = original.sample_offsets()
+
+        def sample(table, offsets, index):
+            return bytes(buffer[offsets[index]:offsets[index] + table.sizes[index]])
+
+        if len(patched.sizes) != len(original.sizes):
+            raise InPlaceError(f"The patched master has {len(patched.sizes)} frames, it had {len(original.sizes)}")
+
+        results = []
+        for segment in sorted(segments):
+            source = _read_table(segment.path)
+            source_offsets = source.sample_offsets()
+            mismatched = []
+
+            with open(segment.path, "rb") as source_file:
+                for index in range(segment.start, min(segment.end, len(patched.sizes))):
+                    source_file.seek(source_offsets[index - segment.start])
+                    if sample(patched, patched_offsets, index) != source_file.read(source.sizes[index - segment.start]):
+                        mismatched.append(index)
+
+            around = [*range(max(segment.start - window, 0), segment.start), *range(segment.end, min(segment.end + window, len(patched.sizes)))]
+            kept = [x for x in around if not any(y.start <= x < y.end for y in segments)]
+            mismatched += [x for x in kept if sample(patched, patched_offsets, x) != sample(original, original_offsets, x)]
+
+            results.append(SegmentCheck(segment.start, segment.end, segment.end - segment.start + len(kept), sorted(mismatched)))
+        return results
+
+    finally:
+        buffer.close()
+        file.close()
+
+
+def _write_regions(path: str, regions: list[tuple[int, bytes]]):
+    if not regions:
+        return
+
+    file, buffer = _open_map(path, write=True)
+    try:
+        for offset, data in regions:
+            buffer[offset:offset + len(data)] = data
+        buffer.flush()
+    finally:
+        buffer.close()
+        file.close()
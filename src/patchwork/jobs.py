@@ -0,0 +1,32 @@
+"""
+Helpers for Resolve render jobs that pydavinci doesn't wrap.
+"""
+
+import logging
+
+logger = logging.getLogger("rich")
+
+# Values of 'JobStatus' reported by Resolve
+COMPLETE = "Complete"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+FINISHED_STATUSES = {COMPLETE, FAILED, CANCELLED}
+
+
+def start_render(project, job_ids: list[str]) -> bool:
+    """Start rendering the given jobs without touching the rest of the queue"""
+
+    logger.debug(f"[magenta]Starting render jobs: {job_ids}")
+    return bool(project._obj.StartRendering(job_ids))
+
+
+def get_job_status(project, job_id: str) -> dict:
+    """
+    Get the status of a render job.
+
+    Returns:
+        dict: Resolve's status, e.g. `{"JobStatus": "Rendering", "CompletionPercentage": 40}`.
+        Empty if the job doesn't exist.
+    """
+
+    return project._obj.GetRenderJobStatus(job_id) or {}
@@ -0,0 +1,258 @@
+"""
+Append-only storage for patch files.
+
+A patch file is a small JSON header line followed by one JSON record per line.
+Saving a change appends just that record instead of rewriting the file, and
+reading replays the records in order. Loaded state is cached with the byte offset
+it was read up to, so a reload only parses what was appended since. Once enough
+records pile up the file is compacted: atomically rewritten as the header and a
+single record holding the current state.
+
+Records are:
+    {"op": "set", "data": {...}}                    replace top level keys
+    {"op": "extend", "key": "...", "items": [...]}  append to a top level list
+
+Files written before the journal (a single JSON document) are still read, and are
+upgraded the first time they're written to.
+"""
+
+import json
+import logging
+import os
+import tempfile
+from json import JSONDecodeError
+from typing import Iterator
+
+from patchwork import tracing
+
+logger = logging.getLogger("rich")
+
+FORMAT = "patchwork"
+VERSION = 2
+
+# Records appended after the last compaction before compacting again
+COMPACT_AFTER = 100
+
+# Replayed state per file, keyed by absolute path
+_loaded = {}
+
+
+class JournalError(Exception):
+    pass
+
+
+class _State:
+    def __init__(self, identity: tuple, end: int, data: dict, records: int, legacy: bool):
+        self.identity = identity
+        self.end = end
+        self.data = data
+        self.records = records
+        self.legacy = legacy
+
+
+def safe_dump(obj, **kwargs) -> str:
+    default = lambda o: f"<<non-serializable: {type(o).__qualname__}>>"
+    return json.dumps(obj, default=default, **kwargs)
+
+
+def _header() -> dict:
+    return {"format": FORMAT, "version": VERSION}
+
+
+def _identity(path: str) -> tuple:
+    # Compaction replaces the file, so a new inode means start over
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino)
+
+
+def _apply(data: dict, record: dict):
+    op = record.get("op")
+    if op == "set":
+        data.update(record["data"])
+    elif op == "extend":
+        # A new list, so copies handed out by `load` aren't changed underneath
+        data[record["key"]] = data.get(record["key"], []) + record["items"]
+    else:
+        raise JournalError(f"Unknown patch file record: '{op}'")
+
+
+def read_records(path: str, offset: int = 0) -> Iterator[tuple[int, dict]]:
+    """
+    Stream a patch file's records without loading the whole file.
+
+    Args:
+        path (str): Patch file
+        offset (int): Byte offset to start from, e.g. the end of a record already read.
+            Zero starts after the header.
+
+    Yields:
+        tuple[int, dict]: Byte offset just past each record, and the record.
+        A trailing record cut short by an interrupted write is skipped.
+    """
+
+    with open(path, "rb") as journal:
+        header_line = journal.readline()
+        if not offset:
+            offset = journal.tell()
+            if not _is_header(_parse(header_line, path)):
+                raise JournalError(f"'{path}' isn't a journaled patch file")
+
+        journal.seek(offset)
+        for line in journal:
+            if not line.endswith(b"\n"):
+                logger.warning(f"[yellow]Ignoring incomplete record at the end of '{path}'")
+                return
+            offset += len(line)
+            if line.strip():
+                yield offset, _parse(line, path)
+
+
+def _parse(line: bytes, path: str):
+    try:
+        return json.loads(line)
+    except (JSONDecodeError, UnicodeDecodeError) as e:
+        raise JournalError(f"Couldn't parse '{path}': {e}")
+
+
+def _is_header(value) -> bool:
+    return isinstance(value, dict) and value.get("format") == FORMAT
+
+
+def _read(path: str) -> _State:
+    """Replay a patch file, resuming from the cached state if it's still valid"""
+
+    key = os.path.abspath(path)
+    identity = _identity(path)
+    size = os.path.getsize(path)
+    state = _loaded.get(key)
+
+    if state and state.identity == identity and state.end <= size:
+        if state.end == size:
+            return state
+        if not state.legacy:
+            tracing.count_bytes("read", size - state.end, "patch_file")
+            for end, record in read_records(path, state.end):
+                _apply(state.data, record)
+                state.end = end
+                state.records += 1
+            return state
+
+    tracing.count_bytes("read", size, "patch_file")
+    with open(path, "rb") as journal:
+        first_line = journal.readline()
+        header_end = journal.tell()
+        try:
+            first = _parse(first_line, path) if first_line.strip() else {}
+        except JournalError:
+            # Possibly an older, indented patch file
+            journal.seek(0)
+            first = _parse(journal.read(), path)
+
+    if not _is_header(first):
+        # A single JSON document from before the journal, or an empty file
+        if not isinstance(first, dict):
+            raise JournalError(f"'{path}' isn't a patch file")
+        state = _State(identity, size, first, 0, legacy=True)
+
+    elif first.get("version", 0) > VERSION:
+        raise JournalError(f"'{path}' was written by a newer version of patchwork (format {first['version']})")
+
+    else:
+        state = _State(identity, header_end, {}, 0, legacy=False)
+        for end, record in read_records(path, header_end):
+            _apply(state.data, record)
+            state.end = end
+            state.records += 1
+
+    _loaded[key] = state
+    return state
+
+
+def load(path: str) -> dict:
+    """
+    Current contents of a patch file.
+
+    Returns a shallow copy of the cached state; treat nested values as read-only.
+    """
+
+    return dict(_read(path).data)
+
+
+def _write_compacted(path: str, data: dict):
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".patch.tmp")
+    try:
+        # mkstemp's files are private, keep the permissions of the file being replaced
+        mode = os.stat(path).st_mode if os.path.exists(path) else 0o644
+        os.chmod(temp_path, mode & 0o777)
+        with os.fdopen(handle, "w") as journal:
+            journal.write(safe_dump(_header()) + "\n")
+            journal.write(safe_dump({"op": "set", "data": data}, sort_keys=True) + "\n")
+        tracing.count_bytes("written", os.path.getsize(temp_path), "patch_file")
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    _loaded.pop(os.path.abspath(path), None)
+
+
+def create(path: str, data: dict):
+    """Write a new patch file holding `data`, replacing any existing one"""
+
+    _write_compacted(path, data)
+
+
+def compact(path: str):
+    """Rewrite a patch file as a single record of its current state"""
+
+    logger.debug(f"[magenta]Compacting patch file '{path}'")
+    _write_compacted(path, _read(path).data)
+
+
+def append(path: str, records: list[dict]):
+    """
+    Append records to a patch file, compacting it if enough have built up.
+
+    Raises:
+        JournalError: If a record is malformed or the file can't be read
+    """
+
+    state = _read(path)
+    if state.legacy:
+        logger.info(f"[cyan]Upgrading '{path}' to the journaled patch file format")
+        compact(path)
+        state = _read(path)
+
+    # Check before writing, so a bad record never reaches the file
+    data = dict(state.data)
+    for record in records:
+        _apply(data, record)
+
+    lines = b"".join((safe_dump(x, sort_keys=True) + "\n").encode() for x in records)
+    with open(path, "r+b") as journal:
+        # Drop anything past the last complete record, like a torn write
+        journal.truncate(state.end)
+        journal.seek(state.end)
+        journal.write(lines)
+    tracing.count_bytes("written", len(lines), "patch_file")
+
+    state.data = data
+    state.end += len(lines)
+    state.records += len(records)
+
+    if state.records > COMPACT_AFTER:
+        compact(path)
+
+
+def update(path: str, values: dict):
+    """Replace top level keys, like `dict.update`"""
+
+    append(path, [{"op": "set", "data": values}])
+
+
+def extend(path: str, key: str, items: list):
+    """Append items to a top level list"""
+
+    append(path, [{"op": "extend", "key": key, "items": items}])
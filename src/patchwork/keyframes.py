@@ -0,0 +1,305 @@
+"""
+Keyframe index of a master file, for snapping change ranges to GOP boundaries.
+
+Long-GOP masters can only be cut on I-frames, so a change has to be widened to
+the enclosing keyframes before it's rendered and spliced. Scanning a master's
+packets is slow, so the index is saved beside the patch file and reused for as
+long as the master's path, size and mtime are unchanged.
+
+All-intra masters, like ProRes and DNxHR, can be cut on any frame. They're
+recognised by codec and never scanned, so their changes are patched frame-exact.
+"""
+
+import json
+import logging
+import os
+import subprocess
+from bisect import bisect_left, bisect_right
+from json import JSONDecodeError
+from typing import NamedTuple
+
+from patchwork.splice import parse_frame_rate
+
+logger = logging.getLogger("rich")
+
+INDEX_VERSION = 1
+
+# ffprobe codec names where every frame is a keyframe. DNxHR reports as dnxhd.
+INTRA_CODECS = {
+    "prores", "dnxhd", "mjpeg", "jpeg2000", "cfhd", "v210", "v410", "r210",
+    "rawvideo", "png", "tiff", "dpx", "exr", "huffyuv", "utvideo",
+}
+
+# Resolve's names for the same, as set in render settings
+RESOLVE_INTRA_CODECS = ("ProRes", "DNx", "CineForm", "JPEG2000", "J2K", "Uncompressed", "DPX", "EXR", "TIFF")
+
+# In-memory copies so repeat lookups skip the disk entirely
+_loaded_indexes = {}
+_probed = {}
+
+
+class KeyframeError(Exception):
+    pass
+
+
+class StreamInfo(NamedTuple):
+    codec: str
+    frames: int | None
+    """Frame count from the container, None if it doesn't say"""
+
+    @property
+    def intra_only(self) -> bool:
+        return self.codec in INTRA_CODECS
+
+
+class KeyframeIndex:
+    """Sorted keyframe positions of a master's first video stream"""
+
+    def __init__(self, keyframes: list[int], frames: int, intra_only: bool = False):
+        self.keyframes = keyframes
+        self.frames = frames
+        self.intra_only = intra_only
+
+    def snap(self, start: int, end: int) -> tuple[int, int]:
+        """
+        Widen a frame range to the nearest enclosing keyframes.
+
+        Args:
+            start (int): First frame of the change (inclusive)
+            end (int): Last frame of the change (exclusive)
+
+        Returns:
+            tuple[int, int]: The snapped range. `end` snaps to the next keyframe
+            at or after it, or the end of the master if there is none.
+        """
+
+        start = max(0, min(start, self.frames))
+        end = max(start, min(end, self.frames))
+
+        if self.intra_only:
+            return start, end
+
+        # Frame zero is always a valid cut, even if the first packet isn't flagged
+        i = bisect_right(self.keyframes, start) - 1
+        snapped_start = self.keyframes[i] if i >= 0 else 0
+
+        j = bisect_left(self.keyframes, end)
+        snapped_end = self.keyframes[j] if j < len(self.keyframes) else self.frames
+
+        return snapped_start, snapped_end
+
+    def to_dict(self) -> dict:
+        if self.intra_only:
+            return {"frames": self.frames, "intra_only": True}
+
+        # Delta encoding keeps fixed-GOP masters tiny on disk
+        deltas = [b - a for a, b in zip([0, *self.keyframes], self.keyframes)]
+        return {"frames": self.frames, "keyframe_deltas": deltas}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "KeyframeIndex":
+        if data.get("intra_only"):
+            return cls([], data["frames"], intra_only=True)
+
+        keyframes = []
+        position = 0
+        for delta in data["keyframe_deltas"]:
+            position += delta
+            keyframes.append(position)
+        return cls(keyframes, data["frames"])
+
+
+def merge_ranges(ranges: list[tuple[int, int, str]]) -> list[tuple[int, int, str]]:
+    """
+    Merge overlapping or touching ranges, joining their labels.
+
+    Snapping can widen neighbouring changes into each other. They have to be
+    rendered as one segment, or the splice would overlap.
+    """
+
+    merged = []
+    for start, end, label in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            last_start, last_end, last_label = merged[-1]
+            merged[-1] = (last_start, max(last_end, end), f"{last_label} + {label}")
+        else:
+            merged.append((start, end, label))
+    return merged
+
+
+def is_intra_render_codec(codec: str) -> bool:
+    """Whether a codec, as Resolve names it in render settings, only makes keyframes"""
+
+    return codec.replace(" ", "").startswith(RESOLVE_INTRA_CODECS)
+
+
+def probe(master: str) -> StreamInfo:
+    """
+    Read the codec and frame count of the master's first video stream.
+
+    Only the container's headers are read, so it's quick.
+
+    Raises:
+        KeyframeError: If ffprobe is missing or can't read the master
+    """
+
+    stat = os.stat(master)
+    key = (os.path.abspath(master), stat.st_size, stat.st_mtime_ns)
+    if key in _probed:
+        return _probed[key]
+
+    command = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,nb_frames",
+        "-of", "csv=p=0",
+        master,
+    ]
+
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except FileNotFoundError:
+        raise KeyframeError("ffprobe was not found on PATH")
+    except subprocess.CalledProcessError as e:
+        raise KeyframeError(f"ffprobe couldn't read '{master}':\n{e.stderr}")
+
+    codec, _, frames = result.stdout.strip().partition(",")
+    if not codec:
+        raise KeyframeError(f"No video stream found in '{master}'")
+
+    info = StreamInfo(codec, int(frames) if frames.isdigit() else None)
+    _probed[key] = info
+    return info
+
+
+def count_frames(patchwork_file: str, path: str, frame_rate) -> int:
+    """
+    Frames in a file's first video stream, from its headers if they say, or its keyframe index.
+
+    The index is cached beside the patch file, so a file is scanned at most once.
+
+    Raises:
+        KeyframeError: If the file can't be read
+    """
+
+    frames = probe(path).frames
+    if frames is None:
+        frames = get_index(patchwork_file, path, frame_rate).frames
+    return frames
+
+
+def scan(master: str, frame_rate) -> KeyframeIndex:
+    """
+    Read keyframe positions from the master's packets with ffprobe.
+
+    Only packet headers are read, nothing is decoded.
+
+    Raises:
+        KeyframeError: If ffprobe is missing or can't read the master
+    """
+
+    logger.info(f"[cyan]Scanning keyframes of '{master}'. This may take a while...")
+
+    command = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        master,
+    ]
+
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except FileNotFoundError:
+        raise KeyframeError("ffprobe was not found on PATH")
+    except subprocess.CalledProcessError as e:
+        raise KeyframeError(f"ffprobe couldn't read '{master}':\n{e.stderr}")
+
+    packets = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if pts_time and pts_time != "N/A":
+            packets.append((float(pts_time), "K" in flags))
+
+    if not packets:
+        raise KeyframeError(f"No video packets found in '{master}'")
+
+    # Packets come in decode order, positions are relative to the first presented frame
+    rate = float(parse_frame_rate(frame_rate))
+    first_pts = min(x[0] for x in packets)
+    keyframes = sorted({round((pts - first_pts) * rate) for pts, key in packets if key})
+
+    # Intra-only encodes of long-GOP codecs, like all-I H.264
+    if len(keyframes) == len(packets):
+        return KeyframeIndex([], len(packets), intra_only=True)
+
+    return KeyframeIndex(keyframes, len(packets))
+
+
+def get_index_path(patchwork_file: str) -> str:
+    return f"{os.path.splitext(patchwork_file)[0]}.keyframes"
+
+
+def _read_index_file(index_path: str) -> dict:
+
+    if not os.path.exists(index_path):
+        return {}
+
+    try:
+        with open(index_path) as index_file:
+            data = json.load(index_file)
+    except JSONDecodeError:
+        logger.warning(f"[yellow]Keyframe index '{index_path}' is malformed, rescanning")
+        return {}
+
+    if data.get("version") != INDEX_VERSION:
+        return {}
+
+    return data.get("entries", {})
+
+
+def get_index(patchwork_file: str, master: str, frame_rate) -> KeyframeIndex:
+    """
+    Get the keyframe index of a master, scanning it only if it has changed.
+
+    Args:
+        patchwork_file (str): Path to the patch file. The index is saved beside it.
+        master (str): Path to the master file
+        frame_rate: Timeline frame rate, as reported by Resolve
+
+    Raises:
+        KeyframeError: If the master needs scanning and can't be read
+    """
+
+    master = os.path.abspath(master)
+    stat = os.stat(master)
+    key = (master, stat.st_size, stat.st_mtime_ns)
+
+    if key in _loaded_indexes:
+        return _loaded_indexes[key]
+
+    index_path = get_index_path(patchwork_file)
+    entries = _read_index_file(index_path)
+    entry = entries.get(master)
+
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        logger.debug(f"[magenta]Using cached keyframe index for '{master}'")
+        index = KeyframeIndex.from_dict(entry)
+
+    else:
+        info = probe(master)
+        if info.intra_only and info.frames:
+            logger.info(f"[cyan]Master is all-intra ({info.codec}), every frame is a cut point")
+            index = KeyframeIndex([], info.frames, intra_only=True)
+        else:
+            index = scan(master, frame_rate)
+        entries[master] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **index.to_dict()}
+
+        try:
+            with open(index_path, "w") as index_file:
+                json.dump({"version": INDEX_VERSION, "entries": entries}, index_file)
+        except PermissionError:
+            logger.warning(f"[yellow]Couldn't save keyframe index to '{index_path}'")
+
+    _loaded_indexes[key] = index
+    return index
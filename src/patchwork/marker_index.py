@@ -0,0 +1,238 @@
+"""
+Local index of a timeline's markers, sorted by start frame.
+
+Fetching and scanning every marker through Resolve on each lookup doesn't scale to
+timelines with thousands of changes. The index is built from a single
+`GetMarkers()` call, answers range queries with a binary search, and is kept up to
+date by writing through to Resolve on add, delete and note changes. It's only
+rebuilt when Resolve's markers differ from what the index last saw.
+"""
+
+import logging
+import re
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple
+
+logger = logging.getLogger("rich")
+
+PATCHWORK_MARKER = "patchwork_marker"
+
+# Changes marked by detection rather than by hand
+DETECTED_MARKER = "patchwork_marker_detected"
+
+_change_number_pattern = re.compile(r"(\d+)\s*$")
+
+
+class MarkerEntry(NamedTuple):
+    """A marker, named like pydavinci's so either can be passed around"""
+
+    frameid: int
+    duration: int
+    name: str
+    note: str
+    color: str
+    customdata: str
+
+    @property
+    def end(self) -> int:
+        return self.frameid + self.duration
+
+    @property
+    def is_change(self) -> bool:
+        return self.customdata in (PATCHWORK_MARKER, DETECTED_MARKER)
+
+    @property
+    def is_detected(self) -> bool:
+        return self.customdata == DETECTED_MARKER
+
+
+def _to_raw(entry: MarkerEntry) -> dict:
+    return {
+        "color": entry.color,
+        "duration": entry.duration,
+        "note": entry.note,
+        "name": entry.name,
+        "customData": entry.customdata,
+    }
+
+
+def _from_raw(frame, data: dict) -> MarkerEntry:
+    return MarkerEntry(
+        int(frame),
+        int(data.get("duration", 1)),
+        data.get("name", ""),
+        data.get("note", ""),
+        data.get("color", ""),
+        data.get("customData", ""),
+    )
+
+
+def _get_change_number(entry: MarkerEntry) -> int:
+    if not entry.is_change:
+        return 0
+    match = _change_number_pattern.search(entry.name)
+    return int(match.group(1)) if match else 0
+
+
+class MarkerIndex:
+    """
+    Markers sorted by start frame, augmented with a running maximum of end frames.
+
+    A query only visits markers that start before the queried range ends and walks
+    back until the running maximum shows nothing earlier can reach the range. With
+    mostly disjoint markers, like patchwork changes, that's a binary search plus
+    the hits.
+    """
+
+    def __init__(self):
+        self._entries: list[MarkerEntry] = []
+        self._starts: list[int] = []
+        self._max_ends: list[int] | None = []
+        self._raw: dict = {}
+        self._timeline_name = None
+        self._max_change_number = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    @property
+    def changes(self) -> list[MarkerEntry]:
+        return [x for x in self._entries if x.is_change]
+
+    def reconcile(self, timeline) -> bool:
+        """
+        Rebuild the index if the timeline's markers differ from it.
+
+        Returns:
+            bool: True if the index was rebuilt
+        """
+
+        return self.reconcile_raw(timeline.name, timeline._obj.GetMarkers() or {})
+
+    def reconcile_raw(self, timeline_name: str, raw_markers) -> bool:
+        """Like `reconcile`, from markers already fetched with `GetMarkers()`"""
+
+        raw = {int(frame): data for frame, data in raw_markers.items()}
+        if timeline_name == self._timeline_name and raw == self._raw:
+            return False
+
+        logger.debug(f"[magenta]Rebuilding marker index, {len(raw)} markers")
+        self._timeline_name = timeline_name
+        self._raw = raw
+        self._entries = sorted(_from_raw(frame, data) for frame, data in raw.items())
+        self._starts = [x.frameid for x in self._entries]
+        self._max_ends = None
+        self._max_change_number = max([_get_change_number(x) for x in self._entries], default=0)
+        return True
+
+    def _get_max_ends(self) -> list[int]:
+        # Rebuilt lazily, so a burst of writes only pays for it once
+        if self._max_ends is None:
+            running = 0
+            self._max_ends = []
+            for entry in self._entries:
+                running = max(running, entry.end)
+                self._max_ends.append(running)
+        return self._max_ends
+
+    def overlapping(self, start: int, end: int) -> list[MarkerEntry]:
+        """Markers overlapping frames `start` (inclusive) to `end` (exclusive), in order"""
+
+        max_ends = self._get_max_ends()
+        hits = []
+        i = bisect_left(self._starts, end) - 1
+        while i >= 0 and max_ends[i] > start:
+            if self._entries[i].end > start:
+                hits.append(self._entries[i])
+            i -= 1
+        hits.reverse()
+        return hits
+
+    def at(self, frame: int) -> list[MarkerEntry]:
+        """Markers covering a frame"""
+
+        return self.overlapping(frame, frame + 1)
+
+    def next_change_number(self) -> int:
+        """
+        The number after the highest numbered change, e.g. 'Change - 12'.
+
+        Numbers aren't reused after a delete until the index is rebuilt.
+        """
+
+        return self._max_change_number + 1
+
+    def _insert(self, entry: MarkerEntry):
+        i = bisect_right(self._starts, entry.frameid)
+        self._starts.insert(i, entry.frameid)
+        self._entries.insert(i, entry)
+
+        # Raise the running maximum until it's already high enough, which is
+        # immediately when markers don't overlap
+        if self._max_ends is not None:
+            running = max(self._max_ends[i - 1] if i else 0, entry.end)
+            self._max_ends.insert(i, running)
+            j = i + 1
+            while j < len(self._max_ends) and self._max_ends[j] < running:
+                self._max_ends[j] = running
+                j += 1
+        self._raw[entry.frameid] = _to_raw(entry)
+        self._max_change_number = max(self._max_change_number, _get_change_number(entry))
+
+    def _remove(self, entry: MarkerEntry):
+        i = bisect_left(self._starts, entry.frameid)
+        while self._entries[i] != entry:
+            i += 1
+        del self._starts[i]
+        del self._entries[i]
+        self._raw.pop(entry.frameid, None)
+        self._max_ends = None
+
+    def add(self, timeline, frameid: int, color: str, name: str, note: str = "", duration: int = 1, customdata: str = "") -> MarkerEntry | None:
+        """
+        Add a marker to the timeline and the index.
+
+        Returns:
+            MarkerEntry | None: The new marker, or None if Resolve refused it
+        """
+
+        if not timeline._obj.AddMarker(frameid, color, name, note, duration, customdata):
+            return None
+
+        entry = MarkerEntry(frameid, duration, name, note, color, customdata)
+        self._insert(entry)
+        return entry
+
+    def delete(self, timeline, entry: MarkerEntry) -> bool:
+        """Delete a marker from the timeline and the index"""
+
+        if not timeline._obj.DeleteMarkerAtFrame(entry.frameid):
+            return False
+
+        self._remove(entry)
+        return True
+
+    def set_note(self, timeline, entry: MarkerEntry, note: str) -> MarkerEntry | None:
+        """
+        Change a marker's note.
+
+        Resolve can't edit notes in place, so the marker is replaced. If Resolve
+        refuses the replacement, the original is put back.
+
+        Returns:
+            MarkerEntry | None: The replacement, or None if the note couldn't be changed
+        """
+
+        if not self.delete(timeline, entry):
+            return None
+
+        replaced = self.add(timeline, entry.frameid, entry.color, entry.name, note, entry.duration, entry.customdata)
+        if replaced:
+            return replaced
+
+        if not self.add(timeline, entry.frameid, entry.color, entry.name, entry.note, entry.duration, entry.customdata):
+            logger.error(f"[red]Couldn't restore marker '{entry.name}' at frame {entry.frameid} after changing its note failed")
+        return None
@@ -0,0 +1,233 @@
+"""
+Watches Resolve render jobs and runs follow-up work as they finish.
+
+Jobs are watched in named groups, like the changes from one render or the segments
+of a distributed master. Every active job's status is fetched in one trip to a
+worker thread per poll, so the GUI never waits on Resolve. Progress is tracked in
+frames, which gives each group a render speed and ETA. Callbacks run on the trio
+thread as soon as a job finishes, and once more when its whole group has. Async
+callbacks run as tasks beside the monitor, so slow follow-up work can be handed
+to a worker thread without holding up polling or the GUI.
+"""
+
+import inspect
+import logging
+import time
+from typing import Callable
+
+import trio
+
+from patchwork import jobs
+
+logger = logging.getLogger("rich")
+
+# Weight of the newest speed sample, higher reacts faster but is noisier
+SPEED_SMOOTHING = 0.3
+
+
+class WatchedJob:
+    def __init__(self, job_id: str, frames: int, label: str = ""):
+        self.job_id = job_id
+        self.frames = max(1, frames)
+        self.label = label or job_id
+        self.status = None
+        self.percent = 0
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in jobs.FINISHED_STATUSES
+
+    @property
+    def frames_done(self) -> float:
+        if self.status == jobs.COMPLETE:
+            return self.frames
+        return self.frames * self.percent / 100
+
+
+class JobGroup:
+    def __init__(
+        self,
+        name: str,
+        watched: list[WatchedJob],
+        on_job_finished: Callable[[WatchedJob], None] | None = None,
+        on_finished: Callable[["JobGroup"], None] | None = None,
+    ):
+        self.name = name
+        self.jobs = watched
+        self.on_job_finished = on_job_finished
+        self.on_finished = on_finished
+        self.started = time.perf_counter()
+        self.speed = None
+        self._last_sample = None
+
+    @property
+    def frames(self) -> int:
+        return sum(x.frames for x in self.jobs)
+
+    @property
+    def frames_done(self) -> float:
+        return sum(x.frames_done for x in self.jobs)
+
+    @property
+    def progress(self) -> float:
+        return self.frames_done / self.frames if self.jobs else 1.0
+
+    @property
+    def is_finished(self) -> bool:
+        return all(x.is_finished for x in self.jobs)
+
+    @property
+    def succeeded(self) -> bool:
+        return all(x.status == jobs.COMPLETE for x in self.jobs)
+
+    @property
+    def eta(self) -> float | None:
+        """Seconds left at the current speed, or None until there's a speed"""
+
+        if not self.speed:
+            return None
+        return (self.frames - self.frames_done) / self.speed
+
+    def _sample(self, now: float):
+        frames_done = self.frames_done
+        if self._last_sample:
+            then, frames_then = self._last_sample
+            if now > then and frames_done > frames_then:
+                speed = (frames_done - frames_then) / (now - then)
+                self.speed = speed if self.speed is None else SPEED_SMOOTHING * speed + (1 - SPEED_SMOOTHING) * self.speed
+        self._last_sample = (now, frames_done)
+
+    def summary(self) -> str:
+        """One line of progress, e.g. 'changes: 3/5 jobs, 62%, 48.2 fps, ETA 0:14'"""
+
+        finished = len([x for x in self.jobs if x.is_finished])
+        text = f"{self.name}: {finished}/{len(self.jobs)} jobs, {self.progress:.0%}"
+        if self.speed:
+            text += f", {self.speed:.1f} fps"
+        if self.eta is not None:
+            minutes, seconds = divmod(int(self.eta), 60)
+            text += f", ETA {minutes}:{seconds:02d}"
+        return text
+
+
+class JobMonitor:
+    def __init__(self, resolve, interval: float = 1.0, on_update: Callable[[], None] | None = None):
+        self.resolve = resolve
+        self.interval = interval
+        self.on_update = on_update
+        self.groups: dict[str, JobGroup] = {}
+        self._wake = trio.Event()
+        self._nursery = None
+        self._token = None
+
+    def watch(
+        self,
+        name: str,
+        watched: list[WatchedJob],
+        on_job_finished: Callable[[WatchedJob], None] | None = None,
+        on_finished: Callable[[JobGroup], None] | None = None,
+    ) -> JobGroup:
+        """
+        Start watching a group of jobs, replacing any group with the same name.
+
+        Safe to call from DearPyGui's callback thread, the group's handed to the
+        trio thread and added there.
+        """
+
+        group = JobGroup(name, watched, on_job_finished, on_finished)
+        if self._token is not None and not self._on_trio_thread():
+            trio.from_thread.run_sync(self._add, group, trio_token=self._token)
+        else:
+            self._add(group)
+        return group
+
+    def _add(self, group: JobGroup):
+        self.groups[group.name] = group
+        self._wake.set()
+
+    def _on_trio_thread(self) -> bool:
+        try:
+            return trio.lowlevel.current_trio_token() is self._token
+        except RuntimeError:
+            return False
+
+    def is_watching(self, name: str) -> bool:
+        return name in self.groups
+
+    def summaries(self) -> list[str]:
+        return [x.summary() for x in self.groups.values()]
+
+    def _fetch(self, job_ids: list[str]) -> dict[str, dict]:
+        project = self.resolve.project
+        return {x: jobs.get_job_status(project, x) for x in job_ids}
+
+    async def run(self):
+        """Poll watched jobs until cancelled"""
+
+        self._token = trio.lowlevel.current_trio_token()
+        async with trio.open_nursery() as nursery:
+            self._nursery = nursery
+            await self._poll()
+
+    async def _poll(self):
+        while True:
+
+            if not self.groups:
+                await self._wake.wait()
+                self._wake = trio.Event()
+                continue
+
+            pending = [x for group in self.groups.values() for x in group.jobs if not x.is_finished]
+            statuses = await trio.to_thread.run_sync(self._fetch, [x.job_id for x in pending], cancellable=True)
+            self._apply(pending, statuses, time.perf_counter())
+
+            if self.on_update:
+                self.on_update()
+
+            with trio.move_on_after(self.interval):
+                await self._wake.wait()
+            self._wake = trio.Event()
+
+    def _apply(self, pending: list[WatchedJob], statuses: dict[str, dict], now: float):
+        finished = set()
+        for job in pending:
+            status = statuses.get(job.job_id)
+            if not status:
+                # Deleted from the queue, so it's never going to render
+                status = {"JobStatus": jobs.CANCELLED}
+            job.status = status.get("JobStatus")
+            job.percent = status.get("CompletionPercentage", 0)
+            if job.is_finished:
+                finished.add(job)
+
+        for name, group in list(self.groups.items()):
+            group._sample(now)
+
+            if group.on_job_finished:
+                for job in group.jobs:
+                    if job in finished:
+                        self._call(group.on_job_finished, job)
+
+            if group.is_finished:
+                del self.groups[name]
+                level = "green" if group.succeeded else "yellow"
+                logger.info(f"[{level}]Render jobs finished: {group.summary()}")
+                if group.on_finished:
+                    self._call(group.on_finished, group)
+
+    def _call(self, callback, *args):
+        # A failing follow-up shouldn't stop the monitor
+        try:
+            result = callback(*args)
+        except Exception:
+            logger.exception(f"[red]Render job callback '{getattr(callback, '__name__', callback)}' failed")
+            return
+
+        if inspect.isawaitable(result):
+            self._nursery.start_soon(self._follow_up, callback, result)
+
+    async def _follow_up(self, callback, awaitable):
+        try:
+            await awaitable
+        except Exception:
+            logger.exception(f"[red]Render job callback '{getattr(callback, '__name__', callback)}' failed")
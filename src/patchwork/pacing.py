@@ -0,0 +1,51 @@
+"""
+Frame pacing for the trio/DearPyGui event loop.
+
+Frames are spaced out to a target rate while the user is interacting or state is
+changing. After a quiet spell the loop drops to an idle rate, leaving the CPU to
+Resolve. New snapshots wake it immediately. DearPyGui only collects input while
+rendering a frame, so the first input after idling waits at most one idle frame.
+"""
+
+import time
+
+import trio
+
+
+class FramePacer:
+    def __init__(self, target_fps: float = 60, idle_fps: float = 4, idle_after: float = 2.0):
+        self.frame_time = 1 / target_fps
+        self.idle_frame_time = 1 / idle_fps
+        self.idle_after = idle_after
+        self._last_activity = time.perf_counter()
+        self._frame_start = time.perf_counter()
+        self._wake = trio.Event()
+
+    def mark_active(self):
+        """Note user input. Safe to call from DearPyGui's callback thread."""
+        self._last_activity = time.perf_counter()
+
+    def wake(self):
+        """Render the next frame now. Call from the trio thread."""
+        self.mark_active()
+        self._wake.set()
+
+    @property
+    def is_idle(self) -> bool:
+        return time.perf_counter() - self._last_activity > self.idle_after
+
+    async def wait_for_next_frame(self):
+        """Sleep out the rest of this frame's budget, or until woken"""
+
+        budget = self.idle_frame_time if self.is_idle else self.frame_time
+        remaining = budget - (time.perf_counter() - self._frame_start)
+
+        if remaining > 0:
+            with trio.move_on_after(remaining):
+                await self._wake.wait()
+        else:
+            # Over budget, still let other tasks run
+            await trio.sleep(0)
+
+        self._wake = trio.Event()
+        self._frame_start = time.perf_counter()
@@ -1,29 +1,64 @@
 
-from pydavinci import davinci
-from dearpygui import dearpygui as dpg
-from patchwork.widgets import dialog_box
-from deepdiff import DeepDiff
-import json
-from json import JSONDecodeError
+from patchwork.splice import Segment
+from patchwork import fingerprint
+from patchwork import journal
+from patchwork.history import get_store_dir
+from patchwork.journal import safe_dump
+from patchwork.marker_index import PATCHWORK_MARKER, DETECTED_MARKER
+import hashlib
+import os
 
 
 import logging
 
 logger = logging.getLogger("rich")
 
-resolve = davinci.Resolve()
+# Set by `connect`, after the GUI is up
+resolve = None
 
-def safe_dump(obj, **kwargs):
-  default = lambda o: f"<<non-serializable: {type(o).__qualname__}>>"
-  return json.dumps(obj, default=default, **kwargs)
+class PatchfileError(Exception):
+    pass
+
+# Last fingerprint taken per timeline, recorded with the segments rendered from it
+last_fingerprints = {}
+
+def connect(resolve_instance=None):
+    """Use a Resolve instance for all patch file operations, connecting if none is given"""
+    
+    global resolve
+    if resolve_instance is None:
+        from pydavinci import davinci
+        resolve_instance = davinci.Resolve()
+    resolve = resolve_instance
 
 def get_changes_data()-> dict:
+    """Patchwork markers on the active timeline, as Resolve reports them, keyed by frame"""
+    
+    timeline = resolve.active_timeline
+    raw_markers = timeline._obj.GetMarkers() or {}
+    return {int(frame): data for frame, data in raw_markers.items() if data.get("customData") in (PATCHWORK_MARKER, DETECTED_MARKER)}
+    
+def detect_changes(patchwork_file_data:dict) -> list[tuple[int, int]]:
+    """
+    Diff the active timeline against the fingerprint stored in the patch file
+    
+    Returns:
+        list[tuple[int, int]]: Changed frame ranges, end exclusive
+    """
+    
+    stored = patchwork_file_data.get("fingerprint")
+    if not stored:
+        logger.warning("[yellow]Patch file has no timeline fingerprint to compare against")
+        return []
     
     timeline = resolve.active_timeline
-    return [x.__dict__ for x in timeline.markers if x.customdata == "patchwork_marker"][0]['_data']
+    current = fingerprint.fingerprint(timeline)
+    last_fingerprints[timeline.name] = current
+    
+    return fingerprint.diff(stored, current)
     
 # MANIPULATE PATCHWORK FILE
-def get_current_settings() -> dict:
+def get_current_settings(render_preset:str|None=None) -> dict:
     
     project = resolve.project
     timeline = resolve.active_timeline
@@ -40,65 +75,147 @@ def get_current_settings() -> dict:
             "render_settings":render_settings,
         },
         "changes": get_changes_data(),
-        "render_preset": dpg.get_value("chosen_render_preset"),
+        "render_preset": render_preset,
     }
     return data
 
+def get_settings_digests(settings:dict) -> dict:
+    """
+    A digest of each settings section, from its canonical JSON
+    
+    Serialised like the patch file itself, so a section digests the same before and
+    after a round trip through it.
+    """
+    
+    digests = {}
+    for section, values in settings.items():
+        encoded = safe_dump(values, sort_keys=True, separators=(",", ":")).encode()
+        digests[section] = hashlib.blake2b(encoded, digest_size=16).hexdigest()
+    return digests
+
 def compare(current_settings:dict, patchwork_file:str):
+    """
+    Check the current settings still match the patch file's
+    
+    Digests are compared first. Only sections whose digest differs are diffed, for
+    the report.
+    
+    Raises:
+        PatchfileError: If the project, timeline or settings don't match
+    """
     
     patchwork_file_data = load(patchwork_file)
 
     if current_settings["project_name"] != patchwork_file_data["project_name"]:
-        dialog_box.prompt(
+        raise PatchfileError(
             f"Looks like the tracked file is for a different project: '{patchwork_file_data['project_name']}'\n"
             "Please load the correct patchwork_file for this project, or create a new one."
         )
-        return
     
     if current_settings["timeline_name"] != patchwork_file_data["timeline_name"]:
-        dialog_box.prompt(
+        raise PatchfileError(
             f"Looks like the tracked file is for a different timeline: '{patchwork_file_data['timeline_name']}'\n"
             "Please load the correct patchwork_file for this timeline, or create a new one."
         )
-        return
     
-    settings_diff = DeepDiff(current_settings["settings"], patchwork_file_data["settings"])
-    if settings_diff:
+    stored_settings = patchwork_file_data["settings"]
+    
+    # Older patch files don't store digests
+    stored_digests = patchwork_file_data.get("settings_digests") or get_settings_digests(stored_settings)
+    current_digests = get_settings_digests(current_settings["settings"])
+    
+    changed_sections = [x for x in current_digests.keys() | stored_digests.keys() if current_digests.get(x) != stored_digests.get(x)]
+    if changed_sections:
         
-        print(settings_diff)
-        dialog_box.prompt(
+        # Slow to import, and only needed when something's changed
+        from deepdiff import DeepDiff
+        
+        settings_diff = {
+            x: DeepDiff(current_settings["settings"].get(x), stored_settings.get(x))
+            for x in sorted(changed_sections)
+        }
+        raise PatchfileError(
             "Looks like project settings have been altered since the master file was rendered!\n"
             "You will need to render a master file again, since consistent results cannot be guaranteed with different settings\n"
             f"{settings_diff}"
         )
-        return
     
 def load(patchwork_file):
+    """Patch file contents. Cached, so repeat loads only read what's been appended since."""
     
-    patchwork_file_data = {}
-    with open(patchwork_file) as patchwork_file:
-        patchwork_file_data = json.loads(patchwork_file.read())
-        
-    return patchwork_file_data
+    return journal.load(patchwork_file)
     
 def update(patchwork_file, writable):
+    """Append new values to the patch file, replacing any with the same keys"""
     
     if not patchwork_file:
         logger.error("[red]No patchwork_file chosen")
         return None
     
-    existing_data = load(patchwork_file)
-    with open(patchwork_file, "w") as json_file:
-        if existing_data:
-            writable.update(existing_data)
-        return json.dump(writable, json_file)
+    journal.update(patchwork_file, writable)
+
+def get_master_path(patchwork_file_path:str, render_settings:dict) -> str:
+    """The master is rendered beside its patch file, with the same name"""
+    
+    stem = os.path.splitext(patchwork_file_path)[0]
+    return f"{stem}.{render_settings['format']}"
+
+def get_segments(patchwork_file_data:dict, kind:str="full") -> list[Segment]:
+    """
+    Rendered segments recorded in the patch file, ready to splice
+    
+    Args:
+        kind (str): Which renders, picture and sound ("full"), sound only ("audio") or subtitles ("subtitle")
+    """
+    
+    return [
+        Segment(x["start"], x["end"], x["path"]) 
+        for x in patchwork_file_data.get("segments", []) 
+        if x.get("kind", "full") == kind
+    ]
         
-def new(patchwork_file_path):
+def new(patchwork_file_path, render_preset:str|None=None):
+    """
+    Write a new patch file for the active timeline, and queue its fingerprint render
+    
+    Raises:
+        PatchfileError: If the patch file can't be written, or has a history to lose
+    """
+    
+    # Starting over re-renders the master the history's versions were spliced into
+    if os.path.exists(patchwork_file_path):
+        try:
+            history = journal.load(patchwork_file_path).get("history", [])
+        except journal.JournalError:
+            history = []
+        if history:
+            store = get_store_dir(patchwork_file_path)
+            raise PatchfileError(
+                f"'{patchwork_file_path}' has a history of spliced versions, stored in '{store}'.\n"
+                "Starting it over would overwrite the master they're spliced from.\n"
+                "Choose a new patch file, or delete this one and its history folder first."
+            )
+    
+    timeline = resolve.active_timeline
+    current = fingerprint.fingerprint(timeline)
+    last_fingerprints[timeline.name] = current
+    
+    data = get_current_settings(render_preset)
+    data["fingerprint"] = current
+    data["settings_digests"] = get_settings_digests(data["settings"])
+    data["master"] = get_master_path(patchwork_file_path, data["settings"]["render_settings"])
+    data["segments"] = []
     
-    data = get_current_settings()
+    # Rendered alongside the master, hashed the first time it's needed
+    from patchwork import phash
+    job_id, proxy = phash.queue_fingerprint_render(
+        resolve.project,
+        os.path.dirname(os.path.abspath(patchwork_file_path)),
+        f"{os.path.splitext(os.path.basename(patchwork_file_path))[0]} - fingerprint",
+    )
+    data["pixel_fingerprint"] = {"proxy": proxy, "job_id": job_id}
     
     try:
-        with open(patchwork_file_path, "w") as patchwork_file:
-            patchwork_file.write(safe_dump(data, sort_keys=True))
+        journal.create(patchwork_file_path, data)
     except PermissionError:
-        dialog_box.prompt("You don't have write permissions to this folder. Try another one.")
+        raise PatchfileError("You don't have write permissions to this folder. Try another one.")
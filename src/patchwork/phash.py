@@ -0,0 +1,190 @@
+"""
+Pixel-level change detection from low-res fingerprint renders.
+
+Some changes never show up in timeline metadata, like an edited Fusion comp or
+relinked media with the same name. For those, Resolve renders a tiny proxy of the
+whole timeline, and each frame is reduced to a 64 bit difference hash plus its
+mean luma. Comparing the hash arrays of two proxies gives the changed frames.
+"""
+
+import logging
+import os
+import subprocess
+
+import numpy as np
+
+logger = logging.getLogger("rich")
+
+PROXY_WIDTH = 64
+PROXY_HEIGHT = 36
+
+# The difference hash compares neighbouring pixels of a 9x8 thumbnail
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+
+HASH_DTYPE = np.dtype([("dhash", "<u8"), ("luma", "u1")])
+
+# Proxy encodes are lossy, allow a little noise before calling a frame changed
+DEFAULT_BIT_THRESHOLD = 4
+DEFAULT_LUMA_THRESHOLD = 3
+
+
+class PixelHashError(Exception):
+    pass
+
+
+def queue_fingerprint_render(project, target_dir: str, name: str) -> tuple[str, str]:
+    """
+    Queue a tiny, video-only render of the whole timeline.
+
+    The project's render format and codec are restored afterwards, so settings
+    checks against the patch file aren't thrown off.
+
+    Returns:
+        tuple[str, str]: The job id and the path the proxy will be rendered to
+    """
+
+    previous = project.current_render_format_and_codec
+    project.set_render_format_and_codec("mp4", "H264")
+    project.set_render_settings(
+        {
+            "SelectAllFrames": True,
+            "TargetDir": target_dir,
+            "CustomName": name,
+            "FormatWidth": PROXY_WIDTH,
+            "FormatHeight": PROXY_HEIGHT,
+            "ExportVideo": True,
+            "ExportAudio": False,
+        }
+    )
+    job_id = project.add_renderjob()
+    project.set_render_format_and_codec(previous["format"], previous["codec"])
+
+    return job_id, os.path.join(target_dir, f"{name}.mp4")
+
+
+def hash_frames(frames: np.ndarray) -> np.ndarray:
+    """
+    Hash a batch of grayscale thumbnails.
+
+    Args:
+        frames (np.ndarray): uint8 array shaped `(n, HASH_HEIGHT, HASH_WIDTH)`
+
+    Returns:
+        np.ndarray: One `HASH_DTYPE` record per frame
+    """
+
+    bits = frames[:, :, 1:] > frames[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(frames), -1), axis=1)
+
+    hashes = np.empty(len(frames), dtype=HASH_DTYPE)
+    hashes["dhash"] = packed.view(">u8").ravel()
+    hashes["luma"] = frames.mean(axis=(1, 2)).round()
+    return hashes
+
+
+def hash_video(path: str) -> np.ndarray:
+    """
+    Decode a proxy to 9x8 grayscale with ffmpeg and hash every frame.
+
+    Raises:
+        PixelHashError: If ffmpeg is missing or can't decode the proxy
+    """
+
+    command = [
+        "ffmpeg", "-v", "error", "-i", path,
+        "-map", "0:v:0", "-an",
+        "-vf", f"scale={HASH_WIDTH}:{HASH_HEIGHT}:flags=area,format=gray",
+        "-f", "rawvideo", "-",
+    ]
+
+    try:
+        result = subprocess.run(command, check=True, capture_output=True)
+    except FileNotFoundError:
+        raise PixelHashError("ffmpeg was not found on PATH")
+    except subprocess.CalledProcessError as e:
+        raise PixelHashError(f"ffmpeg couldn't decode '{path}':\n{e.stderr.decode(errors='replace')}")
+
+    frames = np.frombuffer(result.stdout, dtype=np.uint8).reshape(-1, HASH_HEIGHT, HASH_WIDTH)
+    logger.debug(f"[magenta]Hashed {len(frames)} frames of '{path}'")
+    return hash_frames(frames)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """Count set bits of a uint64 array"""
+
+    values = values - ((values >> 1) & 0x5555555555555555)
+    values = (values & 0x3333333333333333) + ((values >> 2) & 0x3333333333333333)
+    values = (values + (values >> 4)) & 0x0F0F0F0F0F0F0F0F
+    return (values * 0x0101010101010101) >> 56
+
+
+def changed_frames(
+    old: np.ndarray,
+    new: np.ndarray,
+    bit_threshold: int = DEFAULT_BIT_THRESHOLD,
+    luma_threshold: int = DEFAULT_LUMA_THRESHOLD,
+) -> np.ndarray:
+    """
+    Flag frames whose hashes differ by more than the thresholds.
+
+    Frames past the end of the shorter array always count as changed.
+
+    Returns:
+        np.ndarray: Boolean mask, as long as the longer array
+    """
+
+    length = min(len(old), len(new))
+    distance = _popcount(old["dhash"][:length] ^ new["dhash"][:length])
+    luma_delta = np.abs(old["luma"][:length].astype(np.int16) - new["luma"][:length])
+
+    mask = np.ones(max(len(old), len(new)), dtype=bool)
+    mask[:length] = (distance > bit_threshold) | (luma_delta > luma_threshold)
+    return mask
+
+
+def mask_to_ranges(mask: np.ndarray) -> list[tuple[int, int]]:
+    """Turn a boolean frame mask into `(start, end)` ranges, end exclusive"""
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+    return list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+
+
+def compare(old: np.ndarray, new: np.ndarray, **thresholds) -> list[tuple[int, int]]:
+    """Changed frame ranges between two hash arrays"""
+
+    return mask_to_ranges(changed_frames(old, new, **thresholds))
+
+
+def get_hashes_path(patchwork_file: str) -> str:
+    return f"{os.path.splitext(patchwork_file)[0]}.phash.npy"
+
+
+def save(path: str, hashes: np.ndarray):
+    np.save(path, hashes, allow_pickle=False)
+
+
+def load(path: str) -> np.ndarray:
+    return np.load(path, allow_pickle=False)
+
+
+def get_baseline(patchwork_file: str, proxy: str | None) -> np.ndarray | None:
+    """
+    Get the hashes of the master's fingerprint render.
+
+    They're computed from the proxy the first time and saved beside the patch file.
+
+    Returns:
+        np.ndarray | None: The hashes, or None if the proxy hasn't been rendered yet
+    """
+
+    hashes_path = get_hashes_path(patchwork_file)
+    if os.path.exists(hashes_path):
+        return load(hashes_path)
+
+    if not proxy or not os.path.exists(proxy):
+        return None
+
+    hashes = hash_video(proxy)
+    save(hashes_path, hashes)
+    return hashes
@@ -0,0 +1,705 @@
+"""
+Patching steps that don't need the GUI, shared by it and the command line.
+
+Nothing here imports DearPyGui. Problems raise `PipelineError` with a message
+ready for the user: the GUI prompts with it, the CLI prints it.
+"""
+
+import logging
+import os
+from typing import NamedTuple
+
+from patchwork import checksums
+from patchwork import distribute
+from patchwork import fingerprint
+from patchwork import history
+from patchwork import keyframes
+from patchwork import patchfile
+from patchwork import splice
+from patchwork import submission
+from patchwork import tracing
+from patchwork.config import cache_dir
+from patchwork.config import default_configuration as defaults
+from patchwork.marker_index import MarkerIndex
+from patchwork.segment_cache import SegmentCache, make_key
+
+logger = logging.getLogger("rich")
+
+
+class PipelineError(Exception):
+    pass
+
+
+class Plan(NamedTuple):
+    """Segments covering the current changes"""
+
+    reused: list[dict]
+    """Cached renders and jobs already submitted, as recorded in the patch file"""
+
+    planned: list[tuple[int, int, str, str, str]]
+    """`(start, end, label, key, kind)` of each job still to queue"""
+
+    changes: int
+
+    hand_placed: frozenset = frozenset()
+    """Keys of ranges holding hand-placed changes, which the segment cache can't vouch for"""
+
+    with_sound: frozenset = frozenset()
+    """Keys of full renders whose sound may have changed too"""
+
+
+def get_segment_cache() -> SegmentCache | None:
+    """The segment cache as configured, or None if it's turned off"""
+
+    cache_size = defaults["render"].get("segment_cache_size", 20)
+    if not cache_size:
+        return None
+    return SegmentCache(os.path.join(cache_dir, "segments"), int(cache_size * 1024**3))
+
+
+def _load(patchwork_file: str) -> dict:
+    try:
+        return patchfile.load(patchwork_file)
+    except FileNotFoundError:
+        raise PipelineError(f"Patch file '{patchwork_file}' doesn't exist")
+
+
+def get_change_duration(patchwork_file: str | None, frame_rate) -> int:
+    """
+    Frames a new change spans by default.
+
+    All-intra masters can be patched a frame at a time. Long-GOP masters get
+    two seconds, since a change will be widened to the keyframes around it anyway.
+    """
+
+    padded = int(frame_rate) * 2
+    if not patchwork_file:
+        return padded
+
+    patch_data = _load(patchwork_file)
+    master = patch_data.get("master")
+    if master and os.path.exists(master):
+        try:
+            intra_only = keyframes.probe(master).intra_only
+        except keyframes.KeyframeError as e:
+            logger.warning(f"[yellow]Couldn't read the master's codec: {e}")
+            return padded
+    else:
+        # Not rendered yet, go by the codec it'll be rendered with
+        codec = patch_data.get("settings", {}).get("render_settings", {}).get("codec", "")
+        intra_only = keyframes.is_intra_render_codec(codec)
+
+    return 1 if intra_only else padded
+
+
+@tracing.traced("new")
+def new(resolve, patchwork_file: str, render_preset: str) -> dict:
+    """
+    Write a new patch file for the active timeline.
+
+    The preset's loaded first, so the patch file records its format and codec.
+    """
+
+    if not render_preset:
+        raise PipelineError("No render preset chosen.\nPlease choose one before continuing.")
+
+    resolve.project.load_render_preset(render_preset)
+    try:
+        patchfile.new(patchwork_file, render_preset)
+    except patchfile.PatchfileError as e:
+        raise PipelineError(str(e))
+    return patchfile.load(patchwork_file)
+
+
+@tracing.traced("queue_master")
+def queue_master(resolve, patchwork_file: str, render_preset: str, nodes: int) -> list[dict]:
+    """
+    Queue the master for a new patch file, split across render nodes if there's more than one.
+
+    Returns:
+        list[dict]: Master segments with their job ids, or the whole master as one
+    """
+
+    project = resolve.project
+    timeline = resolve.active_timeline
+    patch_data = patchfile.load(patchwork_file)
+
+    target_dir = os.path.dirname(os.path.abspath(patchwork_file))
+    name = os.path.splitext(os.path.basename(patchwork_file))[0]
+    total_frames = timeline._obj.GetEndFrame() - timeline._obj.GetStartFrame()
+
+    if nodes <= 1:
+        project.load_render_preset(render_preset)
+        project.set_render_settings({"SelectAllFrames": True, "TargetDir": target_dir, "CustomName": name})
+        job_id = project.add_renderjob()
+        logger.info(f"[cyan]Queued master render: {job_id}")
+        return [{"start": 0, "end": total_frames, "path": patch_data["master"], "job_id": job_id}]
+
+    frame_rate = timeline.settings.frame_rate
+    ranges = distribute.split(
+        total_frames,
+        nodes * distribute.SEGMENTS_PER_NODE,
+        cut_points=distribute.get_edit_points(patch_data["fingerprint"]),
+        tolerance=int(frame_rate) * 10,
+    )
+    segments = distribute.queue_segments(project, ranges, render_preset, target_dir, name)
+    patchfile.update(patchwork_file, {"master_segments": segments})
+
+    makespan = distribute.estimate_makespan(ranges, nodes)
+    logger.info(f"[cyan]Queued {len(segments)} master segments across {nodes} nodes, busiest renders {makespan} of {total_frames} frames")
+    return segments
+
+
+@tracing.traced("join_master")
+def join_master(patchwork_file: str, segments: list[dict]) -> str:
+    """Join rendered master segments into the master, removing them after"""
+
+    master = _load(patchwork_file)["master"]
+    try:
+        distribute.join([splice.Segment(x["start"], x["end"], x["path"]) for x in segments], master)
+    except splice.SpliceError as e:
+        logger.error(f"[red]{e}")
+        raise PipelineError(f"Couldn't join the master segments:\n{e}")
+
+    for x in segments:
+        os.remove(x["path"])
+
+    patchfile.update(patchwork_file, {"master_segments": []})
+    logger.info(f"[green]Joined master: '{master}'")
+    return master
+
+
+@tracing.traced("plan")
+def plan(resolve, patchwork_file: str, render_preset: str, markers: MarkerIndex | None = None, segment_cache: SegmentCache | None = None) -> Plan:
+    """
+    Work out which segments the current changes need, without queuing anything.
+
+    Args:
+        markers (MarkerIndex, optional): Index to reconcile and read changes from, a new one if not given
+        segment_cache (SegmentCache, optional): Cache to reuse renders from
+    """
+
+    project = resolve.project
+    timeline = resolve.active_timeline
+    markers = markers if markers is not None else MarkerIndex()
+    markers.reconcile(timeline)
+    patchwork_markers = markers.changes
+
+    patch_data = _load(patchwork_file)
+
+    if not patch_data["project_name"] == project.name:
+        raise PipelineError(
+            "The active project doesn't match the linked patch file\n"
+            "Please load the correct file or change project."
+        )
+
+    if not patch_data["timeline_name"] == timeline.name:
+        raise PipelineError(
+            "The active timeline doesn't match the linked patch file\n"
+            "Please load the correct file or change timeline."
+        )
+
+    if not patch_data.get("render_preset"):
+        raise PipelineError("Render preset has not been defined within the patchfile!")
+
+    if not render_preset:
+        raise PipelineError("No render preset chosen.\nPlease choose one before continuing.")
+
+    current_settings = patchfile.get_current_settings(render_preset)
+    try:
+        with tracing.span("compare_settings"):
+            patchfile.compare(current_settings, patchwork_file)
+    except patchfile.PatchfileError as e:
+        raise PipelineError(str(e))
+
+    with tracing.span("fingerprint"):
+        current_fingerprint = fingerprint.fingerprint(timeline)
+    patchfile.last_fingerprints[timeline.name] = current_fingerprint
+
+    # Detected changes that leave the picture alone only need their tracks rendered
+    change_ranges = [(x.frameid, x.frameid + x.duration, x.name) for x in patchwork_markers]
+    stored_fingerprint = patch_data.get("fingerprint")
+    if stored_fingerprint:
+        track_types = fingerprint.changed_track_types(stored_fingerprint, current_fingerprint, [x[:2] for x in change_ranges])
+    else:
+        track_types = [set()] * len(change_ranges)
+    kinds = [submission.get_kind(x, marker.is_detected) for x, marker in zip(track_types, patchwork_markers)]
+
+    # Long-GOP masters can only be cut on keyframes
+    frame_rate = timeline.settings.frame_rate
+    index = None
+    master = patch_data.get("master")
+    if master and os.path.exists(master):
+        try:
+            index = keyframes.get_index(patchwork_file, master, frame_rate)
+        except keyframes.KeyframeError as e:
+            raise PipelineError(f"Couldn't read keyframes from the master:\n{e}")
+    else:
+        logger.warning("[yellow]Master not found, change ranges won't be snapped to keyframes")
+
+    def snap(ranges: list[tuple[int, int, str]]) -> list[tuple[int, int, str]]:
+        if not index:
+            return ranges
+        return [(*index.snap(start, end), name) for start, end, name in ranges]
+
+    # Snapping can widen neighbouring changes into each other, and close ones are cheaper as one job
+    merge_gap = defaults["render"].get("merge_gap", 24)
+    full = submission.coalesce(snap([x for x, kind in zip(change_ranges, kinds) if kind == submission.FULL]), merge_gap)
+    audio = submission.coalesce([x for x, kind in zip(change_ranges, kinds) if kind == submission.AUDIO], merge_gap)
+
+    # Full renders carry sound too, so sound changes they overlap go along with them
+    while overlapping := [x for x in audio if any(x[0] < y[1] and y[0] < x[1] for y in full)]:
+        audio = [x for x in audio if x not in overlapping]
+        full = submission.coalesce(full + snap(overlapping), merge_gap)
+
+    change_ranges = [(*x, submission.FULL) for x in full] + [(*x, submission.AUDIO) for x in audio]
+    if any("subtitle" in x for x in track_types):
+        total_frames = timeline._obj.GetEndFrame() - timeline._obj.GetStartFrame()
+        change_ranges.append((0, total_frames, "Subtitles", submission.SUBTITLE))
+
+    # Key each range by what it renders
+    settings_digests = patchfile.get_settings_digests(current_settings["settings"])
+    range_digests = fingerprint.range_digests(current_fingerprint, [(start, end) for start, end, _, _ in change_ranges])
+    keys = [
+        make_key(digest, settings_digests, render_preset, start, end, kind)
+        for digest, (start, end, _, kind) in zip(range_digests, change_ranges)
+    ]
+
+    # A hand-placed change can be an edit the fingerprint can't see, like a grade tweak,
+    # so a render of the same key may be stale
+    hand_ranges = [(x.frameid, x.frameid + x.duration) for x in patchwork_markers if not x.is_detected]
+    hand_placed = frozenset(
+        key for (start, end, _, kind), key in zip(change_ranges, keys)
+        if kind != submission.SUBTITLE and any(start < y[1] and y[0] < end for y in hand_ranges)
+    )
+
+    # Only picture can be patched in place, so note which full renders change sound too.
+    # Hand-placed changes and ones the tracks don't show could be anything.
+    sound_ranges = [
+        (x.frameid, x.frameid + x.duration) for x, types in zip(patchwork_markers, track_types)
+        if not x.is_detected or "audio" in types or not types
+    ]
+    with_sound = frozenset(
+        key for (start, end, _, kind), key in zip(change_ranges, keys)
+        if kind == submission.FULL and any(start < y[1] and y[0] < end for y in sound_ranges)
+    )
+
+    # Rendering again shouldn't queue the same jobs twice
+    reusable = submission.get_reusable(project, patch_data.get("segments", []), hand_placed)
+
+    reused = []
+    planned = []
+    for (start, end, name, kind), key in zip(change_ranges, keys):
+
+        cached = segment_cache.get(key) if segment_cache and key not in hand_placed else None
+        if cached:
+            reused.append({"start": start, "end": end, "path": cached, "cache_key": key, "cached": True, "kind": kind})
+        elif key in reusable:
+            reused.append(reusable[key])
+        else:
+            planned.append((start, end, name, key, kind))
+
+    return Plan(reused, planned, len(patchwork_markers), hand_placed, with_sound)
+
+
+@tracing.traced("submit")
+def submit(resolve, patchwork_file: str, planned: Plan, render_preset: str) -> list[dict]:
+    """
+    Queue a plan's jobs and record every segment in the patch file.
+
+    Returns:
+        list[dict]: All of the plan's segments, in timeline order
+    """
+
+    project = resolve.project
+    timeline = resolve.active_timeline
+
+    # Segments render beside the patch file so the splice can find them
+    target_dir = os.path.dirname(os.path.abspath(patchwork_file))
+    queued = submission.submit(project, planned.planned, render_preset, target_dir, f"{project.name} {timeline.name}")
+    for x in queued:
+        if x["cache_key"] in planned.hand_placed:
+            x["hand_placed"] = True
+    segments = sorted(planned.reused + queued, key=lambda x: x["start"])
+    for x in segments:
+        if x["kind"] == submission.FULL:
+            x["with_sound"] = x.get("cache_key") in planned.with_sound
+
+    logger.info(
+        f"[cyan]{len(segments)} segments for {planned.changes} changes: "
+        f"{len(queued)} queued, {len(segments) - len(queued)} reused"
+    )
+    # Kept with the segments, so the version they splice into records what they show
+    patchfile.update(patchwork_file, {"segments": segments, "segments_fingerprint": patchfile.last_fingerprints.get(timeline.name)})
+    return segments
+
+
+def splice_changes(resolve, patchwork_file: str, segment_cache: SegmentCache | None = None, in_place: bool | None = None, label: str = "") -> str:
+    """
+    Splice rendered changes into the master, recording the result as a new version.
+
+    Args:
+        in_place (bool, optional): Patch the master itself rather than writing a
+            patched copy, `splice_in_place` from defaults.toml if not given
+        label (str, optional): Label for the version in the history
+
+    Returns:
+        str: Path of the patched master
+    """
+
+    frame_rate = resolve.active_timeline.settings.frame_rate
+    return splice_rendered(patchwork_file, frame_rate, segment_cache, in_place, label)
+
+
+@tracing.traced("splice")
+def splice_rendered(patchwork_file: str, frame_rate, segment_cache: SegmentCache | None = None, in_place: bool | None = None, label: str = "") -> str:
+    """
+    `splice_changes` without Resolve, so it can run on a worker thread.
+
+    Args:
+        frame_rate: Timeline frame rate, as reported by Resolve
+
+    Returns:
+        str: Path of the patched master
+    """
+
+    patch_data = _load(patchwork_file)
+    master = patch_data.get("master")
+    segments = patchfile.get_segments(patch_data)
+    audio_segments = patchfile.get_segments(patch_data, submission.AUDIO)
+    subtitles = patchfile.get_segments(patch_data, submission.SUBTITLE)
+
+    if not master:
+        raise PipelineError("The linked patch file doesn't reference a master file!")
+
+    if not (segments or audio_segments or subtitles):
+        raise PipelineError("Oops, no rendered changes to splice.\nRender them first.")
+
+    # Cached segments can be evicted between render and splice
+    missing = [x.path for x in segments + audio_segments + subtitles if not os.path.exists(x.path)]
+    if missing:
+        raise PipelineError("Some rendered changes are missing, render them again:\n" + "\n".join(missing))
+
+    if in_place is None:
+        in_place = defaults["render"].get("splice_in_place", False)
+
+    # Full renders carry sound, which in-place patching would drop. Segments
+    # recorded before this was tracked are assumed to change it.
+    with_sound = any(x.get("with_sound", True) for x in patch_data.get("segments", []) if x.get("kind", submission.FULL) == submission.FULL)
+    if in_place and (audio_segments or subtitles or with_sound):
+        logger.warning("[yellow]Only picture can be patched in place, writing a patched copy for the sound and subtitle changes")
+        in_place = False
+
+    if in_place:
+        output = _splice_in_place(patchwork_file, patch_data, master, segments)
+
+    else:
+        # A copy starts from the master as rendered
+        if patch_data.get("in_place"):
+            rollback(patchwork_file)
+
+        output = splice.patched_output_path(master)
+
+        try:
+            splice.splice(
+                master,
+                segments,
+                output,
+                frame_rate,
+                audio_segments=audio_segments,
+                subtitles=subtitles[-1].path if subtitles else None,
+            )
+        except splice.SpliceError as e:
+            logger.error(f"[red]{e}")
+            raise PipelineError(f"Couldn't splice changes into the master:\n{e}")
+
+    # Only cache renders that spliced cleanly, and whose key says what they show
+    if segment_cache:
+        for x in patch_data.get("segments", []):
+            if x.get("cache_key") and not x.get("cached") and not x.get("hand_placed"):
+                segment_cache.put(x["cache_key"], x["path"])
+
+    patchfile.update(patchwork_file, {"patched_master": output})
+    history.record(patchwork_file, master, patch_data.get("segments", []), output, frame_rate, patch_data.get("segments_fingerprint"), label)
+    return output
+
+
+def _splice_in_place(patchwork_file: str, patch_data: dict, master: str, segments: list[splice.Segment]) -> str:
+
+    from patchwork import inplace
+
+    try:
+        # Always patch the untouched master, so patches don't pile up
+        if patch_data.get("in_place"):
+            inplace.rollback(master, patch_data["in_place"])
+
+        patch = inplace.prepare(master, segments)
+
+        # Saved first, so an interrupted patch can still be rolled back
+        patchfile.update(patchwork_file, {"in_place": patch.rollback_state()})
+        inplace.apply(master, patch)
+
+    except inplace.InPlaceError as e:
+        logger.error(f"[red]{e}")
+        raise PipelineError(f"Couldn't patch the master in place:\n{e}")
+
+    return master
+
+
+@tracing.traced("rollback")
+def rollback(patchwork_file: str) -> str:
+    """
+    Undo an in-place splice, restoring the master as it was rendered.
+
+    Returns:
+        str: Path of the restored master
+    """
+
+    from patchwork import inplace
+
+    patch_data = _load(patchwork_file)
+    master = patch_data.get("master")
+    if not patch_data.get("in_place"):
+        raise PipelineError("The master hasn't been patched in place, there's nothing to roll back.")
+
+    try:
+        inplace.rollback(master, patch_data["in_place"])
+    except (inplace.InPlaceError, FileNotFoundError) as e:
+        raise PipelineError(f"Couldn't roll back the master:\n{e}")
+
+    patchfile.update(patchwork_file, {"in_place": None, "patched_master": None})
+    return master
+
+
+def log(patchwork_file: str) -> list[dict]:
+    """Versions in the patch file's history, oldest first"""
+
+    return _load(patchwork_file).get("history", [])
+
+
+@tracing.traced("materialize")
+def materialize(patchwork_file: str, version: int, output: str | None = None) -> str:
+    """
+    Write out any version in the history again, by splicing its segments into its base.
+
+    Args:
+        output (str, optional): Where to write it, beside its base if not given
+
+    Returns:
+        str: Path of the materialized version
+    """
+
+    patch_data = _load(patchwork_file)
+    try:
+        chosen = history.get_version(patch_data, version)
+    except history.HistoryError as e:
+        raise PipelineError(str(e))
+
+    # Splicing reads the base as it is on disk
+    if patch_data.get("in_place") and chosen["base"] == patch_data.get("master"):
+        raise PipelineError("The master is patched in place. Roll it back before materializing a version.")
+
+    if output is None:
+        stem, ext = os.path.splitext(chosen["base"])
+        output = f"{stem} - v{chosen['version']}{ext}"
+
+    try:
+        return history.materialize(chosen, output)
+    except history.HistoryError as e:
+        logger.error(f"[red]{e}")
+        raise PipelineError(str(e))
+
+
+@tracing.traced("squash")
+def squash(patchwork_file: str, version: int | None = None) -> str:
+    """
+    Fold a version into a new base master, dropping the versions before it and the
+    segments only they used.
+
+    Args:
+        version (int, optional): Version to squash, the latest if not given
+
+    Returns:
+        str: Path of the new base master
+    """
+
+    patch_data = _load(patchwork_file)
+    try:
+        chosen = history.get_version(patch_data, version)
+    except history.HistoryError as e:
+        raise PipelineError(str(e))
+
+    if not chosen["segments"]:
+        raise PipelineError(f"Version {chosen['version']} is already the base, there's nothing to squash.")
+
+    # Checked before materializing, so a squash that can't happen writes nothing
+    dependent = history.get_dependents(patch_data, chosen["version"])
+    if dependent:
+        raise PipelineError(
+            f"Versions {', '.join(str(x) for x in dependent)} keep parts of the old master that version {chosen['version']} changed.\n"
+            "Squash the latest version instead."
+        )
+
+    base = materialize(patchwork_file, chosen["version"])
+    try:
+        history.squash(patchwork_file, chosen["version"], base)
+    except history.HistoryError as e:
+        raise PipelineError(str(e))
+
+    fingerprint_data = history.load_fingerprint(patchwork_file, chosen["fingerprint"]) if chosen.get("fingerprint") else None
+    if fingerprint_data is None:
+        logger.warning("[yellow]The squashed version has no timeline fingerprint, changes are still detected against the old master")
+
+    values = {"master": base, "in_place": None, "pixel_fingerprint": {}}
+    if fingerprint_data is not None:
+        values["fingerprint"] = fingerprint_data
+    patchfile.update(patchwork_file, values)
+
+    # Pixel hashes were of the old master
+    from patchwork import phash
+
+    hashes_path = phash.get_hashes_path(patchwork_file)
+    if os.path.exists(hashes_path):
+        os.remove(hashes_path)
+
+    logger.info(f"[green]Squashed version {chosen['version']} into '{base}'")
+    return base
+
+
+@tracing.traced("verify")
+def verify(patchwork_file: str) -> list[str]:
+    """
+    Check a patch file's master, segments and patched master are all in order.
+
+    Frames around every splice are checksummed against their sources, and the
+    results recorded in the patch file under "verification".
+
+    Returns:
+        list[str]: Problems found, empty if there are none
+    """
+
+    patch_data = _load(patchwork_file)
+    problems = []
+
+    master = patch_data.get("master")
+    if not master or not os.path.exists(master):
+        problems.append(f"Master '{master}' doesn't exist")
+
+    for x in patchfile.get_segments(patch_data):
+        if not os.path.exists(x.path):
+            problems.append(f"Segment {x.start}-{x.end} '{x.path}' doesn't exist")
+
+    patched = patch_data.get("patched_master")
+    if not patched:
+        problems.append("Nothing has been spliced yet")
+    elif not os.path.exists(patched):
+        problems.append(f"Patched master '{patched}' doesn't exist")
+
+    if problems:
+        return problems
+
+    # A patch replaces frames, it never adds or drops them
+    frame_rate = patch_data.get("settings", {}).get("timeline_settings", {}).get("timelineFrameRate", 24)
+    try:
+        master_frames = keyframes.count_frames(patchwork_file, master, frame_rate)
+        patched_frames = keyframes.count_frames(patchwork_file, patched, frame_rate)
+    except keyframes.KeyframeError as e:
+        return [f"Couldn't read frames: {e}"]
+
+    if master_frames != patched_frames:
+        problems.append(f"Patched master has {patched_frames} frames, the master has {master_frames}")
+
+    segments = patchfile.get_segments(patch_data)
+
+    # Patched in place, the master's original samples are only reachable through the rollback state
+    if patch_data.get("in_place") and os.path.abspath(patched) == os.path.abspath(master):
+        from patchwork import inplace
+
+        try:
+            results = inplace.verify(master, patch_data["in_place"], segments, checksums.WINDOW)
+        except inplace.InPlaceError as e:
+            return problems + [f"Couldn't check the in-place patch: {e}"]
+
+    else:
+        # Only frames near the cuts can go wrong, so only those are decoded
+        try:
+            results = checksums.verify(master, patched, segments, frame_rate) if segments else []
+        except checksums.ChecksumError as e:
+            return problems + [f"Couldn't checksum frames: {e}"]
+
+    patchfile.update(
+        patchwork_file,
+        {
+            "verification": {
+                "patched_master": patched,
+                "segments": [x._asdict() for x in results],
+            }
+        },
+    )
+
+    for x in results:
+        if not x.ok:
+            problems.append(f"Segment {x.start}-{x.end} doesn't match its sources at frames {', '.join(str(y) for y in x.mismatched)}")
+
+    return problems
+
+
+@tracing.traced("qc")
+def check_changes(patchwork_file: str) -> list:
+    """
+    Scan the rendered changes for black, green, frozen and offline frames.
+
+    Defects are recorded in the patch file under "qc". Freezes are only found
+    once they're held for `freeze_frames` from defaults.toml's [qc].
+
+    Returns:
+        list[defects.Defect]: Defects found, in timeline frames
+    """
+
+    # NumPy is slow to import, only load it when scanning
+    from patchwork import defects
+
+    segments = patchfile.get_segments(_load(patchwork_file))
+    if not segments:
+        raise PipelineError("Oops, no rendered changes to check.\nRender them first.")
+
+    missing = [x.path for x in segments if not os.path.exists(x.path)]
+    if missing:
+        raise PipelineError("Some rendered changes are missing, render them again:\n" + "\n".join(missing))
+
+    settings = defaults.get("qc", {})
+    slate = settings.get("offline_slate") or None
+    try:
+        found = defects.scan_segments(segments, slate, freeze_frames=settings.get("freeze_frames", defects.FREEZE_FRAMES))
+    except defects.DefectError as e:
+        logger.error(f"[red]{e}")
+        raise PipelineError(f"Couldn't check the rendered changes:\n{e}")
+
+    patchfile.update(patchwork_file, {"qc": [x._asdict() for x in found]})
+    return found
+
+
+def mark_defects(resolve, found: list, markers: MarkerIndex | None = None) -> int:
+    """
+    Mark defects on the active timeline, replacing markers from earlier checks.
+
+    Returns:
+        int: Markers added
+    """
+
+    from patchwork.defects import QC_MARKER
+
+    timeline = resolve.active_timeline
+    markers = markers if markers is not None else MarkerIndex()
+    markers.reconcile(timeline)
+
+    for x in [x for x in markers if x.customdata == QC_MARKER]:
+        markers.delete(timeline, x)
+
+    added = 0
+    for start, end, kind in found:
+        if markers.add(timeline, start, "Red", f"QC - {kind}", duration=end - start, customdata=QC_MARKER):
+            added += 1
+        else:
+            logger.warning(f"[yellow]Couldn't mark {kind} frames at {start}, there's already a marker there")
+    return added
@@ -0,0 +1,60 @@
+"""
+Background polling of Resolve, so the GUI never waits on IPC.
+
+Snapshots are taken in a worker thread and published over a trio memory channel.
+Only snapshots that differ from the last one are sent. The render loop drains the
+channel without blocking and keeps the newest, so a slow Resolve delays updates
+but never a frame.
+"""
+
+import logging
+
+import trio
+
+from patchwork import snapshot
+from patchwork.snapshot import Snapshot
+
+logger = logging.getLogger("rich")
+
+
+class Poller:
+    def __init__(self, resolve, interval: float = 0.5, on_publish=None):
+        self.resolve = resolve
+        self.interval = interval
+        self.on_publish = on_publish
+        self._wake = trio.Event()
+
+    def request_refresh(self):
+        """Poll again now instead of waiting out the interval. Call from the trio thread."""
+        self._wake.set()
+
+    async def run(self, send_channel: trio.MemorySendChannel):
+        """Poll until cancelled, sending each changed snapshot"""
+
+        previous = snapshot.CLOSED
+        async with send_channel:
+            while True:
+
+                # Abandon the thread on exit rather than waiting on Resolve
+                current = await trio.to_thread.run_sync(snapshot.take, self.resolve, previous, cancellable=True)
+
+                if current != previous:
+                    previous = current
+                    await send_channel.send(current)
+                    if self.on_publish:
+                        self.on_publish()
+
+                with trio.move_on_after(self.interval):
+                    await self._wake.wait()
+                self._wake = trio.Event()
+
+
+def latest(receive_channel: trio.MemoryReceiveChannel) -> Snapshot | None:
+    """Drain every waiting snapshot without blocking, returning the newest"""
+
+    newest = None
+    while True:
+        try:
+            newest = receive_channel.receive_nowait()
+        except (trio.WouldBlock, trio.EndOfChannel):
+            return newest
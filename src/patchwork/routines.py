@@ -1,14 +1,17 @@
 from timecode import Timecode
 from dearpygui import dearpygui as dpg
-from pydavinci.wrappers.marker import MarkerCollection, Marker
-from pydavinci import davinci
-from pydavinci.exceptions import TimelineNotFound
 from patchwork.widgets import dialog_box
+from patchwork import async_helpers
+from patchwork.snapshot import Snapshot
+from patchwork.marker_index import MarkerIndex, MarkerEntry
 import trio
 import logging
 
 logger = logging.getLogger("rich")
 
+# Last text and color set on each status widget
+__displayed = {}
+
 def __compare_state():
     
     current_project = dpg.get_value("current_project")
@@ -19,8 +22,8 @@ def __compare_state():
         dpg.set_value("project_has_changed", False)
     else:
         dpg.set_value("project_has_changed", True)
-        dpg.set_value("environment_has_changed", True)
         logger.debug("PROJECT Environment has changed!")
+        async_helpers.invalidate(f"project:{last_project}")
         
     current_timeline = dpg.get_value("current_timeline")
     last_timeline = dpg.get_value("last_timeline")
@@ -30,13 +33,17 @@ def __compare_state():
         dpg.set_value("timeline_has_changed", False)
     else:
         dpg.set_value("timeline_has_changed", True)
-        dpg.set_value("environment_has_changed", True)
         logger.debug("TIMELINE Environment has changed!")
+        async_helpers.invalidate(f"timeline:{last_timeline}")
         
+    dpg.set_value(
+        "environment_has_changed",
+        dpg.get_value("project_has_changed") or dpg.get_value("timeline_has_changed"),
+    )
     dpg.set_value("last_project", current_project)
     dpg.set_value("last_timeline", current_timeline)
         
-def __refresh_state():
+def __refresh_state(snapshot:Snapshot):
     
     if not dpg.does_item_exist("state_registry"):
         logger.debug("[magenta]Creating new state registry")
@@ -54,43 +61,33 @@ def __refresh_state():
             dpg.add_bool_value(tag="timeline_is_open", default_value=False)
             dpg.add_bool_value(tag="environment_has_changed", default_value=False)
 
-    try:
-        
-        resolve = davinci.Resolve()
+    if not snapshot.resolve_is_open:
+        logger.warning("[yellow]Resolve is not open")
         
-    except TypeError as e:
-        
-        logger.warning(f"[yellow]Resolve is not open\n{e}")
-        dpg.set_value("resolve_is_open", False)
-        dpg.set_value("project_is_open", False)
-        dpg.set_value("timeline_is_open", False)
-        return
-        
-    except TimelineNotFound as e:
-        
-        logger.warning(f"[yellow]No timeline is open\n{e}")
-        dpg.set_value("resolve_is_open", True)
-        dpg.set_value("project_is_open", True)
-        dpg.set_value("timeline_is_open", False)
-        return
+    elif not snapshot.timeline_is_open:
+        logger.warning("[yellow]No timeline is open")
     
-    else:
-    
-        project_name = str(resolve.project.name)
-        timeline_name = str(resolve.active_timeline.name)
-        dpg.set_value("current_project", project_name)
-        dpg.set_value("last_project", project_name)
-        dpg.set_value("current_timeline",timeline_name)
-        dpg.set_value("last_timeline", timeline_name)
-        
-        dpg.set_value("resolve_is_open", True)
-        dpg.set_value("project_is_open", True)
-        dpg.set_value("timeline_is_open", True)
+    dpg.set_value("current_project", snapshot.project_name or "")
+    dpg.set_value("current_timeline", snapshot.timeline_name or "")
+    dpg.set_value("resolve_is_open", snapshot.resolve_is_open)
+    dpg.set_value("project_is_open", snapshot.project_is_open)
+    dpg.set_value("timeline_is_open", snapshot.timeline_is_open)
 
-def get_environment_state():
-    __refresh_state()
+def get_environment_state(snapshot:Snapshot):
+    """Update the state registry from a new snapshot"""
+    __refresh_state(snapshot)
     __compare_state()
 
+def set_status(tag:str, text:str, color:list[int]):
+    """Set a text widget's value and color, skipping DearPyGui if neither changed"""
+    
+    if __displayed.get(tag) == (text, color):
+        return
+    
+    __displayed[tag] = (text, color)
+    dpg.set_value(tag, text)
+    dpg.configure_item(tag, color=color)
+
 class Timer:
     # keeps track of DPG time since last render
     # note: frame rate speeds up by a factor of 4 to 5
@@ -110,19 +107,19 @@ class Timer:
             return True
         return False
 
-async def get_markers_at_playhead(current_markers:MarkerCollection, current_frame:int) -> list[Marker]:
+async def get_markers_at_playhead(current_markers:MarkerIndex, current_frame:int) -> list[MarkerEntry]:
     
     logger.debug("[magenta]Checking for marker at playhead")
     
     playhead_markers = []
     if current_frame:
     
-        playhead_markers = [x for x in current_markers if current_frame >= x.frameid and current_frame < (x.frameid + x.duration)]
+        playhead_markers = current_markers.at(current_frame)
         
     await trio.sleep(0)
     return playhead_markers 
 
-async def refresh_add_status(current_markers:MarkerCollection, current_timecode:str, current_frame:int):
+async def refresh_add_status(current_markers:MarkerIndex, current_timecode:str, current_frame:int):
     
     logger.debug("[magenta]Refreshing 'Add' status")
     playhead_markers = await get_markers_at_playhead(current_markers, current_frame)
@@ -130,22 +127,18 @@ async def refresh_add_status(current_markers:MarkerCollection, current_timecode:
                 
         # If any patchwork markers overlap
         if len(playhead_markers) > 1:
-            if [x.customdata == "patchwork_marker" for x in playhead_markers]:
-                dpg.set_value("current_timecode_display", f"Multiple overlapping markers, unsupported!")
-                dpg.configure_item("current_timecode_display", color=[250, 0, 0])  
+            if any(x.is_change for x in playhead_markers):
+                set_status("current_timecode_display", f"Multiple overlapping markers, unsupported!", [250, 0, 0])
         
         # If not a patchwork marker
         elif len(playhead_markers) == 1:
-            if not playhead_markers[0].customdata == "patchwork_marker":
-                dpg.set_value("current_timecode_display", f"Not a patchwork marker")
-                dpg.configure_item("current_timecode_display", color=[250, 150, 50])  
+            if not playhead_markers[0].is_change:
+                set_status("current_timecode_display", f"Not a patchwork marker", [250, 150, 50])
             
             else:
-                dpg.set_value("current_timecode_display", f"On marker: '{playhead_markers[0].name}'")
-                dpg.configure_item("current_timecode_display", color=[0, 255, 0])
+                set_status("current_timecode_display", f"On marker: '{playhead_markers[0].name}'", [0, 255, 0])
     else:
-        dpg.set_value("current_timecode_display", f"{current_timecode} | {current_frame}")
-        dpg.configure_item("current_timecode_display", color=[50, 150, 255])
+        set_status("current_timecode_display", f"{current_timecode} | {current_frame}", [50, 150, 255])
             
     await trio.sleep(0)
 
@@ -0,0 +1,159 @@
+"""
+Content-addressed store of rendered segments.
+
+A segment's key hashes everything that decides what it looks like: the fingerprint
+of the timeline under its range, the render settings and preset, and the range
+itself. Re-rendering a range whose content is back to an earlier state, like a
+reverted change, can reuse that render instead of going through Resolve again.
+Ranges holding hand-placed changes aren't cached, since the fingerprint can miss
+what they change.
+
+Entries are copies, so renders can be overwritten or deleted freely. The store is
+bounded by size and evicts least recently used entries, with recency kept in file
+modification times so it survives restarts.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+logger = logging.getLogger("rich")
+
+KEY_VERSION = 1
+
+
+def make_key(range_digest: str, settings_digests: dict, render_preset: str, start: int, end: int, kind: str = "full") -> str:
+    """
+    Key of a segment render.
+
+    Args:
+        range_digest (str): `fingerprint.range_digest` of the segment's range
+        settings_digests (dict): `patchfile.get_settings_digests` of the current settings
+        render_preset (str): Preset the segment renders with
+        start (int): First frame (inclusive)
+        end (int): Last frame (exclusive)
+        kind (str): What's rendered, see `submission.KINDS`
+    """
+
+    parts = [KEY_VERSION, range_digest, settings_digests, render_preset, start, end]
+
+    # Picture and sound renders keep the keys they had before partial renders
+    if kind != "full":
+        parts.append(kind)
+
+    encoded = json.dumps(parts, sort_keys=True).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class SegmentCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._size = 0
+        self._scanned = False
+
+    def __len__(self):
+        self._scan()
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        self._scan()
+        return self._size
+
+    def _scan(self):
+        # Deferred until first use, so startup doesn't list the store
+        if self._scanned:
+            return
+        self._scanned = True
+
+        if not os.path.isdir(self.directory):
+            return
+
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime_ns, entry.name.split(".")[0], entry.path, stat.st_size))
+
+        for _, key, path, size in sorted(found):
+            self._entries[key] = (path, size)
+            self._size += size
+
+    def get(self, key: str) -> str | None:
+        """Path of a cached segment, marking it recently used, or None"""
+
+        self._scan()
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+
+        path, _ = entry
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return path
+
+    def put(self, key: str, source: str) -> str | None:
+        """
+        Copy a rendered segment into the store.
+
+        Returns:
+            str | None: The cached path, or None if the segment doesn't fit
+        """
+
+        self._scan()
+        if key in self._entries:
+            return self.get(key)
+
+        size = os.path.getsize(source)
+        if size > self.max_bytes:
+            logger.debug(f"[magenta]Segment '{source}' is larger than the whole cache, not caching")
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        extension = os.path.splitext(source)[1]
+        path = os.path.join(self.directory, f"{key}{extension}")
+
+        # Copy under a temporary name, so a partial copy is never a hit
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=extension)
+        os.close(handle)
+        try:
+            shutil.copyfile(source, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self._entries[key] = (path, size)
+        self._size += size
+        self.evict()
+        return path
+
+    def _forget(self, key: str):
+        _, size = self._entries.pop(key)
+        self._size -= size
+
+    def evict(self):
+        """Remove least recently used segments until the store is within its size"""
+
+        self._scan()
+        while self._size > self.max_bytes and self._entries:
+            key, (path, _) = next(iter(self._entries.items()))
+            self._forget(key)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            logger.debug(f"[magenta]Evicted cached segment '{key}'")
@@ -0,0 +1,88 @@
+"""
+Immutable snapshots of Resolve's state, taken once per poll.
+
+Everything the GUI shows comes from one snapshot, built with a single round of API
+calls. Diffing consecutive snapshots tells the GUI which widgets need updating.
+"""
+
+import logging
+from types import MappingProxyType
+from typing import NamedTuple
+
+
+logger = logging.getLogger("rich")
+
+_no_markers = MappingProxyType({})
+
+
+class Snapshot(NamedTuple):
+    resolve_is_open: bool = False
+    project_name: str | None = None
+    timeline_name: str | None = None
+    frame_rate: str | None = None
+    timecode: str | None = None
+    markers: MappingProxyType = _no_markers
+
+    @property
+    def timeline_is_open(self) -> bool:
+        return self.timeline_name is not None
+
+    @property
+    def project_is_open(self) -> bool:
+        return self.project_name is not None
+
+
+CLOSED = Snapshot()
+
+
+def take(resolve=None, previous: Snapshot = CLOSED) -> Snapshot:
+    """
+    Read Resolve's current state.
+
+    Args:
+        resolve: A pydavinci Resolve instance. One is created if not given.
+        previous (Snapshot): The last snapshot. The frame rate is only re-read
+            when the timeline has changed since.
+
+    Returns:
+        Snapshot: The state. Fields Resolve couldn't provide are left as None.
+    """
+
+    # Imported here, pydavinci is slow to load and startup doesn't need it
+    from pydavinci import davinci
+    from pydavinci.exceptions import TimelineNotFound
+
+    project_name = None
+    try:
+        if resolve is None:
+            resolve = davinci.Resolve()
+        project_name = str(resolve.project.name)
+        timeline = resolve.active_timeline
+        timeline_name = str(timeline.name)
+
+    except TypeError:
+        return CLOSED
+
+    except TimelineNotFound:
+        return Snapshot(True, project_name)
+
+    frame_rate = previous.frame_rate
+    if project_name != previous.project_name or timeline_name != previous.timeline_name:
+        frame_rate = timeline.settings.frame_rate
+
+    raw_markers = timeline._obj.GetMarkers() or {}
+
+    return Snapshot(
+        True,
+        project_name,
+        timeline_name,
+        frame_rate,
+        timeline.timecode,
+        MappingProxyType({int(frame): data for frame, data in raw_markers.items()}),
+    )
+
+
+def diff(old: Snapshot, new: Snapshot) -> set[str]:
+    """Names of the fields that differ between two snapshots"""
+
+    return {field for field, a, b in zip(Snapshot._fields, old, new) if a != b}
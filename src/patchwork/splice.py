@@ -0,0 +1,295 @@
+"""
+Lossless splicing of rendered segments into a master file.
+
+Unchanged ranges are stream-copied from the master and re-rendered segments are
+dropped in between them with ffmpeg's concat demuxer. Nothing is re-encoded.
+
+Sound-only renders and subtitle files are remuxed against the picture instead.
+The concat demuxer needs every file to have the same streams, so sound is
+spliced on its own, from audio-only copies of the master and full segments.
+"""
+
+import logging
+import os
+import subprocess
+import tempfile
+from fractions import Fraction
+from typing import NamedTuple
+
+from patchwork import tracing
+
+logger = logging.getLogger("rich")
+
+# Resolve reports NTSC rates rounded, ffmpeg needs them exact
+NTSC_FRAME_RATES = {
+    "23.976": Fraction(24000, 1001),
+    "29.97": Fraction(30000, 1001),
+    "47.952": Fraction(48000, 1001),
+    "59.94": Fraction(60000, 1001),
+    "119.88": Fraction(120000, 1001),
+}
+
+
+# Bytes per packet when reading back extracted PCM, about 2 ms of stereo 24 bit
+WAV_BLOCK = 1024
+
+
+class SpliceError(Exception):
+    pass
+
+
+class Segment(NamedTuple):
+    """A rendered replacement for frames `start` (inclusive) to `end` (exclusive)"""
+
+    start: int
+    end: int
+    path: str
+
+
+class Piece(NamedTuple):
+    """A span of one input file in the spliced output. `None` bounds mean the whole file."""
+
+    path: str
+    inpoint: int | None = None
+    outpoint: int | None = None
+
+
+def parse_frame_rate(frame_rate) -> Fraction:
+    """Convert a Resolve frame rate (str, int or float) to an exact fraction"""
+
+    key = str(frame_rate)
+    if "." in key:
+        key = key.rstrip("0").rstrip(".")
+
+    if key in NTSC_FRAME_RATES:
+        return NTSC_FRAME_RATES[key]
+    return Fraction(str(frame_rate)).limit_denominator(1001)
+
+
+def frames_to_seconds(frames: int, frame_rate) -> str:
+    """Format a frame count as seconds for ffmpeg, with enough precision to land on the frame"""
+
+    seconds = Fraction(frames) / parse_frame_rate(frame_rate)
+    return f"{float(seconds):.6f}"
+
+
+def plan(master: str, segments: list[Segment]) -> list[Piece]:
+    """
+    Order the pieces of the patched master.
+
+    Args:
+        master (str): Path to the master file
+        segments (list[Segment]): Replacement segments, in any order
+
+    Raises:
+        SpliceError: If segments overlap or have an empty or negative range
+
+    Returns:
+        list[Piece]: Alternating master and segment pieces, in output order
+    """
+
+    pieces = []
+    cursor = 0
+    for segment in sorted(segments, key=lambda x: x.start):
+
+        if segment.end <= segment.start:
+            raise SpliceError(f"Segment '{segment.path}' has an empty range: {segment.start} -> {segment.end}")
+
+        if segment.start < cursor:
+            raise SpliceError(f"Segment '{segment.path}' overlaps the previous segment at frame {segment.start}")
+
+        if segment.start > cursor:
+            pieces.append(Piece(master, cursor, segment.start))
+
+        pieces.append(Piece(segment.path))
+        cursor = segment.end
+
+    # Everything after the last change
+    pieces.append(Piece(master, cursor, None))
+    return pieces
+
+
+def write_concat_list(pieces: list[Piece], frame_rate, list_file, demuxer_options: dict[str, dict] | None = None) -> None:
+    """
+    Write pieces as an ffconcat script to an open text file
+
+    Args:
+        demuxer_options (dict[str, dict], optional): Options to open files with, by path
+    """
+
+    demuxer_options = demuxer_options or {}
+    list_file.write("ffconcat version 1.0\n")
+    for piece in pieces:
+        escaped = os.path.abspath(piece.path).replace("'", "'\\''")
+        list_file.write(f"file '{escaped}'\n")
+        for key, value in demuxer_options.get(piece.path, {}).items():
+            list_file.write(f"option {key} {value}\n")
+        if piece.inpoint:
+            list_file.write(f"inpoint {frames_to_seconds(piece.inpoint, frame_rate)}\n")
+        if piece.outpoint is not None:
+            list_file.write(f"outpoint {frames_to_seconds(piece.outpoint, frame_rate)}\n")
+
+
+def splice(
+    master: str,
+    segments: list[Segment],
+    output: str,
+    frame_rate,
+    audio_segments: list[Segment] | None = None,
+    subtitles: str | None = None,
+) -> str:
+    """
+    Write a new master with the segments spliced in, stream-copying everything.
+
+    Segment boundaries must already sit on valid cut points for the master's codec.
+
+    Args:
+        master (str): Path to the existing master
+        segments (list[Segment]): Rendered replacement segments
+        output (str): Path of the new master. Must differ from `master`.
+        frame_rate: Timeline frame rate, as reported by Resolve
+        audio_segments (list[Segment], optional): Sound-only replacements, clear of `segments`
+        subtitles (str, optional): Subtitle file to replace the master's subtitles with
+
+    Raises:
+        SpliceError: On invalid segments, missing files or an ffmpeg failure
+
+    Returns:
+        str: The output path
+    """
+
+    if os.path.abspath(master) == os.path.abspath(output):
+        raise SpliceError("Can't splice over the master in place, choose another output path")
+
+    audio_segments = audio_segments or []
+    for path in [master, *[x.path for x in segments + audio_segments], *([subtitles] if subtitles else [])]:
+        if not os.path.exists(path):
+            raise SpliceError(f"Missing file: '{path}'")
+
+    logger.debug(f"[magenta]Splicing {len(segments)} segments and {len(audio_segments)} sound changes into '{master}'")
+    if audio_segments or subtitles:
+        remux(master, segments, audio_segments, subtitles, output, frame_rate)
+    else:
+        concat(plan(master, segments), output, frame_rate)
+
+    tracing.count_bytes("written", os.path.getsize(output), "splice")
+    logger.info(f"[green]Spliced {len(segments) + len(audio_segments)} changes into '{output}'")
+    return output
+
+
+def concat(pieces: list[Piece], output: str, frame_rate) -> str:
+    """
+    Stream-copy pieces of one or more files into a single output with ffmpeg.
+
+    Raises:
+        SpliceError: If ffmpeg is missing or fails
+    """
+
+    with tempfile.NamedTemporaryFile("w", suffix=".ffconcat", delete=False) as list_file:
+        write_concat_list(pieces, frame_rate, list_file)
+
+    command = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_file.name,
+        "-map", "0", "-c", "copy",
+        output,
+    ]
+
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except FileNotFoundError:
+        raise SpliceError("ffmpeg was not found on PATH")
+    except subprocess.CalledProcessError as e:
+        raise SpliceError(f"ffmpeg failed to splice:\n{e.stderr}")
+    finally:
+        os.remove(list_file.name)
+
+    return output
+
+
+def _run_ffmpeg(arguments: list[str], action: str):
+    command = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *arguments]
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except FileNotFoundError:
+        raise SpliceError("ffmpeg was not found on PATH")
+    except subprocess.CalledProcessError as e:
+        raise SpliceError(f"ffmpeg failed to {action}:\n{e.stderr}")
+
+
+def extract_audio(path: str, output_stem: str) -> str:
+    """
+    Copy a file's sound into an audio-only file, without re-encoding.
+
+    PCM goes in a WAV, which can be read back in small blocks (`WAV_BLOCK`) so the
+    concat demuxer cuts it within a few milliseconds. Anything WAV can't hold goes
+    in Matroska, and is cut on its own packets.
+
+    Returns:
+        str: Path of the audio-only file
+    """
+
+    try:
+        _run_ffmpeg(["-i", path, "-map", "0:a", "-c", "copy", f"{output_stem}.wav"], "copy out sound")
+        return f"{output_stem}.wav"
+    except SpliceError:
+        _run_ffmpeg(["-i", path, "-map", "0:a", "-c", "copy", f"{output_stem}.mka"], "copy out sound")
+        return f"{output_stem}.mka"
+
+
+def remux(master: str, segments: list[Segment], audio_segments: list[Segment], subtitles: str | None, output: str, frame_rate) -> str:
+    """
+    Splice picture and sound separately, and mux them with replacement subtitles.
+
+    Raises:
+        SpliceError: If ffmpeg is missing or fails
+    """
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        video_list = os.path.join(temp_dir, "video.ffconcat")
+        with open(video_list, "w") as list_file:
+            write_concat_list(plan(master, segments), frame_rate, list_file)
+
+        inputs = ["-f", "concat", "-safe", "0", "-i", video_list]
+        maps = ["-map", "0"]
+
+        if audio_segments:
+            # Sound from everything that isn't already sound only
+            extracted = {}
+            for i, path in enumerate(sorted({master, *[x.path for x in segments]})):
+                extracted[path] = extract_audio(path, os.path.join(temp_dir, str(i)))
+
+            audio_list = os.path.join(temp_dir, "audio.ffconcat")
+            with open(audio_list, "w") as list_file:
+                pieces = [x._replace(path=extracted.get(x.path, x.path)) for x in plan(master, segments + audio_segments)]
+                options = {x: {"max_size": WAV_BLOCK} for x in extracted.values() if x.endswith(".wav")}
+                write_concat_list(pieces, frame_rate, list_file, options)
+
+            inputs += ["-f", "concat", "-safe", "0", "-i", audio_list]
+            maps += ["-map", "-0:a", "-map", "1:a"]
+
+        codecs = ["-c", "copy"]
+        if subtitles:
+            inputs += ["-i", subtitles]
+            maps += ["-map", "-0:s", "-map", f"{2 if audio_segments else 1}:s"]
+
+            # QuickTime and MP4 only take their own text format
+            if os.path.splitext(output)[1].lower() in (".mov", ".mp4", ".m4v"):
+                codecs += ["-c:s", "mov_text"]
+
+        _run_ffmpeg([*inputs, *maps, *codecs, output], "remux")
+
+    return output
+
+
+def patched_output_path(master: str) -> str:
+    """Choose a path for the patched master beside the original, without overwriting anything"""
+
+    stem, ext = os.path.splitext(master)
+    candidate = f"{stem} - patched{ext}"
+    count = 1
+    while os.path.exists(candidate):
+        count += 1
+        candidate = f"{stem} - patched {count}{ext}"
+    return candidate
@@ -0,0 +1,162 @@
+"""
+Planning and queuing of change renders.
+
+Every job pays Resolve's start-up cost and every segment adds two cuts to the
+splice, so changes a few frames apart are cheaper to render as one job, unchanged
+gap included. Jobs are recorded with the key of what they render
+(`segment_cache.make_key`), so submitting again reuses jobs that are already
+queued, rendering or done instead of queuing duplicates. Finished renders of
+hand-placed changes are queued again, the fingerprint can't tell if they're stale.
+
+Changes are rendered by the tracks they touch. A mix note only needs sound, which
+Resolve renders in seconds, and is remuxed against the master's untouched picture.
+Subtitles are rendered once for the whole timeline, as a file to remux.
+"""
+
+import logging
+import os
+
+from patchwork import jobs
+from patchwork.keyframes import merge_ranges
+
+logger = logging.getLogger("rich")
+
+FULL = "full"
+AUDIO = "audio"
+SUBTITLE = "subtitle"
+KINDS = (FULL, AUDIO, SUBTITLE)
+
+# Set on top of the preset for each kind of render
+RENDER_SETTINGS = {
+    FULL: {},
+    AUDIO: {"ExportVideo": False, "ExportAudio": True},
+    SUBTITLE: {"ExportVideo": False, "ExportAudio": False, "ExportSubtitle": True, "SubtitleFormat": "SeparateFile"},
+}
+
+
+def coalesce(ranges: list[tuple[int, int, str]], gap: int) -> list[tuple[int, int, str]]:
+    """
+    Merge ranges that overlap or are at most `gap` frames apart, joining their labels.
+
+    Args:
+        ranges (list[tuple[int, int, str]]): `(start, end, label)`, end exclusive
+        gap (int): Largest gap worth rendering to save a job
+    """
+
+    merged = []
+    for start, end, label in merge_ranges(ranges):
+        if merged and start - merged[-1][1] <= gap:
+            last_start, last_end, last_label = merged[-1]
+            merged[-1] = (last_start, max(last_end, end), f"{last_label} + {label}")
+        else:
+            merged.append((start, end, label))
+    return merged
+
+
+def get_kind(track_types: set[str], detected: bool = True) -> str:
+    """
+    What to render for a change, from the types of track it touches.
+
+    Only detected changes can render less than everything. A change marked by
+    hand can hold a picture change the fingerprint can't see, like a grade tweak,
+    so it's rendered in full, as is any change that doesn't show up in a track.
+    """
+
+    if not detected or "video" in track_types or not track_types:
+        return FULL
+    if "audio" in track_types:
+        return AUDIO
+    return SUBTITLE
+
+
+def get_reusable(project, previous_segments: list[dict], hand_placed: frozenset = frozenset()) -> dict[str, dict]:
+    """
+    Previously submitted segments that don't need queuing again, by key.
+
+    A segment is reusable while its job is still in Resolve's queue and hasn't
+    failed or been cancelled. Once complete, its render has to still exist.
+
+    Args:
+        hand_placed (frozenset): Keys of ranges holding hand-placed changes. They're
+            only reused while their job hasn't finished, since a finished render can
+            predate an edit the fingerprint can't see.
+    """
+
+    reusable = {}
+    for segment in previous_segments:
+        key = segment.get("cache_key")
+        if not key:
+            continue
+
+        if segment.get("cached"):
+            if key not in hand_placed and os.path.exists(segment["path"]):
+                reusable[key] = segment
+            continue
+
+        status = jobs.get_job_status(project, segment["job_id"]).get("JobStatus")
+        if not status or status in (jobs.FAILED, jobs.CANCELLED):
+            continue
+        if status == jobs.COMPLETE and (key in hand_placed or not os.path.exists(segment["path"])):
+            continue
+        reusable[key] = segment
+
+    return reusable
+
+
+def submit(project, planned: list[tuple[int, int, str, str | None, str]], render_preset: str, target_dir: str, name: str) -> list[dict]:
+    """
+    Queue a render job per planned range.
+
+    The preset is loaded once per kind of render; only the range and name
+    change between jobs.
+
+    Args:
+        planned (list[tuple[int, int, str, str | None, str]]): `(start, end, label, key, kind)`
+        name (str): Prefix of each render's file name
+
+    Returns:
+        list[dict]: Segments as recorded in the patch file, in the order given
+    """
+
+    if not planned:
+        return []
+
+    segments = {}
+    for kind in KINDS:
+
+        batch = [(i, x) for i, x in enumerate(planned) if x[4] == kind]
+        if not batch:
+            continue
+
+        project.load_render_preset(render_preset)
+        project.set_render_settings(RENDER_SETTINGS[kind])
+        extension = "srt" if kind == SUBTITLE else project.current_render_format_and_codec["format"]
+
+        for i, (start, end, label, key, _) in batch:
+
+            # Long runs of merged changes would make for unwieldy file names
+            parts = label.split(" + ")
+            if len(parts) > 2:
+                label = f"{parts[0]} to {parts[-1]}"
+
+            # A change's sound mustn't overwrite its full render
+            custom_name = f"{name} {label} audio" if kind == AUDIO else f"{name} {label}"
+            project.set_render_settings(
+                {
+                    "MarkIn": start,
+                    "MarkOut": end - 1, # Resolve's mark out is inclusive
+                    "TargetDir": target_dir,
+                    "CustomName": custom_name,
+                }
+            )
+            segments[i] = {
+                "start": start,
+                "end": end,
+                "path": os.path.join(target_dir, f"{custom_name}.{extension}"),
+                "job_id": project.add_renderjob(),
+                "cache_key": key,
+                "kind": kind,
+            }
+
+    logger.debug(f"[magenta]Queued {len(segments)} render jobs with preset '{render_preset}'")
+    return [segments[i] for i in range(len(planned))]
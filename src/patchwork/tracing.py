@@ -0,0 +1,338 @@
+"""
+Stage timing and counters for the patch pipeline.
+
+Stages run inside spans, which are written as one JSON line each to a rotating
+trace file. Spans nest, so a trace shows where a patch run spent its time.
+Counters (Resolve calls and their latency, bytes read and written) and span
+timings are aggregated in memory, and written as OpenMetrics text on exit.
+
+Tracing is off unless turned on in defaults.toml or with `patchwork --trace`.
+While it's off, `span` hands back a shared no-op context manager, counters return
+straight away and Resolve isn't wrapped, so instrumented code costs next to nothing.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+logger = logging.getLogger("rich")
+
+# Spans go to their own logger, which only writes to the trace file
+trace_logger = logging.getLogger("patchwork.trace")
+trace_logger.propagate = False
+
+enabled = False
+trace_dir = None
+
+# Set by the first `configure`, so a later one can't override `--no-trace`
+_configured = False
+
+_NO_SPAN = contextlib.nullcontext()
+_run_id = os.urandom(6).hex()
+_span_ids = itertools.count(1)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Guards the metrics, Resolve is polled from a worker thread
+_lock = threading.Lock()
+_counters = {}
+_summaries = {}
+_help = {
+    "patchwork_stage_seconds": ("summary", "Time spent in each pipeline stage"),
+    "patchwork_resolve_calls": ("counter", "Calls made to Resolve's scripting API"),
+    "patchwork_resolve_call_seconds": ("summary", "Latency of calls to Resolve's scripting API"),
+    "patchwork_bytes": ("counter", "Bytes read and written"),
+    "patchwork_cache_lookups": ("counter", "Async cache lookups, by whether they hit"),
+}
+
+
+def configure(enable: bool | None = None, directory: str | None = None):
+    """
+    Turn tracing on if asked to, from here or defaults.toml's [tracing].
+
+    Only the first call without `enable` reads defaults.toml, so the GUI started
+    by the CLI keeps its `--trace/--no-trace`.
+
+    Args:
+        enable (bool, optional): Trace, `enabled` in defaults.toml if not given
+        directory (str, optional): Where the trace and metrics go, `directory` in
+            defaults.toml if not given, else the cache folder
+    """
+
+    from patchwork.config import cache_dir
+    from patchwork.config import default_configuration as defaults
+
+    global enabled, trace_dir, _configured
+    if enable is None and _configured:
+        return
+    _configured = True
+
+    settings = defaults.get("tracing", {})
+    enable = settings.get("enabled", False) if enable is None else enable
+    if not enable:
+        return
+
+    trace_dir = directory or settings.get("directory") or os.path.join(cache_dir, "traces")
+    os.makedirs(trace_dir, exist_ok=True)
+
+    handler = logging.handlers.RotatingFileHandler(
+        os.path.join(trace_dir, "trace.jsonl"),
+        maxBytes=int(settings.get("max_mb", 10) * 1024**2),
+        backupCount=settings.get("backups", 5),
+        encoding="utf-8",
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.handlers = [handler]
+    trace_logger.setLevel(logging.INFO)
+
+    if not enabled:
+        atexit.register(write_metrics)
+    enabled = True
+    logger.debug(f"[magenta]Tracing to '{trace_dir}'")
+
+
+class Span:
+    """A timed stage, written to the trace file when it ends"""
+
+    __slots__ = ("name", "attributes", "id", "parent", "started", "_perf_started", "_token")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.id = next(_span_ids)
+
+    def set(self, **attributes):
+        """Add attributes found out during the stage, e.g. how many segments it spliced"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self.id)
+        self.started = time.time()
+        self._perf_started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._perf_started
+        _current_span.reset(self._token)
+
+        record = {
+            "run": _run_id,
+            "span": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "start": self.started,
+            "duration_ms": round(duration * 1000, 3),
+            **self.attributes,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+
+        trace_logger.info(json.dumps(record, default=str))
+        observe("patchwork_stage_seconds", duration, stage=self.name)
+        return False
+
+
+def span(name: str, **attributes):
+    """
+    Time a stage: `with tracing.span("splice", segments=3):`
+
+    Returns:
+        A Span, or a no-op context manager while tracing is off
+    """
+
+    if not enabled:
+        return _NO_SPAN
+    return Span(name, attributes)
+
+
+def traced(name: str):
+    """Time every call of a function as a stage"""
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: float = 1, **labels):
+    """Add to a counter"""
+
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """Add a measurement to a summary"""
+
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        total, measurements = _summaries.get(key, (0.0, 0))
+        _summaries[key] = (total + value, measurements + 1)
+
+
+def count_bytes(direction: str, value: int, source: str):
+    """Count bytes `read` or `written`, by what read or wrote them"""
+    count("patchwork_bytes", value, direction=direction, source=source)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def metrics_text() -> str:
+    """Counters and summaries so far, in the OpenMetrics text format"""
+
+    with _lock:
+        counters = dict(_counters)
+        summaries = dict(_summaries)
+
+    lines = []
+    for name in sorted({x for x, _ in counters} | {x for x, _ in summaries}):
+        kind, description = _help.get(name, ("counter" if any(x == name for x, _ in counters) else "summary", ""))
+        lines.append(f"# TYPE {name} {kind}")
+        if description:
+            lines.append(f"# HELP {name} {description}")
+
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}_total{_format_labels(labels)} {value}")
+
+        for (metric, labels), (total, measurements) in sorted(summaries.items()):
+            if metric == name:
+                lines.append(f"{name}_count{_format_labels(labels)} {measurements}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: str | None = None) -> str | None:
+    """
+    Write the metrics out, to `metrics.txt` beside the trace file if no path is given.
+
+    Returns:
+        str | None: Where they were written, None while tracing is off
+    """
+
+    if not enabled:
+        return None
+
+    path = path or os.path.join(trace_dir, "metrics.txt")
+    with open(path, "w", encoding="utf-8") as metrics_file:
+        metrics_file.write(metrics_text())
+    return path
+
+
+def _is_resolve_object(value) -> bool:
+    """pydavinci wrappers and Resolve's own objects, or the fake standing in for them"""
+
+    kind = type(value)
+    return kind.__module__.startswith(("pydavinci", "patchwork.fake_resolve")) or kind.__name__ == "PyRemoteObject"
+
+
+def _traced_result(value):
+    if _is_resolve_object(value):
+        return TracedResolve(value)
+    if type(value) is list and any(_is_resolve_object(x) for x in value):
+        return [TracedResolve(x) if _is_resolve_object(x) else x for x in value]
+    return value
+
+
+class TracedResolve:
+    """
+    Counts and times calls to a Resolve object, and to the objects it hands back.
+
+    Property reads count as calls, since pydavinci's properties call the API.
+    """
+
+    __slots__ = ("_target",)
+
+    def __init__(self, target):
+        object.__setattr__(self, "_target", target)
+
+    def __getattr__(self, name: str):
+        target = object.__getattribute__(self, "_target")
+        if name.startswith("_") and name != "_obj":
+            return getattr(target, name)
+
+        call = f"{type(target).__name__}.{name}"
+        started = time.perf_counter()
+        try:
+            value = getattr(target, name)
+        except Exception:
+            _record_call(call, time.perf_counter() - started)
+            raise
+
+        # Fetching a method isn't a call, calling it is. Raw API methods only exist
+        # once fetched, so this goes by what came back rather than by the class.
+        if callable(value) and not _is_resolve_object(value):
+            return _traced_method(call, value)
+
+        if name != "_obj":
+            _record_call(call, time.perf_counter() - started)
+        return _traced_result(value)
+
+    def __setattr__(self, name: str, value):
+        setattr(object.__getattribute__(self, "_target"), name, value)
+
+    def __eq__(self, other):
+        target = object.__getattribute__(self, "_target")
+        if isinstance(other, TracedResolve):
+            other = object.__getattribute__(other, "_target")
+        return target == other
+
+    def __hash__(self):
+        return hash(object.__getattribute__(self, "_target"))
+
+    def __repr__(self):
+        return f"TracedResolve({object.__getattribute__(self, '_target')!r})"
+
+
+def _traced_method(call: str, method):
+
+    @functools.wraps(method)
+    def traced(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return _traced_result(method(*args, **kwargs))
+        finally:
+            _record_call(call, time.perf_counter() - started)
+
+    return traced
+
+
+def _record_call(call: str, seconds: float):
+    count("patchwork_resolve_calls", call=call)
+    observe("patchwork_resolve_call_seconds", seconds, call=call)
+
+
+def trace_resolve(resolve):
+    """Count and time calls to Resolve while tracing, otherwise hand it back untouched"""
+
+    if not enabled or resolve is None or isinstance(resolve, TracedResolve):
+        return resolve
+    return TracedResolve(resolve)